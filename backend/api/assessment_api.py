@@ -1,9 +1,15 @@
 from fastapi import APIRouter, HTTPException, Body, Query, Response
 from services.assessment import AssessmentService
+from services.deadline import DeadlineExceeded
+from services.session_store import get_session_store
+from models.session_models import AssessmentSessionRequest, SessionRequest, SessionTurnRequest
+from api.streaming import structured_sse, sse_response
+from api.sessions import create_session, load_session, record_stream, save_session, user_turn
 from typing import List, Dict
 
 router = APIRouter(prefix="/api/assessment", tags=["assessment"])
 assessment_service = AssessmentService()
+session_store = get_session_store()
 
 @router.post("/initial-chat")
 async def chat_with_ai(
@@ -27,11 +33,29 @@ async def chat_with_ai(
                 response.headers["X-Completion-Tokens"] = str(usage["completion_tokens"])
             if "total_tokens" in usage:
                 response.headers["X-Total-Tokens"] = str(usage["total_tokens"])
+            if "cached_tokens" in usage:
+                response.headers["X-Cached-Tokens"] = str(usage["cached_tokens"])
         return result
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/initial-chat/stream")
+async def chat_with_ai_stream(
+    messages: List[Dict] = Body(...),
+    native_lang: str = Query("", description="用户母语，默认为cmn-CN（中文）"),
+    learning_lang: str = Query("en-US", description="学习语言，默认为en-US（英语）")
+):
+    """
+    流式版本的 /initial-chat，以 Server-Sent Events 返回，每句 speechText 完成即推送 sentence 事件，
+    最后的 done 事件字段与 /initial-chat 的返回相同（含 usage）
+    """
+    events = assessment_service.conduct_initial_assessment_stream(messages, native_lang, learning_lang)
+    return sse_response(structured_sse(events, lambda result: result))
+
+
 @router.post("/total-plan-chat")
 async def chat_with_ai(
     response: Response,
@@ -54,7 +78,11 @@ async def chat_with_ai(
                 response.headers["X-Completion-Tokens"] = str(usage["completion_tokens"])
             if "total_tokens" in usage:
                 response.headers["X-Total-Tokens"] = str(usage["total_tokens"])
+            if "cached_tokens" in usage:
+                response.headers["X-Cached-Tokens"] = str(usage["cached_tokens"])
         return result
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -81,7 +109,11 @@ async def analyze_user_profile(
                 response.headers["X-Completion-Tokens"] = str(usage["completion_tokens"])
             if "total_tokens" in usage:
                 response.headers["X-Total-Tokens"] = str(usage["total_tokens"])
+            if "cached_tokens" in usage:
+                response.headers["X-Cached-Tokens"] = str(usage["cached_tokens"])
         return profile
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
@@ -107,7 +139,11 @@ async def generate_total_plan(
                 response.headers["X-Completion-Tokens"] = str(usage["completion_tokens"])
             if "total_tokens" in usage:
                 response.headers["X-Total-Tokens"] = str(usage["total_tokens"])
+            if "cached_tokens" in usage:
+                response.headers["X-Cached-Tokens"] = str(usage["cached_tokens"])
         return total_plan
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -133,8 +169,109 @@ async def generate_weekly_plan(
                 response.headers["X-Completion-Tokens"] = str(usage["completion_tokens"])
             if "total_tokens" in usage:
                 response.headers["X-Total-Tokens"] = str(usage["total_tokens"])
+            if "cached_tokens" in usage:
+                response.headers["X-Cached-Tokens"] = str(usage["cached_tokens"])
         return weekly_plan['content']
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def set_usage_headers(response: Response, result: Dict) -> None:
+    usage = result.pop("usage", None)
+    if usage and isinstance(usage, dict):
+        # Add usage information to response headers
+        if "prompt_tokens" in usage:
+            response.headers["X-Prompt-Tokens"] = str(usage["prompt_tokens"])
+        if "completion_tokens" in usage:
+            response.headers["X-Completion-Tokens"] = str(usage["completion_tokens"])
+        if "total_tokens" in usage:
+            response.headers["X-Total-Tokens"] = str(usage["total_tokens"])
+        if "cached_tokens" in usage:
+            response.headers["X-Cached-Tokens"] = str(usage["cached_tokens"])
+
+
+def session_reply(result: Dict) -> Dict:
+    """保存到会话中的 AI 回复，与客户端上传的 messages 中的格式相同"""
+    return {"role": "assistant", "content": result.get("content", "")}
+
+
+@router.post("/session")
+async def create_assessment_session(
+    request: AssessmentSessionRequest,
+    native_lang: str = Query("", description="用户母语，默认为cmn-CN（中文）"),
+    learning_lang: str = Query("en-US", description="学习语言，默认为en-US（英语）")
+):
+    """
+    创建服务端保存的评估会话，已有的对话只上传一次，之后每轮只发送 session_id 和 user_input；
+    /initial-chat 和 /total-plan-chat 是两段不同的对话，各自创建会话
+    """
+    return await create_session(session_store, "assessment", native_lang, learning_lang, request.messages)
+
+
+@router.get("/session/{session_id}")
+async def get_assessment_session(session_id: str):
+    session = await load_session(session_store, session_id, "assessment")
+    return {"session_id": session_id, "messages": session["messages"]}
+
+
+@router.delete("/session/{session_id}")
+async def delete_assessment_session(session_id: str):
+    await session_store.delete(session_id)
+    return {"deleted": True}
+
+
+async def session_turn(request: SessionTurnRequest, response: Response, conduct) -> Dict:
+    """一轮评估对话：对话历史从会话中读取，成功后把这一轮追加到会话中"""
+    async with session_store.lock(request.session_id):
+        session = await load_session(session_store, request.session_id, "assessment")
+        history = session["messages"] + user_turn(request.user_input)
+        try:
+            result = await conduct(history, session["native_lang"], session["learning_lang"])
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        session["messages"] = history + [session_reply(result)]
+        await save_session(session_store, session)
+    set_usage_headers(response, result)
+    return result
+
+
+@router.post("/session/initial-chat")
+async def session_initial_chat(request: SessionTurnRequest, response: Response):
+    """与 /initial-chat 相同，对话历史保存在会话中"""
+    return await session_turn(request, response, assessment_service.conduct_initial_assessment)
+
+
+@router.post("/session/initial-chat/stream")
+async def session_initial_chat_stream(request: SessionTurnRequest):
+    """流式版本的 /session/initial-chat，done 事件之后这一轮的对话才会保存到会话中"""
+    await load_session(session_store, request.session_id, "assessment")
+
+    def run(session: Dict, history: List[Dict]):
+        return assessment_service.conduct_initial_assessment_stream(history, session["native_lang"], session["learning_lang"])
+
+    events = record_stream(session_store, request.session_id, "assessment", request.user_input, run, session_reply)
+    return sse_response(structured_sse(events, lambda result: result))
+
+
+@router.post("/session/total-plan-chat")
+async def session_total_plan_chat(request: SessionTurnRequest, response: Response):
+    """与 /total-plan-chat 相同，对话历史保存在会话中"""
+    return await session_turn(request, response, assessment_service.conduct_generate_total_plan)
+
+
+@router.post("/session/analyze-profile")
+async def session_analyze_profile(request: SessionRequest, response: Response):
+    """与 /analyze-profile 相同，分析会话中保存的评估对话"""
+    session = await load_session(session_store, request.session_id, "assessment")
+    try:
+        profile = await assessment_service.analyze_assessment(session["messages"], session["native_lang"], session["learning_lang"])
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    set_usage_headers(response, profile)
+    return profile
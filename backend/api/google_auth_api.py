@@ -1,5 +1,6 @@
 from fastapi import APIRouter, HTTPException, Depends, Body
 from typing import Dict, Any
+import logging
 import sys
 import os
 
@@ -9,6 +10,8 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 # 直接导入
 from services.google_auth import GoogleAuthService
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
 @router.post("/get-google-user-info")
@@ -23,7 +26,7 @@ async def get_google_user_info(request_data: dict = Body(...)):
         if not token:
             raise ValueError("请求中缺少access_token参数")
         
-        print(f"[INFO] 收到令牌，尝试验证")
+        logger.debug("收到令牌，尝试验证")
         
         # 初始化Google验证服务
         google_auth = GoogleAuthService()
@@ -1,11 +1,19 @@
 import logging
 from fastapi import APIRouter, HTTPException, Body, Query, Response
-from typing import Dict, List
+from typing import Dict, List, Optional
 from services.lesson import LessonService, LessonMode
+from services.lesson_steps import LessonStepEngine
+from services.deadline import DeadlineExceeded
+from services.session_store import get_session_store
 from models.lesson_models import Message, CreateLessonRequest, ChatRequest, SummaryLessonRequest
+from models.session_models import LessonSessionRequest, SessionTurnRequest
+from api.streaming import structured_sse, sse_response
+from api.sessions import create_session, load_session, record_stream, save_session
 
 router = APIRouter(prefix="/api/lesson", tags=["lesson"])
 lesson_service = LessonService()
+step_engine = LessonStepEngine(lesson_service)
+session_store = get_session_store()
 logger = logging.getLogger(__name__)
 
 
@@ -14,14 +22,15 @@ async def create_lesson(
     request: CreateLessonRequest,
     response: Response,
     native_lang: str = Query("cmn-CN", description="用户母语，默认为cmn-CN（中文）"),
-    learning_lang: str = Query("en-US", description="学习语言，默认为en-US（英语）")
+    learning_lang: str = Query("en-US", description="学习语言，默认为en-US（英语）"),
+    steps: bool = Query(False, description="学习模式时同时把课程编排为步骤，返回的 steps 用于创建按步骤进行的会话（/session）")
 ):
     """创建一个新的课程场景，返回初始化的课程信息和系统提示"""
     try: 
         if not request.lesson_info:
             raise HTTPException(status_code=400, detail="requires lesson_info data")
         
-        result = await lesson_service.create_lesson(request, native_lang, learning_lang)
+        result = await lesson_service.create_lesson(request, native_lang, learning_lang, steps=steps)
         usage = result.pop("usage", None)
         if usage and isinstance(usage, dict):
             # Add usage information to response headers
@@ -31,19 +40,37 @@ async def create_lesson(
                 response.headers["X-Completion-Tokens"] = str(usage["completion_tokens"])
             if "total_tokens" in usage:
                 response.headers["X-Total-Tokens"] = str(usage["total_tokens"])
+            if "cached_tokens" in usage:
+                response.headers["X-Cached-Tokens"] = str(usage["cached_tokens"])
         return result
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         logger.error(f"Error creating lesson: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+
+DIAGNOSE_QUERY = Query(None, description="inline：诊断与回复在同一次调用中生成；split：只生成回复，诊断见 /diagnose。默认为 LESSON_DIAGNOSE_MODE")
+
+
+def check_diagnose_mode(diagnose: Optional[str]) -> None:
+    if diagnose is not None and diagnose.lower() not in LessonService.DIAGNOSE_MODES:
+        raise HTTPException(status_code=400, detail=f"diagnose must be one of {', '.join(LessonService.DIAGNOSE_MODES)}")
+
+
 @router.post("/chat")
 async def chat(
     request: ChatRequest,
     response: Response,
     native_lang: str = Query("cmn-CN", description="用户母语，默认为cmn-CN（中文）"),
-    learning_lang: str = Query("en-US", description="学习语言，默认为en-US（英语）")
+    learning_lang: str = Query("en-US", description="学习语言，默认为en-US（英语）"),
+    diagnose: Optional[str] = DIAGNOSE_QUERY
 ):
-    """进行对话交互，需要传入完整的课程信息和对话历史"""
+    """
+    进行对话交互，需要传入完整的课程信息和对话历史
+    diagnose 为 split 时返回的 diagnose 为 null，客户端可以同时请求 /diagnose 获取诊断
+    """
+    check_diagnose_mode(diagnose)
     try:
         if not request.user_input:
             raise HTTPException(
@@ -67,7 +94,8 @@ async def chat(
             user_message=request.user_input,
             conversation_history=messages,
             native_lang=native_lang,
-            learning_lang=learning_lang
+            learning_lang=learning_lang,
+            diagnose=diagnose
         )
 
         content = "".join(result.get("speechText", result.get("content")))
@@ -80,6 +108,8 @@ async def chat(
                 response.headers["X-Completion-Tokens"] = str(usage["completion_tokens"])
             if "total_tokens" in usage:
                 response.headers["X-Total-Tokens"] = str(usage["total_tokens"])
+            if "cached_tokens" in usage:
+                response.headers["X-Cached-Tokens"] = str(usage["cached_tokens"])
                 
         assistant_message = {
             "role": "assistant",
@@ -90,11 +120,231 @@ async def chat(
         }
         
         return assistant_message
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         logger.error(f"Chat error: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/chat/stream")
+async def chat_stream(
+    request: ChatRequest,
+    native_lang: str = Query("cmn-CN", description="用户母语，默认为cmn-CN（中文）"),
+    learning_lang: str = Query("en-US", description="学习语言，默认为en-US（英语）"),
+    diagnose: Optional[str] = DIAGNOSE_QUERY
+):
+    """
+    流式版本的 /chat，以 Server-Sent Events 返回 token/sentence/field 事件，
+    最后的 done 事件字段与 /chat 的返回相同，另加 usage；
+    diagnose 为 split 时诊断与回复同时生成，以单独的 diagnose 事件返回（在 done 之前或之后）
+    """
+    check_diagnose_mode(diagnose)
+    if not request.user_input:
+        raise HTTPException(
+            status_code=400,
+            detail="Missing required fields: user_input"
+        )
+
+    events = lesson_service.conduct_lesson_stream(
+        request.lesson.dict(),
+        user=request.user,
+        user_message=request.user_input,
+        conversation_history=[msg.dict() for msg in request.conversation_history],
+        native_lang=native_lang,
+        learning_lang=learning_lang,
+        diagnose=diagnose
+    )
+    return sse_response(structured_sse(events, format_chat_done))
+
+
+def format_chat_done(result: Dict) -> Dict:
+    """流式 done 事件的内容，与 /chat 的返回格式一致"""
+    speech_text = result.get("speechText")
+    return {
+        "role": "assistant",
+        "content": "".join(speech_text) if isinstance(speech_text, list) else (speech_text or ""),
+        "speechText": speech_text,
+        "displayText": result.get("displayText", ""),
+        "diagnose": result.get("diagnose", ""),
+        "usage": result.get("usage")
+    }
     
 
+@router.post("/diagnose")
+async def diagnose_turn(
+    request: ChatRequest,
+    response: Response,
+    native_lang: str = Query("cmn-CN", description="用户母语，默认为cmn-CN（中文）"),
+    learning_lang: str = Query("en-US", description="学习语言，默认为en-US（英语）")
+):
+    """
+    诊断 user_input（学习者的最后一句话），请求体与 /chat 相同，只使用最近几条对话作为上下文；
+    配合 diagnose=split 的 /chat 使用，两个请求可以同时发出
+    """
+    if not request.user_input:
+        raise HTTPException(
+            status_code=400,
+            detail="Missing required fields: user_input"
+        )
+    try:
+        result = await lesson_service.diagnose_turn(
+            request.user_input,
+            [msg.dict() for msg in request.conversation_history],
+            native_lang,
+            learning_lang
+        )
+        usage = result.pop("usage", None)
+        if usage and isinstance(usage, dict):
+            # Add usage information to response headers
+            if "prompt_tokens" in usage:
+                response.headers["X-Prompt-Tokens"] = str(usage["prompt_tokens"])
+            if "completion_tokens" in usage:
+                response.headers["X-Completion-Tokens"] = str(usage["completion_tokens"])
+            if "total_tokens" in usage:
+                response.headers["X-Total-Tokens"] = str(usage["total_tokens"])
+            if "cached_tokens" in usage:
+                response.headers["X-Cached-Tokens"] = str(usage["cached_tokens"])
+        return result
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        logger.error(f"Diagnose error: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/session")
+async def create_lesson_session(
+    request: LessonSessionRequest,
+    native_lang: str = Query("cmn-CN", description="用户母语，默认为cmn-CN（中文）"),
+    learning_lang: str = Query("en-US", description="学习语言，默认为en-US（英语）")
+):
+    """
+    创建服务端保存的课程会话，课程信息和已有的对话只上传一次，
+    之后通过 /session/chat 每轮只发送 session_id 和 user_input；
+    带 steps（/create?steps=true 的返回）时按步骤进行课程，讲解性的步骤不调用模型，见 services/lesson_steps.py
+    """
+    if request.steps:
+        steps = {"steps": [step.model_dump() for step in request.steps], "step_state": LessonStepEngine.initial_state()}
+    else:
+        steps = {}
+    return await create_session(
+        session_store, "lesson", native_lang, learning_lang,
+        [msg.model_dump(exclude_none=True) for msg in request.conversation_history],
+        lesson=request.lesson.model_dump(), user=request.user, **steps
+    )
+
+
+@router.get("/session/{session_id}")
+async def get_lesson_session(session_id: str):
+    """会话中保存的课程信息和对话历史（客户端恢复课程时使用）"""
+    session = await load_session(session_store, session_id, "lesson")
+    return {"session_id": session_id, "lesson": session["lesson"], "conversation_history": session["messages"],
+            "steps": session.get("steps"), "step_state": session.get("step_state")}
+
+
+@router.delete("/session/{session_id}")
+async def delete_lesson_session(session_id: str):
+    await session_store.delete(session_id)
+    return {"deleted": True}
+
+
+def session_reply(result: Dict) -> Dict:
+    """保存到会话中的老师回复，与客户端上传的 conversation_history 中的格式相同"""
+    speech_text = result.get("speechText")
+    return {
+        "role": "assistant",
+        "content": "".join(speech_text) if isinstance(speech_text, list) else (speech_text or ""),
+        "speechText": speech_text,
+        "displayText": result.get("displayText", "")
+    }
+
+
+@router.post("/session/chat")
+async def session_chat(
+    request: SessionTurnRequest,
+    response: Response,
+    diagnose: Optional[str] = DIAGNOSE_QUERY
+):
+    """
+    与 /chat 相同，课程信息和对话历史从会话中读取，这一轮的对话成功后追加到会话中；
+    按步骤进行的会话由 LessonStepEngine 处理，讲解性的步骤不调用模型（没有 usage）
+    """
+    check_diagnose_mode(diagnose)
+    if not request.user_input:
+        raise HTTPException(
+            status_code=400,
+            detail="Missing required fields: user_input"
+        )
+    async with session_store.lock(request.session_id):
+        session = await load_session(session_store, request.session_id, "lesson")
+        history = session["messages"] + [{"role": "user", "content": request.user_input}]
+        try:
+            if session.get("steps"):
+                result = await step_engine.turn(session, history, request.user_input, diagnose)
+            else:
+                result = await lesson_service.conduct_lesson(
+                    session["lesson"],
+                    user=session["user"],
+                    user_message=request.user_input,
+                    conversation_history=history,
+                    native_lang=session["native_lang"],
+                    learning_lang=session["learning_lang"],
+                    diagnose=diagnose
+                )
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.error(f"Session chat error: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail=str(e))
+        session["messages"] = history + [session_reply(result)]
+        await save_session(session_store, session)
+
+    usage = result.pop("usage", None)
+    if usage and isinstance(usage, dict):
+        # Add usage information to response headers
+        if "prompt_tokens" in usage:
+            response.headers["X-Prompt-Tokens"] = str(usage["prompt_tokens"])
+        if "completion_tokens" in usage:
+            response.headers["X-Completion-Tokens"] = str(usage["completion_tokens"])
+        if "total_tokens" in usage:
+            response.headers["X-Total-Tokens"] = str(usage["total_tokens"])
+        if "cached_tokens" in usage:
+            response.headers["X-Cached-Tokens"] = str(usage["cached_tokens"])
+    return {**session_reply(result), "diagnose": result.get("diagnose", "")}
+
+
+@router.post("/session/chat/stream")
+async def session_chat_stream(
+    request: SessionTurnRequest,
+    diagnose: Optional[str] = DIAGNOSE_QUERY
+):
+    """流式版本的 /session/chat，事件与 /chat/stream 相同，done 事件之后这一轮的对话才会保存到会话中"""
+    check_diagnose_mode(diagnose)
+    if not request.user_input:
+        raise HTTPException(
+            status_code=400,
+            detail="Missing required fields: user_input"
+        )
+    await load_session(session_store, request.session_id, "lesson")
+
+    def run(session: Dict, history: List[Dict]):
+        if session.get("steps"):
+            return step_engine.turn_stream(session, history, request.user_input, diagnose)
+        return lesson_service.conduct_lesson_stream(
+            session["lesson"],
+            user=session["user"],
+            user_message=request.user_input,
+            conversation_history=history,
+            native_lang=session["native_lang"],
+            learning_lang=session["learning_lang"],
+            diagnose=diagnose
+        )
+
+    events = record_stream(session_store, request.session_id, "lesson", request.user_input, run, session_reply)
+    return sse_response(structured_sse(events, format_chat_done))
+
+
 @router.post("/summary")
 async def summary_lesson(
     request: SummaryLessonRequest,
@@ -117,12 +367,16 @@ async def summary_lesson(
                     response.headers["X-Completion-Tokens"] = str(usage["completion_tokens"])
                 if "total_tokens" in usage:
                     response.headers["X-Total-Tokens"] = str(usage["total_tokens"])
+                if "cached_tokens" in usage:
+                    response.headers["X-Cached-Tokens"] = str(usage["cached_tokens"])
             
             # If there's a content field in the result, return it directly to maintain the original format
             if "report" in result:
                 return result["report"]
         
         return result
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         logger.error(f"Summary error: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
@@ -145,7 +399,11 @@ async def evaluate_lesson(request: SummaryLessonRequest,
                 response.headers["X-Completion-Tokens"] = str(usage["completion_tokens"])
             if "total_tokens" in usage:
                 response.headers["X-Total-Tokens"] = str(usage["total_tokens"])
+            if "cached_tokens" in usage:
+                response.headers["X-Cached-Tokens"] = str(usage["cached_tokens"])
         return result
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -169,7 +427,11 @@ async def generate_weekly_summary(
                 response.headers["X-Completion-Tokens"] = str(usage["completion_tokens"])
             if "total_tokens" in usage:
                 response.headers["X-Total-Tokens"] = str(usage["total_tokens"])
+            if "cached_tokens" in usage:
+                response.headers["X-Cached-Tokens"] = str(usage["cached_tokens"])
         return result
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
         
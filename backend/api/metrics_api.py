@@ -0,0 +1,12 @@
+from fastapi import APIRouter
+from services.metrics import metrics
+
+router = APIRouter(prefix="/api/metrics", tags=["metrics"])
+
+
+@router.get("")
+async def get_metrics():
+    """
+    查看服务内部指标（LLM 调用、JSON 修复次数等）
+    """
+    return metrics.snapshot()
@@ -0,0 +1,148 @@
+import asyncio
+import json
+import logging
+from typing import Optional
+
+from services.deadline import DeadlineExceeded, reset_deadline, set_deadline
+from services.metrics import metrics
+from services.structured_logging import debug_requested, reset_request_debug, set_request_debug
+
+logger = logging.getLogger(__name__)
+
+
+class RequestControlMiddleware:
+    """
+    ASGI 中间件：
+
+    - 客户端断开连接时取消正在执行的请求处理，正在等待的 LLM / TTS 上游请求随之取消，不再占用配额和并发名额
+    - 客户端可以通过 X-Request-Timeout 头（秒）设置请求的截止时间，作为上游请求超时的上限（见 services/deadline.py），
+      到期时取消请求处理并返回 504
+    - X-Debug-Log 头与 LOG_DEBUG_TOKEN 一致时，为该请求输出模型的原始响应等大段内容（见 services/structured_logging.py）
+    """
+
+    HEADER = b"x-request-timeout"
+    DEBUG_HEADER = b"x-debug-log"
+    # 没有 Content-Length 和 Transfer-Encoding 时视为没有请求体的方法
+    BODILESS_METHODS = ("GET", "HEAD", "OPTIONS", "DELETE")
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timeout = self._timeout(scope)
+        body_read = asyncio.Event()
+        disconnected = asyncio.Event()
+        response_started = False
+        # 中间件已经读取、还没有交给应用的请求消息
+        buffered = []
+
+        if not self._has_body(scope):
+            # 没有请求体的请求（GET、空的 POST 等）应用可能不会读取请求体，这里先读出唯一的一条消息，
+            # 之后马上开始监听断开
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            buffered.append(message)
+            if not message.get("more_body", False):
+                body_read.set()
+
+        async def app_receive():
+            if buffered:
+                return buffered.pop(0)
+            # 请求体读完之后由 watch_disconnect 读取连接状态，这里只等待断开的通知（StreamingResponse 会监听）
+            if body_read.is_set():
+                await disconnected.wait()
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                disconnected.set()
+            elif not message.get("more_body", False):
+                body_read.set()
+            return message
+
+        async def app_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        async def watch_disconnect():
+            await body_read.wait()
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            disconnected.set()
+
+        # 处理请求的任务创建时复制当前的上下文，继承截止时间和调试标记
+        token = set_deadline(timeout)
+        debug_token = set_request_debug(debug_requested(self._header(scope, self.DEBUG_HEADER)))
+        try:
+            handler = asyncio.ensure_future(self.app(scope, app_receive, app_send))
+        finally:
+            reset_request_debug(debug_token)
+            reset_deadline(token)
+        watcher = asyncio.ensure_future(watch_disconnect())
+        disconnect = asyncio.ensure_future(disconnected.wait())
+        try:
+            done, _ = await asyncio.wait({handler, disconnect}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if handler in done:
+                try:
+                    handler.result()
+                except DeadlineExceeded:
+                    # 截止时间在上游请求中先到（接口把 DeadlineExceeded 原样抛出），同样返回 504
+                    metrics.incr("http_deadline_exceeded", path=scope["path"])
+                    if not response_started:
+                        await self._send_timeout(send)
+                return
+            handler.cancel()
+            await asyncio.gather(handler, return_exceptions=True)
+            if disconnected.is_set():
+                metrics.incr("http_client_disconnects", path=scope["path"])
+                logger.info(f"Client disconnected, cancelled {scope['method']} {scope['path']}")
+                return
+            metrics.incr("http_deadline_exceeded", path=scope["path"])
+            if not response_started:
+                await self._send_timeout(send)
+        finally:
+            watcher.cancel()
+            disconnect.cancel()
+            if not handler.done():
+                handler.cancel()
+
+    def _has_body(self, scope) -> bool:
+        if self._header(scope, b"transfer-encoding") is not None:
+            return True
+        length = self._header(scope, b"content-length")
+        if length is not None:
+            return length.strip() not in (b"", b"0")
+        return scope.get("method", "GET").upper() not in self.BODILESS_METHODS
+
+    def _timeout(self, scope) -> Optional[float]:
+        value = self._header(scope, self.HEADER)
+        if value is None:
+            return None
+        try:
+            timeout = float(value)
+        except ValueError:
+            return None
+        return timeout if timeout > 0 else None
+
+    @staticmethod
+    def _header(scope, header: bytes) -> Optional[bytes]:
+        for name, value in scope.get("headers", []):
+            if name == header:
+                return value
+        return None
+
+    @staticmethod
+    async def _send_timeout(send) -> None:
+        body = json.dumps({"detail": "Request deadline exceeded"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 504,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,56 @@
+import logging
+from typing import AsyncIterator, Callable, Dict, List
+
+from fastapi import HTTPException
+
+from services.session_store import SessionStore, SessionTooLarge
+
+logger = logging.getLogger(__name__)
+
+
+async def load_session(store: SessionStore, session_id: str, kind: str) -> Dict:
+    """读取会话，不存在或已过期时返回 404，客户端需要重新创建会话（上传完整的对话）"""
+    session = await store.get(session_id, kind)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found or expired")
+    return session
+
+
+async def create_session(store: SessionStore, kind: str, native_lang: str, learning_lang: str, messages: List[Dict], **data) -> Dict:
+    try:
+        session = await store.create(kind, native_lang, learning_lang, messages, **data)
+    except SessionTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    return {"session_id": session["id"], "ttl": store.ttl}
+
+
+async def save_session(store: SessionStore, session: Dict) -> None:
+    """保存这一轮之后的会话；丢弃最早的消息后仍然超过大小限制时返回 413"""
+    try:
+        await store.save(session)
+    except SessionTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+
+def user_turn(user_input: str) -> List[Dict]:
+    """这一轮追加到对话中的用户消息；评估对话的第一轮可以没有用户输入（由 AI 开场）"""
+    return [{"role": "user", "content": user_input}] if user_input else []
+
+
+async def record_stream(store: SessionStore, session_id: str, kind: str, user_input: str,
+                        run: Callable[[Dict, List[Dict]], AsyncIterator[Dict]],
+                        reply: Callable[[Dict], Dict]) -> AsyncIterator[Dict]:
+    """
+    流式版本的一轮会话：run(session, history) 返回 stream_structured_chat 格式的事件，
+    done 事件时把用户输入和 reply(done 的 value) 追加到会话中保存；出错或客户端断开时这一轮不保存
+    """
+    async with store.lock(session_id):
+        session = await store.get(session_id, kind)
+        if session is None:
+            raise Exception("Session not found or expired")
+        history = session["messages"] + user_turn(user_input)
+        async for event in run(session, history):
+            if event["type"] == "done":
+                session["messages"] = history + [reply(event["value"])]
+                await store.save(session)
+            yield event
@@ -0,0 +1,48 @@
+import json
+import logging
+from typing import AsyncIterator, Callable, Dict
+
+from fastapi.responses import StreamingResponse
+
+logger = logging.getLogger(__name__)
+
+
+def format_sse(event: str, data: Dict) -> str:
+    """将事件编码为 Server-Sent Events 格式"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def structured_sse(events: AsyncIterator[Dict], format_done: Callable[[Dict], Dict]) -> AsyncIterator[str]:
+    """
+    将 LLMService.stream_structured_chat 格式的事件转换为 SSE：
+    - token 事件：模型新生成的文本片段 {"delta": str}
+    - sentence 事件：新完成的一句 speechText {"index": int, "text": str}
+    - field 事件：已完成的其他顶层字段 {"name": str, "value": Any}
+    - done 事件：format_done 处理后的最终结果
+    - diagnose 事件：单独生成的诊断 {"diagnose": list | None, "usage": dict}（课程对话 diagnose=split 时）
+    - error 事件：生成过程中出错 {"detail": str}
+    """
+    try:
+        async for event in events:
+            if event["type"] == "delta":
+                yield format_sse("token", {"delta": event["delta"]})
+            elif event["type"] == "item":
+                yield format_sse("sentence", {"index": event["index"], "text": event["value"]})
+            elif event["type"] == "field" and event["field"] != "speechText":
+                yield format_sse("field", {"name": event["field"], "value": event["value"]})
+            elif event["type"] == "done":
+                yield format_sse("done", format_done(event["value"]))
+            elif event["type"] == "diagnose":
+                yield format_sse("diagnose", event["value"])
+    except Exception as e:
+        logger.error(f"Stream error: {e}", exc_info=True)
+        yield format_sse("error", {"detail": str(e)})
+
+
+def sse_response(stream: AsyncIterator[str]) -> StreamingResponse:
+    """返回不被代理缓冲的 text/event-stream 响应"""
+    return StreamingResponse(
+        stream,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
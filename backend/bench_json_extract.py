@@ -0,0 +1,156 @@
+"""
+JSON 提取的微基准：对比 structured_chat 原先的逐字符括号扫描与 extract_json（raw_decode）
+
+用法:
+    python bench_json_extract.py                 # 使用内置的样例响应（1-50 KB）
+    python bench_json_extract.py captures/       # 使用目录中抓取的真实模型响应（每个文件一个响应）
+"""
+import json
+import os
+import sys
+import timeit
+
+from services.json_parsing import extract_json
+
+
+def legacy_extract(content: str):
+    """structured_chat 原先的实现：去掉代码块标记、逐行重建，再用 Python 逐字符匹配括号"""
+    content = content.replace('```json', '').replace('```', '')
+    lines = [line.strip() for line in content.split('\n') if line.strip()]
+    content = '\n'.join(lines)
+
+    array_start = content.find('[')
+    object_start = content.find('{')
+    if array_start != -1 and (object_start == -1 or array_start < object_start):
+        start = array_start
+    elif object_start != -1:
+        start = object_start
+    else:
+        raise ValueError("No valid JSON found in response")
+
+    end = -1
+    stack = []
+    in_string = False
+    escape = False
+    for i, char in enumerate(content[start:]):
+        if char == '\\' and not escape:
+            escape = True
+            continue
+        if char == '"' and not escape:
+            in_string = not in_string
+        if not in_string:
+            if char in '{[':
+                stack.append(char)
+            elif char in '}]':
+                if not stack:
+                    break
+                if (char == '}' and stack[-1] == '{') or (char == ']' and stack[-1] == '['):
+                    stack.pop()
+                    if not stack:
+                        end = i + 1
+                        break
+        escape = False
+
+    if end == -1:
+        raise ValueError("Could not find matching closing bracket")
+    return json.loads(content[start:start + end])
+
+
+def lesson_turn_response() -> str:
+    body = {
+        "diagnose": [{
+            "type": "Grammar",
+            "description": "\"I goes to school\" 中主语是 I，动词应使用原形 go",
+            "correct": "I go to school every day."
+        }],
+        "speechText": [
+            "Nice try!",
+            "We say \"I go to school\", not \"I goes\".",
+            "Can you tell me how you get to school?"
+        ],
+        "displayText": ""
+    }
+    return "```json\n" + json.dumps(body, ensure_ascii=False, indent=4) + "\n```"
+
+
+def weekly_plan_response(days: int) -> str:
+    plan = []
+    for day in range(1, days + 1):
+        plan.append({
+            "day_number": day,
+            "topic": f"Day {day}: Ordering food and asking about ingredients at a restaurant",
+            "scenarios": [
+                {"title": "餐厅点餐（Ordering at a Restaurant）", "content": "和服务员沟通，询问菜品的配料、口味和价格，并根据忌口调整点餐"},
+                {"title": "外卖电话（Phone Orders）", "content": "通过电话预订外卖，确认地址、送达时间和付款方式"}
+            ],
+            "knowledge_points": [
+                {
+                    "name": "polite requests with could / would",
+                    "level": 3,
+                    "examples": [
+                        "Could I see the menu, please?",
+                        "Would you recommend something without nuts?",
+                        "Could we have the bill, please?"
+                    ]
+                },
+                {
+                    "name": "food vocabulary: ingredients and flavours",
+                    "level": 2,
+                    "examples": ["Is this dish spicy?", "Does it contain dairy?", "I'd like it medium rare."]
+                }
+            ],
+            "practice": [
+                {"point": "polite requests", "context": "扮演顾客，在限定预算内为两个人点一份含素食的套餐", "difficulty": 3}
+            ],
+            "estimated_time": 30
+        })
+    return "好的，下面是本周的学习计划：\n```json\n" + json.dumps(plan, ensure_ascii=False, indent=4) + "\n```"
+
+
+def profile_response() -> str:
+    profile = {
+        "user_profile": {"name": "Leo", "age": 32, "gender": "male", "career": "产品经理", "other": "经常需要和海外团队开会"},
+        "language_level": {"text": "合格水平：大致能有效运用英语，虽然有不准确、不适当和误解发生", "score": 5},
+        "speed": "slow",
+        "interests": ["科幻电影，尤其是《星际穿越》和《火星救援》", "周末徒步和露营", "玩策略类电子游戏"] * 4,
+        "learning_goals": ["在 standup meeting 中清楚地汇报进度和阻塞问题", "写结构清晰的项目周报邮件"] * 4
+    }
+    return "```json\n" + json.dumps(profile, ensure_ascii=False, indent=4) + "\n```"
+
+
+def builtin_samples():
+    samples = {
+        "lesson_turn": lesson_turn_response(),
+        "profile": profile_response(),
+        "weekly_plan_7d": weekly_plan_response(7),
+    }
+    # 扩展到 ~50 KB，模拟超长的计划输出
+    days = 7
+    while len(weekly_plan_response(days).encode("utf-8")) < 50 * 1024:
+        days += 7
+    samples[f"weekly_plan_{days}d"] = weekly_plan_response(days)
+    return samples
+
+
+def load_captures(path: str):
+    samples = {}
+    for name in sorted(os.listdir(path)):
+        with open(os.path.join(path, name), encoding="utf-8") as f:
+            samples[name] = f.read()
+    return samples
+
+
+def main():
+    samples = load_captures(sys.argv[1]) if len(sys.argv) > 1 else builtin_samples()
+    print(f"{'sample':<24}{'size':>10}{'legacy (ms)':>14}{'extract_json (ms)':>20}{'speedup':>10}")
+    for name, content in samples.items():
+        assert legacy_extract(content) == extract_json(content), name
+        number = max(10, 200000 // max(len(content), 1))
+        legacy = min(timeit.repeat(lambda: legacy_extract(content), number=number, repeat=5)) / number
+        fast = min(timeit.repeat(lambda: extract_json(content), number=number, repeat=5)) / number
+        size_kb = f"{len(content.encode('utf-8')) / 1024:.1f} KB"
+        print(f"{name:<24}{size_kb:>10}{legacy * 1000:>14.3f}{fast * 1000:>20.3f}{legacy / fast:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
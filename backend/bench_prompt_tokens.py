@@ -0,0 +1,110 @@
+"""
+对比各接口发送给模型的提示词大小：嵌入提示词的数据原先的序列化方式（Python repr）与 services/prompt_format.compact
+
+系统提示词模板两列相同：模板在 services/prompt_templates 中定义时已经去掉了源码缩进（prompt_format.prompt_text），
+这里无法还原原先带缩进的模板，只对比数据序列化的差异
+
+token 数按 prompt_format.estimate_tokens 估算，只用于前后对比，与各 provider 实际计费的 token 数会有差异
+
+用法:
+    python bench_prompt_tokens.py
+"""
+import asyncio
+
+from models.lesson_models import CreateLessonRequest, SummaryLessonRequest
+from services import assessment, lesson
+from services.assessment import AssessmentService
+from services.lesson import LessonService
+from services.prompt_format import estimate_tokens
+
+USER = {
+    "name": "Lin", "age": 9, "gender": None, "occupation": "", "interests": ["football", "drawing"],
+    "level": 3, "speed": "slow", "native_language": "cmn-CN", "goals": [], "notes": None
+}
+LESSON_INFO = {
+    "title": "Ordering at a cafe",
+    "scenario": "The learner orders breakfast for the family at a small cafe",
+    "words": ["latte", "croissant", "takeaway", "receipt", "oat milk"],
+    "phrases": ["Can I get ...?", "For here or to go?", "That's all, thanks."],
+    "grammar": None, "review": [], "extra": {}
+}
+MENU = "| Item | Price |\n|----|----|\n" + "\n".join(f"| Item {i} | ${i}.50 |" for i in range(12))
+
+
+def conversation(turns: int):
+    history = [{"role": "assistant", "content": "Welcome to Sunny Cafe! What would you like?",
+                "speechText": ["Welcome to Sunny Cafe!", "What would you like?"], "displayText": MENU}]
+    for i in range(turns):
+        history.append({"role": "user", "content": f"[voice] Can I get a latte and croissant number {i}?",
+                        "speechText": None, "displayText": None})
+        history.append({"role": "assistant", "content": f"Sure! Anything else for order {i}?",
+                        "speechText": ["Sure!", f"Anything else for order {i}?"], "displayText": None})
+    return history
+
+
+class Captured(Exception):
+    pass
+
+
+class CapturingLLM:
+    """记录发送给模型的消息后中止调用"""
+
+    def __init__(self):
+        self.messages = None
+
+    async def _capture(self, messages=None, *args, **kwargs):
+        self.messages = messages if messages is not None else args[0]
+        raise Captured()
+
+    chat_completion = structured_chat = _capture
+
+
+def endpoints(llm):
+    lessons = LessonService(llm_service=llm)
+    assessments = AssessmentService(llm_service=llm)
+    history = conversation(10)
+    summary_request = SummaryLessonRequest(mode="practice", lesson=LESSON_INFO, user=USER, conversation_history=history)
+    return {
+        "lesson/create": lambda: lessons.create_lesson(CreateLessonRequest(mode="study", lesson_info=LESSON_INFO, user=USER), "cmn-CN", "en-US"),
+        "lesson/chat (20 turns)": lambda: lessons.conduct_lesson({"mode": "practice", "lesson_info": LESSON_INFO}, USER, "hi", history, diagnose="inline"),
+        "lesson/chat split (20 turns)": lambda: lessons.conduct_lesson({"mode": "practice", "lesson_info": LESSON_INFO}, USER, "hi", history, diagnose="split"),
+        "lesson/diagnose": lambda: lessons.diagnose_turn("hi", history),
+        "lesson/summary": lambda: lessons.summary_lesson(summary_request),
+        "lesson/evaluate": lambda: lessons.evaluate_lesson(summary_request),
+        "lesson/weekly-summary": lambda: lessons.generate_weekly_summary({"reports": [LESSON_INFO] * 3, "user": USER}),
+        "assessment/initial-chat": lambda: assessments.conduct_initial_assessment(history[:7], "cmn-CN", "en-US"),
+        "assessment/generate-total-plan": lambda: assessments.generate_total_plan(USER, "cmn-CN", "en-US"),
+        "assessment/generate-weekly-plan": lambda: assessments.generate_weekly_plan(USER, "cmn-CN", "en-US"),
+    }
+
+
+def measure():
+    llm = CapturingLLM()
+    sizes = {}
+    for name, call in endpoints(llm).items():
+        llm.messages = None
+        try:
+            asyncio.run(call())
+        except Exception:
+            pass
+        sizes[name] = sum(estimate_tokens(str(m["content"])) for m in llm.messages or [])
+    return sizes
+
+
+def legacy(module):
+    """切换回原先的序列化方式"""
+    module.compact = lambda value: str(value.model_dump() if hasattr(value, "model_dump") else value)
+
+
+if __name__ == "__main__":
+    after = measure()
+    saved = (lesson.compact, assessment.compact)
+    legacy(lesson)
+    legacy(assessment)
+    before = measure()
+    lesson.compact, assessment.compact = saved
+
+    print(f"| {'endpoint':<32} | {'before':>7} | {'after':>7} | {'saved':>6} |")
+    print(f"|{'-' * 34}|{'-' * 9}|{'-' * 9}|{'-' * 8}|")
+    for name in after:
+        print(f"| {name:<32} | {before[name]:>7} | {after[name]:>7} | {1 - after[name] / before[name]:>6.0%} |")
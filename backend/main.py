@@ -1,14 +1,35 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from dotenv import load_dotenv
 from api import lesson_api, assessment_api, tts_api
-from api import google_auth_api
+from api import google_auth_api, metrics_api
+from api.request_control import RequestControlMiddleware
+from services.llm_service import get_llm_service
+from services.session_store import get_session_store
+from services.structured_logging import setup_logging
 
 # 加载环境变量
 load_dotenv()
+# 日志通过队列在后台线程写出，见 services/structured_logging.py
+setup_logging()
 
-app = FastAPI(title="AI English Tutor API")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 启动时创建 LLM 上游的共享连接池，退出时关闭连接池和会话的持久化层
+    llm_service = get_llm_service()
+    await llm_service.startup()
+    yield
+    await llm_service.shutdown()
+    await get_session_store().close()
+
+
+app = FastAPI(title="AI English Tutor API", lifespan=lifespan)
+
+# 客户端断开时取消请求处理，支持 X-Request-Timeout 截止时间
+app.add_middleware(RequestControlMiddleware)
 
 # 配置CORS
 app.add_middleware(
@@ -24,6 +45,7 @@ app.include_router(lesson_api.router)
 app.include_router(assessment_api.router)
 app.include_router(tts_api.router)
 app.include_router(google_auth_api.router, prefix="/api/auth")
+app.include_router(metrics_api.router)
 #app.include_router(asr_api.router)
 
 # 挂载静态文件
@@ -0,0 +1,139 @@
+"""
+LLM 结构化输出的 Pydantic 模型，models/output_schemas.py 中的 JSON Schema 由这些模型生成，
+structured_chat 解析出 JSON 后用于校验结构，缺失或格式错误的字段会单独让模型补全；
+提示词中说明可以为空的字段（如 displayText、diagnose）设置默认值，缺失时不追问
+"""
+from pydantic import BaseModel, Field, RootModel
+from typing import List, Optional
+
+from models.lesson_models import LessonStep
+
+
+def _enum(*values: str):
+    """只写入 JSON Schema 的可选值，校验时不限制（模型偶尔输出其他值时不需要追问）"""
+    return Field(json_schema_extra={"enum": list(values)})
+
+
+class Diagnose(BaseModel):
+    type: str = _enum("Grammar", "Vocabulary", "Structure", "Context", "Pronunciation")
+    description: str
+    correct: str
+
+# AssessmentService.conduct_initial_assessment / conduct_generate_total_plan
+class AssessmentChat(BaseModel):
+    speechText: List[str]
+    displayText: Optional[str] = ""
+
+# LessonService.conduct_lesson
+class LessonTurn(BaseModel):
+    diagnose: List[Diagnose] = []
+    speechText: List[str]
+    displayText: Optional[str] = ""
+
+# LessonService.conduct_lesson，diagnose 为 split 时
+class LessonReply(BaseModel):
+    speechText: List[str]
+    displayText: Optional[str] = ""
+
+# LessonService.diagnose_turn
+class LessonDiagnose(BaseModel):
+    diagnose: List[Diagnose]
+
+# LessonService.create_lesson
+class LessonCreate(BaseModel):
+    speechText: List[str]
+    displayText: Optional[str] = ""
+
+# LessonService.compile_steps
+class LessonSteps(BaseModel):
+    steps: List[LessonStep]
+
+class ScoreReason(BaseModel):
+    score: float
+    reason: str
+
+# LessonService.evaluate_lesson
+class LessonEvaluation(BaseModel):
+    text: str
+    eval: ScoreReason
+    level: ScoreReason
+
+class SummaryAction(BaseModel):
+    type: str = _enum("level", "speed")
+    value: str
+    reason: str
+
+# LessonService.generate_weekly_summary
+class WeeklySummary(BaseModel):
+    summary: str
+    achievements: str
+    weaknesses: str
+    suggestions: str
+    action: List[SummaryAction]
+
+class UserProfile(BaseModel):
+    name: Optional[str] = None
+    age: Optional[float] = None
+    gender: Optional[str] = None
+    career: Optional[str] = None
+    other: Optional[str] = None
+
+class LanguageLevel(BaseModel):
+    text: str
+    score: float
+
+# AssessmentService.analyze_assessment（英文提示词版本）
+class LearnerProfile(BaseModel):
+    user_profile: UserProfile
+    language_level: LanguageLevel
+    speed: str = _enum("slowest", "slow", "normal")
+    interests: List[str]
+    learning_goals: List[str]
+
+class UserProfileZh(BaseModel):
+    english_name: Optional[str] = None
+    age: Optional[float] = None
+    gender: Optional[str] = None
+    career: Optional[str] = None
+    other: Optional[str] = None
+
+# AssessmentService.analyze_assessment（中文提示词版本）
+class LearnerProfileZh(BaseModel):
+    user_profile: UserProfileZh
+    english_level: LanguageLevel
+    speed: str = _enum("slowest", "slow", "normal")
+    interests: List[str]
+    learning_goals: List[str]
+    study_time_per_day: float
+    total_study_day: float
+
+# AssessmentService.generate_total_plan
+class TotalPlan(BaseModel):
+    estimated_weeks: int
+    weeks_plan: List[str]
+
+class Scenario(BaseModel):
+    title: str
+    content: str
+
+class KnowledgePoint(BaseModel):
+    name: str
+    level: int
+    examples: List[str]
+
+class Practice(BaseModel):
+    point: str
+    context: str
+    difficulty: int
+
+class WeeklyPlanDay(BaseModel):
+    day_number: int
+    topic: str
+    scenarios: List[Scenario]
+    knowledge_points: List[KnowledgePoint]
+    practice: List[Practice]
+    estimated_time: int
+
+# AssessmentService.generate_weekly_plan，顶层是数组，校验失败时按下标补全
+class WeeklyPlan(RootModel[List[WeeklyPlanDay]]):
+    pass
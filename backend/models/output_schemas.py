@@ -0,0 +1,64 @@
+"""
+LLM 结构化输出的 JSON Schema，由 models/output_models.py 中的 Pydantic 模型生成，
+对应 LessonService / AssessmentService 提示词中描述的输出格式，
+开启 LLM_RESPONSE_FORMAT 时作为 response_format 传给支持的 provider
+"""
+from typing import Any, Dict, Type
+
+from pydantic import BaseModel
+
+from models.output_models import (AssessmentChat, LearnerProfile, LearnerProfileZh, LessonCreate, LessonDiagnose,
+                                  LessonEvaluation, LessonReply, LessonSteps, LessonTurn, TotalPlan, WeeklyPlan,
+                                  WeeklySummary)
+
+# pydantic 生成的这些关键字对 provider 没有用处，部分 provider 的 JSON mode 也不接受
+_DROPPED_KEYWORDS = ("title", "default")
+
+
+def output_schema(model: Type[BaseModel], title: str) -> Dict:
+    """
+    模型的 JSON Schema：嵌套模型的 $ref 展开（部分 provider 不支持 $defs），去掉各级的 title 和 default，
+    顶层的 title 作为 response_format 的 name
+    """
+    schema = model.model_json_schema()
+    definitions = schema.pop("$defs", {})
+
+    def inline(node: Any) -> Any:
+        if isinstance(node, list):
+            return [inline(item) for item in node]
+        if not isinstance(node, dict):
+            return node
+        if "$ref" in node:
+            return inline(definitions[node["$ref"].rsplit("/", 1)[-1]])
+        return {
+            # properties 的 key 是字段名（可能就叫 title），不能当作关键字去掉
+            key: {name: inline(field) for name, field in value.items()} if key == "properties" else inline(value)
+            for key, value in node.items() if key not in _DROPPED_KEYWORDS
+        }
+
+    return {"title": title, **inline(schema)}
+
+
+# LessonService.conduct_lesson
+LESSON_TURN_SCHEMA = output_schema(LessonTurn, "lesson_turn")
+# LessonService.conduct_lesson，diagnose 为 split 时老师的回复中不包含诊断
+LESSON_REPLY_SCHEMA = output_schema(LessonReply, "lesson_reply")
+# LessonService.diagnose_turn
+LESSON_DIAGNOSE_SCHEMA = output_schema(LessonDiagnose, "lesson_diagnose")
+# LessonService.create_lesson
+LESSON_CREATE_SCHEMA = output_schema(LessonCreate, "lesson_create")
+# LessonService.compile_steps，对应 models/lesson_models.LessonStep
+LESSON_STEPS_SCHEMA = output_schema(LessonSteps, "lesson_steps")
+# AssessmentService.conduct_initial_assessment / conduct_generate_total_plan
+ASSESSMENT_CHAT_SCHEMA = output_schema(AssessmentChat, "assessment_chat")
+# LessonService.evaluate_lesson
+LESSON_EVALUATION_SCHEMA = output_schema(LessonEvaluation, "lesson_evaluation")
+# LessonService.generate_weekly_summary
+WEEKLY_SUMMARY_SCHEMA = output_schema(WeeklySummary, "weekly_summary")
+# AssessmentService.analyze_assessment（英文 / 中文提示词版本）
+PROFILE_SCHEMA = output_schema(LearnerProfile, "learner_profile")
+PROFILE_SCHEMA_ZH = output_schema(LearnerProfileZh, "learner_profile_zh")
+# AssessmentService.generate_total_plan
+TOTAL_PLAN_SCHEMA = output_schema(TotalPlan, "total_plan")
+# AssessmentService.generate_weekly_plan，顶层是数组，provider 的 JSON mode 只支持对象，因此不会作为 response_format 发送
+WEEKLY_PLAN_SCHEMA = output_schema(WeeklyPlan, "weekly_plan")
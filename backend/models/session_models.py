@@ -0,0 +1,19 @@
+from pydantic import BaseModel, Field
+from typing import Dict, Optional, List
+from models.lesson_models import Lesson, LessonStep, Message
+
+class LessonSessionRequest(BaseModel):
+    lesson: Lesson
+    user: Optional[Dict] = None
+    conversation_history: List[Message] = Field(default_factory=list)  # 已有的对话，如 /api/lesson/create 返回的开场白
+    steps: Optional[List[LessonStep]] = None  # /api/lesson/create?steps=true 返回的课程步骤，按步骤进行课程
+
+class AssessmentSessionRequest(BaseModel):
+    messages: List[Dict] = Field(default_factory=list)
+
+class SessionRequest(BaseModel):
+    session_id: str
+
+class SessionTurnRequest(BaseModel):
+    session_id: str
+    user_input: str
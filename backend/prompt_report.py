@@ -0,0 +1,59 @@
+"""
+各系统提示词模板（services/prompt_templates）在所有语言组合下编译后的 token 数，
+用于确认每个提示词的大小、对比同一提示词不同版本（PROMPT_VERSION_<NAME>）的差异
+
+token 数按 prompt_format.estimate_tokens 估算，与各 provider 实际计费的 token 数会有差异；
+动态参数（当前日期、用户档案字段）使用固定的示例值
+
+用法:
+    python prompt_report.py          # 每个模板 / 版本 / variant 一行，列出所有语言组合中的最小、平均、最大值
+    python prompt_report.py --all    # 每个语言组合一行
+"""
+import argparse
+from itertools import permutations
+
+from services.prompt_format import estimate_tokens
+from services.prompt_registry import LANGUAGE_NAMES, get_prompt_registry
+
+# 模板中除语言名称之外的参数的示例值
+SAMPLE_PARAMS = {
+    "mode": "practice",
+    "current_date": "2024-01-01",
+    "english_level": 3,
+    "learning_goals": "travel, work",
+    "study_time_per_day": 30,
+    "position": "3/8",
+    "step": '{"title":"Ordering a drink","contents":[{"text":"Practice: order a latte","content_type":"exercise"}]}'
+}
+
+
+def inventory():
+    """按 (模板, 版本, variant, 母语, 学习语言) 列出编译后的 token 数"""
+    registry = get_prompt_registry()
+    rows = []
+    for (name, version, variant), template in sorted(registry.templates.items()):
+        for native_lang, learning_lang in permutations(LANGUAGE_NAMES, 2):
+            text = registry.render(name, native_lang, learning_lang, variant=variant, version=version, **SAMPLE_PARAMS)
+            rows.append((name, version, variant, native_lang, learning_lang, estimate_tokens(text)))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Token inventory of the system prompt templates")
+    parser.add_argument("--all", action="store_true", help="one row per language pair")
+    args = parser.parse_args()
+
+    rows = inventory()
+    if args.all:
+        print(f"| {'prompt':<16} | {'version':<7} | {'variant':<8} | {'native':<6} | {'learning':<8} | {'tokens':>6} |")
+        print(f"|{'-' * 18}|{'-' * 9}|{'-' * 10}|{'-' * 8}|{'-' * 10}|{'-' * 8}|")
+        for name, version, variant, native_lang, learning_lang, tokens in rows:
+            print(f"| {name:<16} | {version:<7} | {variant:<8} | {native_lang:<6} | {learning_lang:<8} | {tokens:>6} |")
+    else:
+        groups = {}
+        for name, version, variant, _, _, tokens in rows:
+            groups.setdefault((name, version, variant), []).append(tokens)
+        print(f"| {'prompt':<16} | {'version':<7} | {'variant':<8} | {'min':>5} | {'avg':>5} | {'max':>5} |")
+        print(f"|{'-' * 18}|{'-' * 9}|{'-' * 10}|{'-' * 7}|{'-' * 7}|{'-' * 7}|")
+        for (name, version, variant), counts in groups.items():
+            print(f"| {name:<16} | {version:<7} | {variant:<8} | {min(counts):>5} | {sum(counts) // len(counts):>5} | {max(counts):>5} |")
@@ -8,6 +8,8 @@ import jwt
 from typing import Dict, Any, Optional, List
 from fastapi import HTTPException
 import logging
+from services.deadline import budget
+from services.rate_limit import UpstreamError, get_limiter, parse_retry_after
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +26,10 @@ class ASRService:
         self.credentials_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
         if not self.credentials_path or not os.path.exists(self.credentials_path):
             logger.warning(f"GOOGLE_APPLICATION_CREDENTIALS not set or file not found: {self.credentials_path}")
+        # 出站限流和 429/503 重试，配置见 ASR_RPM / ASR_CONCURRENCY
+        self.limiter = get_limiter("asr", concurrency=8)
+        # 单次识别请求的超时，不超过客户端请求剩余的时间（见 services/deadline.py）
+        self.request_timeout = float(os.getenv("ASR_REQUEST_TIMEOUT", "300"))
     
     async def recognize_speech(
         self, 
@@ -88,17 +94,19 @@ class ASRService:
             }
             
             # Make the API request
-            async with aiohttp.ClientSession() as session:
-                async with session.post(self.api_url, json=payload, headers=headers) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        logger.error(f"Google Speech API v2 error: {error_text}")
-                        raise HTTPException(
-                            status_code=response.status,
-                            detail=f"Google Speech API v2 error: {error_text}"
-                        )
-                    
-                    response_data = await response.json()
+            try:
+                response_data = await self.limiter.call(lambda: self._recognize(payload, headers))
+            except UpstreamError as e:
+                # 重试后仍被限流或上游不可用，把上游的状态码返回给客户端
+                raise HTTPException(
+                    status_code=e.status,
+                    detail=f"Google Speech API v2 error: {str(e)}"
+                )
+            except asyncio.TimeoutError:
+                raise HTTPException(
+                    status_code=504,
+                    detail="Google Speech API v2 timeout"
+                )
             
             # Process and format the response
             result = {
@@ -120,7 +128,9 @@ class ASRService:
                 result["confidence"] = 0
             
             return result
-                    
+
+        except HTTPException:
+            raise
         except Exception as e:
             logger.error(f"Error calling Google Speech API v2: {str(e)}")
             raise HTTPException(
@@ -128,6 +138,16 @@ class ASRService:
                 detail=f"Error calling Google Speech API v2: {str(e)}"
             )
     
+    async def _recognize(self, payload: Dict, headers: Dict) -> Dict:
+        """发送一次识别请求，返回的状态码不是 200 时抛出 UpstreamError"""
+        async with aiohttp.ClientSession() as session:
+            async with session.post(self.api_url, json=payload, headers=headers, timeout=aiohttp.ClientTimeout(total=budget(self.request_timeout))) as response:
+                if response.status != 200:
+                    error_text = await response.text()
+                    logger.error(f"Google Speech API v2 error: {error_text}")
+                    raise UpstreamError(response.status, error_text, parse_retry_after(response.headers.get("Retry-After")))
+                return await response.json()
+
     async def _get_access_token(self, credentials):
         """Get access token from service account credentials"""
         try:
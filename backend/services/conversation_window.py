@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from services.deadline import set_deadline
+from services.llm_cache import cache_key
+from services.metrics import metrics
+from services.prompt_format import prompt_text
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationWindow:
+    """
+    控制每轮发送给模型的对话历史长度：第一条消息（开场白和场景设定）和最近 keep_turns 条消息原样保留，
+    更早的消息压缩为一段摘要
+
+    摘要在后台生成，不阻塞当前请求：某个位置之前的摘要还没有生成好时，先用更早的摘要加上原文。
+    摘要覆盖的范围按 block_turns 条消息为单位推进，两次推进之间每轮请求的前缀保持不变，不影响 provider 的前缀缓存
+
+    配置来自环境变量 CONVERSATION_KEEP_TURNS、CONVERSATION_SUMMARY_BLOCK，CONVERSATION_KEEP_TURNS 为 0 时不压缩；
+    生成摘要使用的模型见 services/llm_profiles.py 中的 conversation_summary
+    """
+
+    SUMMARY_PROMPT = prompt_text("""你负责压缩一节语言课程中较早的对话记录。请在已有摘要的基础上合并新的对话，保留：
+        1. 学习者的个人信息、兴趣和表达过的偏好（如觉得太难、想换话题）
+        2. 已经讲解和练习过的知识点，学习者掌握得好的内容和反复出现的错误
+        3. 教学步骤的进度，或角色扮演场景中已经发生的事件和已完成的目标
+        只输出摘要本身，使用简洁的条目，不超过 300 字。""")
+
+    def __init__(self, llm, keep_turns: Optional[int] = None, block_turns: Optional[int] = None, max_entries: int = 512):
+        self.llm = llm
+        self.keep_turns = keep_turns if keep_turns is not None else int(os.getenv('CONVERSATION_KEEP_TURNS', '12'))
+        self.block_turns = max(1, block_turns if block_turns is not None else int(os.getenv('CONVERSATION_SUMMARY_BLOCK', '8')))
+        # 超过这个长度的 displayText 只在第一次出现时保留
+        self.display_text_min_length = int(os.getenv('CONVERSATION_DISPLAY_TEXT_DEDUP', '200'))
+        self.max_entries = max_entries
+        # 前 n 条消息（不含置顶的第一条）的哈希 -> 摘要
+        self._summaries: "OrderedDict[str, str]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Task] = {}
+
+    def apply(self, history: List[Dict]) -> List[Dict]:
+        """
+        返回实际发送给模型的对话历史，压缩掉的部分替换为一条 user 消息形式的摘要
+        """
+        history = self._drop_repeated_display_text(history)
+        if self.keep_turns <= 0 or len(history) <= 1 + self.keep_turns + self.block_turns:
+            return history
+
+        pinned, rest = history[:1], history[1:]
+        cutoff = (len(rest) - self.keep_turns) // self.block_turns * self.block_turns
+
+        # 使用已经生成好的、覆盖范围最大的摘要
+        covered, summary = 0, None
+        for end in range(cutoff, 0, -self.block_turns):
+            summary = self._lookup(rest[:end])
+            if summary is not None:
+                covered = end
+                break
+
+        if covered < cutoff:
+            self._schedule(rest, covered, cutoff, summary)
+
+        if summary is None:
+            return history
+        metrics.incr("conversation_window_compressed_messages", covered)
+        return pinned + [{"role": "user", "content": f"Summary of the earlier conversation:\n{summary}"}] + rest[covered:]
+
+    def _drop_repeated_display_text(self, history: List[Dict]) -> List[Dict]:
+        """较长的 displayText（菜单、文档等）重复出现时只保留第一次"""
+        seen = set()
+        result = []
+        for msg in history:
+            display_text = msg.get("displayText")
+            if display_text and len(display_text) >= self.display_text_min_length:
+                if display_text in seen:
+                    msg = {**msg, "displayText": None}
+                    metrics.incr("conversation_window_dropped_display_text")
+                else:
+                    seen.add(display_text)
+            result.append(msg)
+        return result
+
+    @staticmethod
+    def _key(messages: List[Dict]) -> str:
+        return cache_key("conversation_summary", [(m.get("role"), m.get("content"), m.get("displayText")) for m in messages])
+
+    def _lookup(self, messages: List[Dict]) -> Optional[str]:
+        key = self._key(messages)
+        summary = self._summaries.get(key)
+        if summary is not None:
+            self._summaries.move_to_end(key)
+        return summary
+
+    def _schedule(self, rest: List[Dict], covered: int, cutoff: int, summary: Optional[str]) -> None:
+        """在后台把 rest[covered:cutoff] 合并进摘要，同一段历史只生成一次"""
+        key = self._key(rest[:cutoff])
+        if key in self._pending:
+            return
+        try:
+            task = asyncio.get_running_loop().create_task(self._summarize(key, summary, rest[covered:cutoff]))
+        except RuntimeError:
+            # 没有运行中的事件循环（同步调用），不压缩
+            return
+        self._pending[key] = task
+        task.add_done_callback(lambda _: self._pending.pop(key, None))
+
+    async def _summarize(self, key: str, summary: Optional[str], messages: List[Dict]) -> None:
+        # 后台任务继承了触发它的请求的截止时间，摘要不受该请求的时间限制
+        set_deadline(None)
+        start = time.monotonic()
+        transcript = "\n".join(f"{m.get('role', 'user').capitalize()}: {m.get('content', '')}" for m in messages)
+        content = f"已有摘要：\n{summary or '无'}\n\n新的对话：\n{transcript}"
+        try:
+            response = await self.llm.chat_completion(
+                [{"role": "system", "content": self.SUMMARY_PROMPT}, {"role": "user", "content": content}],
+                profile="conversation_summary"
+            )
+        except Exception as e:
+            metrics.incr("conversation_summaries", result="error")
+            logger.warning(f"Conversation summary failed: {e}")
+            return
+        self._summaries[key] = response["content"].strip()
+        while len(self._summaries) > self.max_entries:
+            self._summaries.popitem(last=False)
+        metrics.incr("conversation_summaries", result="ok")
+        metrics.observe("conversation_summary_seconds", time.monotonic() - start)
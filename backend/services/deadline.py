@@ -0,0 +1,41 @@
+import asyncio
+import time
+from contextvars import ContextVar, Token
+from typing import Optional
+
+# 当前请求的截止时间（time.monotonic()），由 api/request_control.py 根据客户端的 X-Request-Timeout 设置
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """请求的剩余时间已经用完，不再发送上游请求，也不重试或切换 provider"""
+
+
+def set_deadline(seconds: Optional[float]) -> Token:
+    """设置当前上下文（及之后创建的任务）的截止时间，seconds 为 None 时不限制"""
+    return _deadline.set(time.monotonic() + seconds if seconds is not None else None)
+
+
+def reset_deadline(token: Token) -> None:
+    _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """当前请求剩余的秒数，没有截止时间时返回 None"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def budget(timeout: Optional[float]) -> Optional[float]:
+    """
+    一次上游请求可以使用的超时：配置的 timeout 与请求剩余时间中较小的一个，
+    同一个请求中后面的步骤（续写、修复、TTS）得到的时间越来越少；剩余时间已经用完时抛出 DeadlineExceeded
+    """
+    left = remaining()
+    if left is None:
+        return timeout
+    if left <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    return left if timeout is None else min(timeout, left)
@@ -0,0 +1,429 @@
+import json
+import re
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+_decoder = json.JSONDecoder()
+_JSON_START = re.compile(r"[{\[]")
+
+# 尝试解码的起始位置上限，避免在很长的非 JSON 内容上反复扫描
+MAX_EXTRACT_ATTEMPTS = 8
+
+
+def _candidate_starts(content: str) -> Iterable[int]:
+    """
+    依次产出可能的 JSON 起始位置（{ 或 [）
+
+    跳过位于第一个候选位置内部的括号（两者之间左括号多于右括号），
+    避免第一个候选解码失败后把它内部的片段（如 "diagnose": []）当作整个结果
+    """
+    root = None
+    for attempt, match in enumerate(_JSON_START.finditer(content)):
+        if attempt >= MAX_EXTRACT_ATTEMPTS:
+            break
+        start = match.start()
+        if root is not None:
+            between = content[root:start]
+            opens = between.count("{") + between.count("[")
+            closes = between.count("}") + between.count("]")
+            if opens > closes:
+                continue
+        root = start
+        yield start
+
+
+def extract_json(content: str) -> Any:
+    """
+    从模型输出中提取第一个有效的 JSON 对象或数组
+
+    直接在原字符串上用 json.JSONDecoder.raw_decode（C 实现）从第一个 { 或 [ 开始解码，
+    无需去掉 ```json 标记或重建每一行；解码失败时依次尝试后面不在其内部的起始位置。
+    找不到有效 JSON 时抛出 ValueError
+    """
+    error = None
+    for start in _candidate_starts(content):
+        try:
+            value, _ = _decoder.raw_decode(content, start)
+            return value
+        except ValueError as e:
+            error = e
+    if error is None:
+        raise ValueError("No valid JSON found in response")
+    raise ValueError(f"No valid JSON found in response: {error}")
+
+
+_NUMBER = re.compile(r"-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?")
+_WORD = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_LITERALS = {
+    "null": "null", "true": "true", "false": "false",
+    "None": "null", "True": "true", "False": "false",
+}
+_ESCAPABLE = '"\\/bfnrtu'
+_CONTROL_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+
+
+def repair_json(content: str) -> Tuple[Any, List[str]]:
+    """
+    在本地修复模型输出中常见的 JSON 格式错误，返回 (解析结果, 应用的修复类型)
+
+    可以处理的错误类型:
+        comments         # 或 // 注释（提示词里的输出格式带注释，模型有时会照抄）
+        trailing_commas  对象或数组最后多余的逗号
+        extra_commas     连续或开头多余的逗号
+        missing_commas   两个值之间缺少逗号
+        single_quotes    单引号字符串
+        inner_quotes     字符串中未转义的双引号
+        control_chars    字符串中未转义的换行、制表符等控制字符
+        invalid_escapes  字符串中无效的转义，如 \\s
+        python_literals  Python 的 None/True/False
+        unquoted_keys    没有引号的对象键
+        missing_values   有键没有值
+        truncated        输出被截断，补全未闭合的字符串和括号
+    无法修复时抛出 ValueError
+    """
+    error = None
+    for start in _candidate_starts(content):
+        try:
+            text, repairs = _repair_from(content, start)
+            return json.loads(text), sorted(repairs)
+        except ValueError as e:
+            error = e
+    if error is None:
+        raise ValueError("No JSON found in response")
+    raise ValueError(f"Could not repair JSON: {error}")
+
+
+def _repair_from(content: str, start: int) -> Tuple[str, Set[str]]:
+    """从 start 处的 { 或 [ 开始逐个 token 重写为合法的 JSON 文本"""
+    out: List[str] = []
+    repairs: Set[str] = set()
+    # 每层容器: [括号, 状态]，状态为 start / after_comma / colon（等待冒号）/ value（等待值）/ done（值已完成）
+    stack: List[List[str]] = []
+    i = start
+    n = len(content)
+
+    def value_done():
+        if stack:
+            stack[-1][1] = "done"
+
+    while i < n:
+        ch = content[i]
+        if ch in " \t\r\n":
+            out.append(ch)
+            i += 1
+            continue
+        if not stack and out:
+            # 顶层 JSON 已经闭合，忽略后面的内容
+            break
+        if ch == "#" or content.startswith("//", i):
+            end = content.find("\n", i)
+            i = n if end < 0 else end
+            repairs.add("comments")
+            continue
+
+        top = stack[-1] if stack else None
+        if ch in "}]":
+            if top is None or ch != ("}" if top[0] == "{" else "]"):
+                raise ValueError(f"Unexpected {ch!r} at position {i}")
+            _close_container(out, top, repairs)
+            stack.pop()
+            value_done()
+            i += 1
+            continue
+        if ch == ",":
+            if top is None:
+                break
+            if top[1] in ("start", "after_comma"):
+                repairs.add("extra_commas")
+            else:
+                out.append(",")
+                top[1] = "after_comma"
+            i += 1
+            continue
+        if ch == ":":
+            if top is None or top[0] != "{" or top[1] != "colon":
+                raise ValueError(f"Unexpected ':' at position {i}")
+            out.append(":")
+            top[1] = "value"
+            i += 1
+            continue
+
+        # 下面开始一个新的键或值
+        if top is not None and top[1] == "done":
+            out.append(",")
+            top[1] = "after_comma"
+            repairs.add("missing_commas")
+
+        if top is not None and top[0] == "{" and top[1] in ("start", "after_comma"):
+            if ch in "\"'":
+                text, i = _read_string(content, i, repairs)
+                out.append(text)
+            else:
+                match = _WORD.match(content, i)
+                if not match:
+                    raise ValueError(f"Expected object key at position {i}")
+                out.append(json.dumps(match.group()))
+                repairs.add("unquoted_keys")
+                i = match.end()
+            top[1] = "colon"
+            continue
+        if top is not None and top[1] == "colon":
+            raise ValueError(f"Expected ':' at position {i}")
+
+        if ch in "{[":
+            out.append(ch)
+            stack.append([ch, "start"])
+            i += 1
+            continue
+        if ch in "\"'":
+            text, i = _read_string(content, i, repairs)
+            out.append(text)
+            value_done()
+            continue
+        match = _NUMBER.match(content, i)
+        if match:
+            out.append(match.group())
+            i = match.end()
+            value_done()
+            continue
+        match = _WORD.match(content, i)
+        if match and match.group() in _LITERALS:
+            literal = _LITERALS[match.group()]
+            if literal != match.group():
+                repairs.add("python_literals")
+            out.append(literal)
+            i = match.end()
+            value_done()
+            continue
+        raise ValueError(f"Unexpected character {ch!r} at position {i}")
+
+    if stack:
+        # 输出被截断：由内向外补全括号
+        repairs.add("truncated")
+        while stack:
+            _close_container(out, stack.pop(), repairs)
+            value_done()
+    return "".join(out), repairs
+
+
+def _close_container(out: List[str], top: List[str], repairs: Set[str]) -> None:
+    """闭合一层容器，去掉末尾多余的逗号并补全缺失的值"""
+    if top[1] == "after_comma":
+        for k in range(len(out) - 1, -1, -1):
+            if out[k] == ",":
+                del out[k]
+                break
+        repairs.add("trailing_commas")
+    elif top[1] == "colon":
+        out.append(": null")
+        repairs.add("missing_values")
+    elif top[1] == "value":
+        out.append("null")
+        repairs.add("missing_values")
+    out.append("}" if top[0] == "{" else "]")
+
+
+def _read_string(content: str, start: int, repairs: Set[str]) -> Tuple[str, int]:
+    """读取 start 处开始的字符串，返回 (合法的 JSON 字符串, 结束后的位置)"""
+    quote = content[start]
+    if quote == "'":
+        repairs.add("single_quotes")
+    buf = ['"']
+    i = start + 1
+    n = len(content)
+    while i < n:
+        c = content[i]
+        if c == "\\":
+            if i + 1 >= n:
+                i += 1
+                break
+            nxt = content[i + 1]
+            if quote == "'" and nxt == "'":
+                buf.append("'")
+            elif nxt in _ESCAPABLE:
+                buf.append(c + nxt)
+            else:
+                buf.append("\\\\" + nxt)
+                repairs.add("invalid_escapes")
+            i += 2
+            continue
+        if c == quote:
+            if _is_string_end(content, i + 1):
+                buf.append('"')
+                return "".join(buf), i + 1
+            # 字符串中间未转义的引号
+            buf.append('\\"' if quote == '"' else "'")
+            repairs.add("inner_quotes")
+        elif c == '"':
+            buf.append('\\"')
+        elif c in _CONTROL_ESCAPES:
+            buf.append(_CONTROL_ESCAPES[c])
+            repairs.add("control_chars")
+        elif ord(c) < 0x20:
+            buf.append(f"\\u{ord(c):04x}")
+            repairs.add("control_chars")
+        else:
+            buf.append(c)
+        i += 1
+    repairs.add("truncated")
+    buf.append('"')
+    return "".join(buf), n
+
+
+def _is_string_end(content: str, pos: int) -> bool:
+    """判断引号是否真的结束了字符串：后面紧跟 , : } ] 、注释、换行后的新内容或输入结束"""
+    n = len(content)
+    saw_newline = False
+    while pos < n and content[pos] in " \t\r\n":
+        saw_newline = saw_newline or content[pos] == "\n"
+        pos += 1
+    if pos >= n or saw_newline:
+        return True
+    return content[pos] in ",:}]#" or content.startswith("//", pos)
+
+
+class IncrementalJSONParser:
+    """
+    增量 JSON 解析器，用于在模型流式生成时提前拿到已完成的字段
+
+    按块喂入模型输出（可以包含 ```json 等前缀），解析器只跟踪顶层对象：
+    - stream_fields 中的数组字段（如 speechText），每个元素在结束引号到达时立即产出
+    - 其他顶层字段在其值完整后产出
+    - 顶层对象闭合时产出完整结果
+
+    产出的事件格式:
+        {"type": "item", "field": str, "index": int, "value": Any}  # 数组字段中新完成的元素
+        {"type": "field", "field": str, "value": Any}  # 完整的顶层字段
+        {"type": "done", "value": Any}  # 完整的顶层 JSON
+    无法解析的片段会被跳过，最终结果仍应以完整输出的解析为准
+    """
+
+    def __init__(self, stream_fields: Iterable[str] = ("speechText",)):
+        self.stream_fields = set(stream_fields)
+        self.done = False
+        self._started = False
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._expect_key = False
+        self._key = None
+        self._item_counts: Dict[str, int] = {}
+        # 正在截取的文本：名称 -> [之前各块中的片段, 在当前块中的起点]
+        # root 为整个 JSON，value 为当前顶层字段的值，string 为需要产出的字符串（顶层的 key / 值、流式数组的元素）；
+        # 每个字符只扫描一次；截取以片段列表保存，结束时拼接一次，新的一块到达时不需要复制之前的输出
+        self._captures: Dict[str, list] = {}
+        self._chunk = ""
+
+    def feed(self, chunk: str) -> List[Dict]:
+        """喂入一段新生成的文本，返回由此新完成的事件"""
+        events: List[Dict] = []
+        self._chunk = chunk
+
+        for i, ch in enumerate(chunk):
+            if self.done:
+                break
+
+            # 跳过 JSON 之前的内容（如 ```json）
+            if not self._started:
+                if ch in "{[":
+                    self._started = True
+                    self._capture("root", i)
+                    self._stack.append(ch)
+                    self._expect_key = ch == "{"
+                continue
+
+            depth = len(self._stack)
+            in_root_object = self._stack[0] == "{"
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if "string" in self._captures:
+                        raw = self._take("string", i + 1)
+                        if depth == 1:
+                            value = self._loads(raw)
+                            if self._expect_key:
+                                self._key = value
+                            else:
+                                self._emit_field(events, value)
+                        else:
+                            self._emit_item(events, raw)
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                if in_root_object and (depth == 1 or (depth == 2 and self._stack[-1] == "[" and self._key in self.stream_fields)):
+                    self._capture("string", i)
+                if depth == 1 and not self._expect_key and "value" not in self._captures:
+                    self._capture("value", i)
+            elif ch in "{[":
+                if depth == 1 and "value" not in self._captures:
+                    self._capture("value", i)
+                self._stack.append(ch)
+            elif ch in "}]":
+                self._stack.pop()
+                if depth == 1:
+                    if in_root_object:
+                        self._flush_primitive(events, self._take("value", i) if "value" in self._captures else "")
+                    self.done = True
+                    value = self._loads(self._take("root", i + 1))
+                    if value is not _INVALID:
+                        events.append({"type": "done", "value": value})
+                elif depth == 2 and in_root_object and "value" in self._captures:
+                    self._emit_field(events, self._loads(self._take("value", i + 1)))
+            elif in_root_object and depth == 1:
+                if ch == ":":
+                    self._expect_key = False
+                elif ch == ",":
+                    if "value" in self._captures:
+                        self._flush_primitive(events, self._take("value", i))
+                    self._expect_key = True
+                elif not ch.isspace() and not self._expect_key and "value" not in self._captures:
+                    # 数字、true/false/null 等没有结束符的值，在遇到 , 或 } 时产出
+                    self._capture("value", i)
+
+        # 还没有结束的截取保存这一块中的部分，下一块从头开始
+        for capture in self._captures.values():
+            capture[0].append(chunk[capture[1]:])
+            capture[1] = 0
+        return events
+
+    def _capture(self, name: str, start: int) -> None:
+        self._captures[name] = [[], start]
+
+    def _take(self, name: str, end: int) -> str:
+        parts, start = self._captures.pop(name)
+        parts.append(self._chunk[start:end])
+        return "".join(parts)
+
+    def _emit_field(self, events: List[Dict], value) -> None:
+        self._captures.pop("value", None)
+        if value is not _INVALID and self._key is not None:
+            events.append({"type": "field", "field": self._key, "value": value})
+
+    def _emit_item(self, events: List[Dict], raw: str) -> None:
+        value = self._loads(raw)
+        if value is _INVALID:
+            return
+        index = self._item_counts.get(self._key, 0)
+        self._item_counts[self._key] = index + 1
+        events.append({"type": "item", "field": self._key, "index": index, "value": value})
+
+    def _flush_primitive(self, events: List[Dict], raw: str) -> None:
+        if raw.strip():
+            self._emit_field(events, self._loads(raw.strip()))
+        self._captures.pop("value", None)
+
+    @staticmethod
+    def _loads(raw: str):
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return _INVALID
+
+
+# 解析失败的占位值（None 本身是合法的 JSON 值）
+_INVALID = object()
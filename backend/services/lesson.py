@@ -1,8 +1,22 @@
-from typing import Dict, List
+from typing import AsyncIterator, Dict, List, Optional
 from enum import Enum
+import asyncio
 import json
-from services.llm_service import LLMService
+import logging
+import os
+from services.deadline import DeadlineExceeded
+from services.llm_service import LLMService, get_llm_service
+from services.conversation_window import ConversationWindow
+from services.prompt_format import compact
+from services.prompt_registry import LANGUAGE_NAMES, get_prompt_registry, language_name
+from services.structured_logging import log_payload
 from models.lesson_models import Message, CreateLessonRequest, SummaryLessonRequest
+from models.output_schemas import (LESSON_CREATE_SCHEMA, LESSON_TURN_SCHEMA, LESSON_REPLY_SCHEMA, LESSON_DIAGNOSE_SCHEMA,
+                                   LESSON_STEPS_SCHEMA, LESSON_EVALUATION_SCHEMA, WEEKLY_SUMMARY_SCHEMA)
+from models.output_models import (LessonCreate, LessonTurn, LessonReply, LessonDiagnose, LessonSteps, LessonEvaluation,
+                                  WeeklySummary)
+
+logger = logging.getLogger(__name__)
 
 class LessonMode(Enum):
     STUDY = "study"
@@ -10,18 +24,21 @@ class LessonMode(Enum):
 
 class LessonService:
     # 语言代码到语言名称的映射
-    LANGUAGE_NAMES = {
-        "cmn-CN": "中文",
-        "en-US": "English",
-        "fr-FR": "French",
-        "es-ES": "Spanish",
-        "de-DE": "German",
-        "ja-JP": "Japanese",
-        "ko-KR": "Korean"
-    }
+    LANGUAGE_NAMES = LANGUAGE_NAMES
+    # 对学习者最后一句话的诊断（diagnose）：inline 与老师的回复在同一次调用中生成；
+    # split 只生成老师的回复，诊断由 diagnose_turn 在另一次调用中生成，不占用老师回复的生成时间
+    DIAGNOSE_MODES = ("inline", "split")
+    # diagnose_turn 作为上下文发送的最近几条对话
+    DIAGNOSE_CONTEXT_MESSAGES = 4
     
-    def __init__(self):
-        self.llm_service = LLMService()
+    def __init__(self, llm_service: Optional[LLMService] = None):
+        self.llm_service = llm_service or get_llm_service()
+        # 长对话只保留最近的若干轮原文，更早的部分压缩为摘要
+        self.conversation_window = ConversationWindow(self.llm_service)
+        # 系统提示词模板，按语言和模式编译一次后缓存，见 services/prompt_templates/lesson.py
+        self.prompts = get_prompt_registry()
+        # 请求没有指定 diagnose 时使用的方式
+        self.diagnose_mode = os.getenv('LESSON_DIAGNOSE_MODE', 'inline').lower()
         
     def get_language_name(self, lang_code: str) -> str:
         """
@@ -34,7 +51,7 @@ class LessonService:
             语言的完整名称，如 "中文", "English" 等
         """
         # 如果找不到对应的语言名称，则返回代码本身
-        return self.LANGUAGE_NAMES.get(lang_code, lang_code)
+        return language_name(lang_code)
     
     def should_use_english_prompt(self, native_lang: str) -> bool:
         """
@@ -52,51 +69,28 @@ class LessonService:
         # 只有中文母语使用中文提示，其他语言都使用英语提示
         return True
 
-    async def create_lesson(self, request: CreateLessonRequest, native_lang: str, learning_lang: str) -> Dict:
-        # 获取语言名称
+    async def create_lesson(self, request: CreateLessonRequest, native_lang: str, learning_lang: str, steps: bool = False) -> Dict:
+        """
+        生成课程的开场白；steps 为 True 且是学习模式时同时把课程编排为步骤（compile_steps），
+        返回中增加 steps，由 services/lesson_steps.py 按步骤进行课程
+        """
         # 生成系统提示和欢迎消息
         mode = LessonMode.STUDY if request.mode == "study" else LessonMode.PRACTICE
-        native_language_name = self.get_language_name(native_lang)
-        learning_language_name = self.get_language_name(learning_lang)
-        if mode == LessonMode.PRACTICE:  # 角色扮演模式
-            # 构建场景资源提示
-            system_prompt = f"""You are a professional {learning_language_name} teacher, designing a role-playing scenario for a {native_language_name} mother tongue learner.
-            Based on the information provided by the user to build a role-playing scenario. Need to set a completion goal to ensure this scenario is based on the user's level and challenging, 
-            and add some random events to ensure the scenario is different each time.
-            
-            Important guidelines:
-            1. For each response, provide two fields, displayText and speechText:
-               - displayText: 基于课程信息生成一个场景，对场景进行简单描述，并且分配bot和user的角色，显示本场景设定达到的目标以及所需的一些信息，用markdown格式方便清晰的描述。为方便在手机上显示而优化。
-               如是问路的场景，你可以用markdown提供一个地图，设定一个当前位置和目的地，看用户能否能用{learning_language_name}正确指路。如是餐厅的场景，
-               你可以提供带价格的菜单，看用户能否按要求(如必须含有2份主食，吃素，有忌口或者价格限定在多少范围内)搭配点餐. Please use {native_language_name}.
-               - speechText: 你作为bot, based on the role in displayText, generate an opening statement, if you should not speak first, return an empty array, the opening statement should be concise, for convenience of speech synthesis, divide into sentences.
-            
-            """
-        else:  # 学习模式
-            system_prompt = f"""You are a professional {learning_language_name} teacher helping one {native_language_name} mother tongue learner learn {learning_language_name} language.
-            基于下面提供的课程信息和用户信息，课程信息和用户信息可能用各国语言提供，你只要理解课程的意思即可。你需要规划今天的课程大纲，并且生成一个开场语。生成大纲时请考虑用户目前的语言水平和用户年龄，如用户{learning_language_name}水平较低，请使用尽量基础的单词和句型。
-            
-            Important guidelines:
-            1. Return two fields, displayText and speechText:
-            displayText field: Plan today's course outline in markdown format, optimized for display on a mobile device.
-            speechText field: Teacher's voice output content, divide into sentences for convenience of speech synthesis.
-            
-            2. This is a one-on-one teaching scenario, so you should plan the outline based on the student's level and the content to be learned.
-            """
-        
+        system_prompt = self.prompts.render("lesson_create", native_lang, learning_lang, variant=mode.value)
+
         # 使用structured_chat生成带格式的欢迎语
-        output_format = '''
-        Return format must be json format, as follows:
-        {
-            "speechText": string[],  # Required speech content, divided into sentences, do not use special characters like asterisks, brackets, pinyin, etc. which may cause speech synthesis errors
-            "displayText": str  # Display content, support markdown format
-        }
-        '''
-        
-        result = await self.llm_service.structured_chat(
-            messages=[{"role": "system", "content": system_prompt + output_format},
-            {"role": "user", "content": str(request)}]
+        welcome = self.llm_service.structured_chat(
+            messages=[{"role": "system", "content": system_prompt},
+            {"role": "user", "content": compact(request)}],
+            response_schema=LESSON_CREATE_SCHEMA,
+            output_model=LessonCreate,
+            profile="lesson_create"
         )
+        compiled = None
+        if steps and mode == LessonMode.STUDY:
+            result, compiled = await asyncio.gather(welcome, self.compile_steps(request, native_lang, learning_lang))
+        else:
+            result = await welcome
 
         displayText = result["displayText"]
         speechText = result["speechText"]
@@ -110,12 +104,33 @@ class LessonService:
             )
         ]
         
+        if compiled is None:
+            return {
+                "conversation_history": initial_conversation,
+                "usage": result["usage"]
+            }
         return {
             "conversation_history": initial_conversation,
-            "usage": result["usage"]
+            "steps": compiled["steps"],
+            "usage": LLMService._merge_usage(result["usage"], compiled["usage"])
         }
 
-    async def conduct_lesson(self, lesson_content: Dict, user: Dict = None, user_message: str = None, conversation_history: List[Dict] = None, native_lang: str = "cmn-CN", learning_lang: str = "en-US") -> Dict:
+    async def compile_steps(self, request: CreateLessonRequest, native_lang: str, learning_lang: str) -> Dict:
+        """
+        把学习模式的课程编排为按顺序进行的 LessonStep（每节课只生成一次，相同的课程命中 LLM 缓存）
+        返回 {"steps": [LessonStep 格式的 dict], "usage": {...}}
+        """
+        system_prompt = self.prompts.render("lesson_steps", native_lang, learning_lang)
+        response = await self.llm_service.structured_chat(
+            messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": compact(request)}],
+            response_schema=LESSON_STEPS_SCHEMA,
+            output_model=LessonSteps,
+            cache=True,
+            profile="lesson_steps"
+        )
+        return {"steps": response.get("steps", []), "usage": response.get("usage", None)}
+
+    async def conduct_lesson(self, lesson_content: Dict, user: Dict = None, user_message: str = None, conversation_history: List[Dict] = None, native_lang: str = "cmn-CN", learning_lang: str = "en-US", diagnose: Optional[str] = None, step_instruction: Optional[str] = None) -> Dict:
         """
         进行实时互动教学，处理用户输入并返回适当的响应
         返回格式：
@@ -123,208 +138,201 @@ class LessonService:
             "speechText": str,  # 必须的语音内容
             "displayText": str  # 可选的展示内容，支持markdown格式
         }
+        diagnose 为 split 时返回的 diagnose 为 None，诊断通过 diagnose_turn 获取；
+        step_instruction 为按步骤进行的课程中当前步骤的指令（见 services/lesson_steps.py）
         """
         try:
-            # 使用传入的对话历史或创建新的
-            if conversation_history is None:
-                conversation_history = []
-                
-            # 获取语言名称
-            native_language_name = self.get_language_name(native_lang)
-            target_language_name = self.get_language_name(learning_lang)
-            
-            # 构建系统提示
-            system_prompt = None
-            if lesson_content["mode"] == LessonMode.STUDY.value:
-                system_prompt = f"""You are a knowledgeable and professional {target_language_name} teacher, you are Polly, an American born in San Francisco, who has a deep understanding of {target_language_name} culture. 
-                Course content: {lesson_content}
-                User info: {user}
-            
-            1. 你需要结合上面的课程内容, 用户信息以及下面提供的对话，结合场景和主题，通过和user探讨的方式，来一步一步的引导user完成本次{target_language_name}学习。这是一个一对一的教学，请保证充分的互动。
-
-            2. 请使用{target_language_name}语言，不要出现其他语言内容。并且你需要根据用户的年龄和{target_language_name}语言水平来决定你使用语言的难易度。如用户年龄较小或{target_language_name}水平较低，请使用尽量基础的单词和句型，限定词汇量。
-            另外，如果对话过程中用户表示太难了或者听不懂，你可以用更简单的方式重新解释，并且之后也一直保持简单，往下调低难度，限定词汇量等。
-
-            3. 如果用户确实一点都不懂{target_language_name}, 你可以在displayText中以{native_language_name}显示每句话的翻译，但是你始终都以{target_language_name}来说。
-
-            Important guidelines:
-            1. 返回以json格式需要三个字段, diagnose, displayText和speechText：
-            diagnose字段: 分析user最后一句对话，主要评测语法是否有错，单词短语使用是否准确，任务完成度，在当前语境下是否合适，发音是否正确等。
-            speechText字段: 格式为字符串数组，教师说话的内容，Please use {target_language_name} language，所以不要出现其他语言内容或者特殊字符如星号括号拼音等不方便语音合成的内容，内容分为一句一句的，方便语音合成播放。
-            displayText字段: 尽量不显示，除非讲解中需要用到文字不好描述的内容，如展示一份菜单、地图等。在displayText字段以markdown格式显示，如无需要则置为空字符串即可。
-                             如果学习课程内容完成并通过实际场景练习确认了学生的学习效果，则在displayText输出<end_of_lesson>。
-
-            2. 始终记得自己是一个{target_language_name}教师，既要及时解答user的疑问，也要基于下面的教学大纲来完成本课的内容。被打断了要记得及时回到课程内容上来。
-            教学中要充分保证互动，以确认user的学习效果。
-            3. user的对话是通过语音识别输入，所以如果有单词让你疑惑或出现少数其他文字，可能是语音识别的问题，也可能是user发音不标准造成语音识别的问题，你可以猜测user的意思进行回答即可。
-            4. 你一次说话不要太长，需要鼓励user多说，让user参与到对话中来。如果明显用户没有说完，你可以提示user继续说。
-            5. 如果用户要求说慢一点，你可以在speechText中的word间加上...来让TTS变慢
-            6. 如果用户明显没有说完，你可以提示user继续说。
-            7. 如果需要用户跟读的情况，不要仅跟读单词，这样语音识别容易出问题，请融入到一句话中。
-
-            注意：返回格式只需要json格式，返回前你需要再次确认你的返回是json格式，不论对话有多长，一定不要忘记这个rule，json格式如下：
-            {{
-                "diagnose": [{{ # 仅分析user最后的一句话，是否存在语法，单词，结构，上下文错误，发音错误(因为使用的语音识别可能犯错，这里的判断尽量放松一些)，如无错误则返回空数组。
-                    "type": str,  # 错误类型必须为：Grammar, Vocabulary, Structure, Context，Pronunciation
-                    "description": str,  # 错误描述，引号引用原文，说明错误原因，please use {native_language_name} language
-                    "correct": str  # 正确的{target_language_name}表达
-                }}],
-                "speechText": string[],  # Please use {target_language_name} language, do not use other languages or special characters like asterisks, brackets, pinyin, etc. which may cause speech synthesis errors, divide into sentences for convenience of speech synthesis.
-                "displayText": str  # 默认为空，除非要展示一些语音不好描述的内容，如展示一份菜单、地图等，support markdown format, default use {target_language_name}, also can use {native_language_name}.
-            }}
-            """
-            else:  # PRACTICE mode
-                system_prompt = f"""You are in a role-playing scenario for {target_language_name}. Stay in character and respond naturally based on your role.        
-            场景内容如下：
-            {lesson_content}
-    
-            场景设定和需要完成的目标由下面的第一个message的displayText字段提供。在实现目标的过程中，随机给用户2-3个突发情况。如目标是超市购买指定的牛油果，按店员
-            指导到相应货架后发现没有牛油果了，你可以在完成第一轮对话后通过displayText字段说明这个突发情况，并提示用户于是你找到了店员，然后让用户继续进行会话。
-
-            Important guidelines:
-            1. For each response, provide two fields:
-            - diagnose字段: 对下面user的最后一句对话进行诊断，主要评测语法是否有错，单词短语使用是否准确，任务完成度，在当前语境下是否合适等。
-            - displayText: 默认为空，当需要转场描述或者展示场景中需要用到的菜单、列表、文档等时才使用markdown格式显示，因为在手机侧显示，生成markdown时注意不要显示太长以至于一屏都装不下，Please use {target_language_name} language or {native_language_name} language.
-            - speechText: bot角色说话的内容，必须是方便TTS的文本内容，不要出现特殊字符如星号括号等不方便读的，按内容分为一句一句的，方便语音合成播放。Please use {target_language_name} language.
-            
-            要求：
-            1. 完全按照角色设定进行对话，注意任务目标是用户需要完成的任务，你扮演的角色并不知道。所以不要提示用户需要完成任务。
-            2. 不要做教学解释，始终保持你的身份，说你的角色该说的话。
-            3. user的会话是通过语音识别输入的，所以如果有单词让你疑惑或者出现少数其他语言文字，可能是语音识别的问题，也可能是用户发音不标准的问题，你可以猜测用户的意思进行回答即可。
-            4. 如果user使用非{target_language_name}语言，用{target_language_name}以符合角色的方式表达自己不太懂其他语言，让对方用{target_language_name}简单描述。
-            5. 当完成场景目标或者结束对话时，displayText中输出<end_of_lesson>以结束课程
-            6. 记住只有说话的内容是放在speechText中，如果要有场景描述或者旁白，都放在displayText中
-            7. 如果用户明显没有说完，你可以提示user继续说。
-            8. 如果用户要求说慢一点，你可以在speechText中的word间加上...来让TTS变慢
-
-            返回格式只需要json格式，如下：
-            {{
-                "diagnose": [{{ # 仅分析user最后的一句话，是否存在语法，单词，结构，上下文错误，发音错误(因为使用的语音识别可能犯错，这里的判断尽量放松一些)，如无错误则返回空数组。
-                    "type": str,  # 错误类型必须为：Grammar, Vocabulary, Structure, Context，Pronunciation
-                    "description": str,  # 错误描述，引号引用原文，说明错误原因，please use {native_language_name} language
-                    "correct": str  # 正确的{target_language_name}表达
-                }}],
-                "speechText": string[],  # 必须是{target_language_name}语言，不要出现其他语言内容或者特殊字符如星号、括号、拼音等不方便语音合成的内容，内容分为一句一句的。
-                "displayText": str  # 可选的展示内容，支持markdown格式，默认使用{target_language_name},如有需要也能使用{native_language_name}。
-            }}
-                """
-
-            # 处理用户消息
-            if user_message is None and not conversation_history:
-                conversation_history = [
-                    {"role": "user", "content": "continue."}
-                ]
-
-            # 在调用 structured_chat 前，将 system_prompt 添加到 conversation_history 的开头
-            messages_with_system = conversation_history.copy()
-            # 循环messages_with_system将speechText删除
-            messages_with_system = [{"role": "user", "content": "\n".join([
-                (f"\nDisplayText: {msg['displayText']}" if msg.get("displayText") else "") +
-                f"{msg['role'].capitalize()}: {msg['content']}"
-                for msg in messages_with_system
-            ])}]
-            #打印messages_with_system的最后一句
-            print("user message:", messages_with_system[-1])
-            messages_with_system.insert(0, {"role": "system", "content": system_prompt})
-
+            split = self._split_diagnose(diagnose)
+            messages_with_system = self._build_lesson_messages(
+                lesson_content, user, user_message, conversation_history, native_lang, learning_lang, split, step_instruction
+            )
             
             response = await self.llm_service.structured_chat(
-                messages=messages_with_system
+                messages=messages_with_system,
+                response_schema=LESSON_REPLY_SCHEMA if split else LESSON_TURN_SCHEMA,
+                output_model=LessonReply if split else LessonTurn,
+                profile="lesson_turn"
             )
             
-            # 解析JSON响应
-            formatted_response = {
-                "role": "assistant",
-                "content": response.get("speechText", response.get("content")),
-                "speechText": response.get("speechText", response.get("content")),
-                "displayText": response.get("displayText", ""),
-                "diagnose": response.get("diagnose", ""),
-                "usage": response.get("usage", None)
-            }
-            
-            return formatted_response
+            return self._format_lesson_response(response, split)
 
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             raise Exception(f"Lesson interaction failed: {str(e)}")
 
+    async def conduct_lesson_stream(self, lesson_content: Dict, user: Dict = None, user_message: str = None, conversation_history: List[Dict] = None, native_lang: str = "cmn-CN", learning_lang: str = "en-US", diagnose: Optional[str] = None, step_instruction: Optional[str] = None) -> AsyncIterator[Dict]:
+        """
+        流式版本的 conduct_lesson，边生成边返回模型输出
+        
+        产出 LLMService.stream_structured_chat 的事件（delta/item/field），
+        每句 speechText 完成时即产出 item 事件，可立即送去语音合成；
+        最后的 done 事件的 value 与 conduct_lesson 的返回相同
+
+        diagnose 为 split 时诊断与老师的回复同时生成，完成后产出 diagnose 事件
+        （value 为 diagnose_turn 的返回，失败时 diagnose 为 None），可能在 done 之前或之后
+        """
+        diagnosis = None
+        try:
+            split = self._split_diagnose(diagnose)
+            messages_with_system = self._build_lesson_messages(
+                lesson_content, user, user_message, conversation_history, native_lang, learning_lang, split, step_instruction
+            )
+            if split:
+                diagnosis = asyncio.ensure_future(self._diagnose_or_none(user_message, conversation_history, native_lang, learning_lang))
+
+            async for event in self.llm_service.stream_structured_chat(
+                    messages_with_system,
+                    response_schema=LESSON_REPLY_SCHEMA if split else LESSON_TURN_SCHEMA,
+                    output_model=LessonReply if split else LessonTurn,
+                    profile="lesson_turn"):
+                if event["type"] == "done":
+                    event = {"type": "done", "value": self._format_lesson_response(event["value"], split)}
+                yield event
+                if diagnosis is not None and diagnosis.done():
+                    yield {"type": "diagnose", "value": diagnosis.result()}
+                    diagnosis = None
+
+            if diagnosis is not None:
+                yield {"type": "diagnose", "value": await diagnosis}
+                diagnosis = None
+
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            raise Exception(f"Lesson interaction failed: {str(e)}")
+        finally:
+            # 老师的回复失败或客户端断开时不再等待诊断
+            if diagnosis is not None:
+                diagnosis.cancel()
+
+    async def diagnose_turn(self, user_message: str, conversation_history: List[Dict] = None, native_lang: str = "cmn-CN", learning_lang: str = "en-US") -> Dict:
+        """
+        诊断学习者的最后一句话（diagnose 为 split 时使用），只发送最近几条对话作为上下文，
+        使用 lesson_diagnose 的模型配置（见 services/llm_profiles.py）
+        返回 {"diagnose": [...], "usage": {...}}
+        """
+        context = [{"role": msg.get("role"), "content": msg.get("content", "")}
+                   for msg in (conversation_history or [])[-self.DIAGNOSE_CONTEXT_MESSAGES - 1:]]
+        # 对话历史中可能已经包含了这句话
+        if context and context[-1]["role"] == "user" and context[-1]["content"] == user_message:
+            context.pop()
+        context = context[-self.DIAGNOSE_CONTEXT_MESSAGES:]
+
+        system_prompt = self.prompts.render("lesson_diagnose", native_lang, learning_lang)
+        response = await self.llm_service.structured_chat(
+            messages=[{"role": "system", "content": system_prompt},
+                      {"role": "user", "content": compact({"context": context, "user_message": user_message})}],
+            response_schema=LESSON_DIAGNOSE_SCHEMA,
+            output_model=LessonDiagnose,
+            profile="lesson_diagnose"
+        )
+        return {"diagnose": response.get("diagnose", []), "usage": response.get("usage", None)}
+
+    async def _diagnose_or_none(self, user_message: str, conversation_history: List[Dict], native_lang: str, learning_lang: str) -> Dict:
+        """流式课程中的诊断失败时不影响老师的回复"""
+        try:
+            return await self.diagnose_turn(user_message, conversation_history, native_lang, learning_lang)
+        except Exception as e:
+            logger.warning(f"Lesson diagnose failed: {e}")
+            return {"diagnose": None, "usage": None}
+
+    def _split_diagnose(self, diagnose: Optional[str]) -> bool:
+        mode = (diagnose or self.diagnose_mode).lower()
+        if mode not in self.DIAGNOSE_MODES:
+            raise ValueError(f"Unknown diagnose mode {mode}, expected one of {', '.join(self.DIAGNOSE_MODES)}")
+        return mode == "split"
+
+    def _build_lesson_messages(self, lesson_content: Dict, user: Dict = None, user_message: str = None, conversation_history: List[Dict] = None, native_lang: str = "cmn-CN", learning_lang: str = "en-US", split: bool = False, step_instruction: Optional[str] = None) -> List[Dict]:
+        """
+        构建一轮教学对话发送给模型的消息
+
+        为了命中 provider 的前缀缓存（Gemini 隐式缓存、DashScope 上下文缓存），消息按变化频率排列：
+        固定的教学指令在最前面，然后是本课的课程内容和用户信息（同一节课内不变，按固定顺序序列化），
+        最后是逐轮追加的对话，同一节课中每一轮的消息前缀都与上一轮完全相同；
+        对话较长时由 ConversationWindow 把较早的部分替换为摘要；
+        step_instruction 追加在最后一条 user 消息之后，不改变前面的消息
+        """
+        # 使用传入的对话历史或创建新的
+        if conversation_history is None:
+            conversation_history = []
+            
+        # 构建系统提示：固定的教学指令按语言和模式缓存
+        mode = LessonMode.STUDY if lesson_content["mode"] == LessonMode.STUDY.value else LessonMode.PRACTICE
+        variant = f"{mode.value}_split" if split else mode.value
+        system_prompt = self.prompts.render("lesson_turn", native_lang, learning_lang, variant=variant)
+
+        # 本课的上下文放在固定指令之后
+        if lesson_content["mode"] == LessonMode.STUDY.value:
+            lesson_context = f"Course content: {compact(lesson_content)}\nUser info: {compact(user)}"
+        else:
+            lesson_context = f"Scenario content: {compact(lesson_content)}"
+        system_prompt = system_prompt + "\n\n" + lesson_context
+
+        # 处理用户消息
+        if user_message is None and not conversation_history:
+            conversation_history = [
+                {"role": "user", "content": "continue."}
+            ]
+
+        messages_with_system = [{"role": "system", "content": system_prompt}]
+        messages_with_system.extend(self._history_turns(self.conversation_window.apply(conversation_history)))
+        if step_instruction:
+            if messages_with_system[-1]["role"] == "user":
+                messages_with_system[-1] = {"role": "user", "content": messages_with_system[-1]["content"] + "\n\n" + step_instruction}
+            else:
+                messages_with_system.append({"role": "user", "content": step_instruction})
+        log_payload(logger, "Lesson last message", messages_with_system[-1])
+        return messages_with_system
+
+    @staticmethod
+    def _history_turns(conversation_history: List[Dict]) -> List[Dict]:
+        """
+        把对话历史转换为逐条追加的消息：user 保持原文，assistant 以模型当时输出的 JSON 格式表示
+        （speechText 和 displayText），帮助模型保持输出格式；连续相同角色的消息合并为一条
+        """
+        # 课程由老师的开场白开始，部分 provider 要求第一条消息必须是 user，这里补一条固定的消息
+        turns = [{"role": "user", "content": "start."}]
+        for msg in conversation_history:
+            role = msg.get("role", "user")
+            if role not in ("user", "assistant"):
+                role = "user"
+            if role == "assistant":
+                speech_text = msg.get("speechText") or [msg.get("content", "")]
+                content = compact({"speechText": speech_text, "displayText": msg.get("displayText")})
+            elif msg.get("displayText"):
+                content = f"DisplayText: {msg['displayText']}\n{msg.get('content', '')}"
+            else:
+                content = msg.get("content", "")
+            if turns and turns[-1]["role"] == role:
+                turns[-1]["content"] += "\n" + content
+            else:
+                turns.append({"role": role, "content": content})
+        return turns
+
+    def _format_lesson_response(self, response: Dict, split: bool = False) -> Dict:
+        """
+        将模型返回的 JSON 整理为教学对话的响应格式，split 时 diagnose 为 None（单独生成）
+        """
+        return {
+            "role": "assistant",
+            "content": response.get("speechText", response.get("content")),
+            "speechText": response.get("speechText", response.get("content")),
+            "displayText": response.get("displayText", ""),
+            "diagnose": None if split else response.get("diagnose", ""),
+            "usage": response.get("usage", None)
+        }
+
 
     async def summary_lesson(self, request: SummaryLessonRequest, native_lang: str = "cmn-CN", learning_lang: str = "en-US") -> Dict:
         from datetime import datetime
         current_date = datetime.now().strftime("%Y-%m-%d")
-        native_language_name = self.get_language_name(native_lang)
-        target_language_name = self.get_language_name(learning_lang)
-            
-        system_prompt = f"""你是一个{target_language_name}教育专家，本次课程为{request.mode}模式. 今天的日期是：{current_date}
-
-        本次课程的内容，用户信息和对话都在下面的用户输入中,其中user表示用户的对话，assistant表示bot的回复。user的会话前缀是[voice]表示用户是通过语音输入，
-        所以如果有单词让你疑惑可能是用户发音不标准的问题，你可以猜测用户的意思进行回答即可。前缀[text]表示用户是通过文字输入，那可能存在一些拼写错误。
-
-        TASK：The conversation is a {native_language_name} speaker study {target_language_name}.Please use {native_language_name} language generate a markdown report, 
-        the report format example is as follows, you need to translate it to {native_language_name} language, only output correct and valid markdown format report, 
-        do not add other descriptions:
-
-        # 📊 对话评估报告
-
-> **对话主题**：`[填写主题]`  
-> **日期**：`{current_date}`  
-
----
-
-## 🎯 表现概述
-- **整体理解度**：`[对用户理解程度的总体评价]`
-- **互动积极性**：`[描述用户在对话中的参与度]`
-- **关键亮点**：
-  - ✅ `[用户展现出的亮点 1]`
-  - ✅ `[用户展现出的亮点 2]`
-  - ✅ `[用户展现出的亮点 3]`
-- **需要改进**：
-  - 🔄 `[需要改进的方面 1]`
-  - 🔄 `[需要改进的方面 2]`
-
----
-
-## 📌 知识掌握情况
-| 评估维度 | 评价 |
-|---------|------|
-| **核心概念理解** | `[浅显 / 部分掌握 / 较好 / 熟练]` |
-| **实践应用能力** | `[弱 / 一般 / 良好 / 熟练]` |
-| **逻辑表达能力** | `[需要提升 / 清晰流畅 / 优秀]` |
-| **自主思考能力** | `[较弱 / 需要引导 / 主动思考]` |
-
----
-
-## 📈 互动与反馈分析
-- **学生提问情况**：
-  - `[是否有深度问题，或仅停留在表面问题]`
-  - `[提问是否能促进对话继续]`
-- **回答质量**：
-  - `[是否能完整表达自己的想法]`
-  - `[是否能结合案例或个人理解]`
-- **对关键知识点的反应**：
-  - `[哪些内容学生反应积极]`
-  - ⚠️ `[哪些内容学生较为困惑]`
-
----
-
-## 🎯 未来学习建议
-- **强化学习内容**：
-  - 📖 `[建议复习的知识点]`
-  - 🏗 `[推荐进一步练习的方法]`
-- **提升互动表现**：
-  - 🎤 `[如何更主动表达自己的观点]`
-  - 🔍 `[如何提高沟通能力]`
-- **个性化学习建议**：
-  - 🎯 `[根据学生特点给出的具体建议]`
-
----
-
-## 📎 总结
-> `[用一句话总结这节课学生的整体学习效果]`
-
-        """
+        system_prompt = self.prompts.render("lesson_summary", native_lang, learning_lang, mode=request.mode, current_date=current_date)
         
         response = await self.llm_service.chat_completion(
-            messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": str(request)}]  #, model="pkqwq:latest"
+            messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": compact(request)}],
+            cache=True,
+            profile="lesson_summary"
         )
         report = response["content"]
         if report.startswith("\"") and report.endswith("\""):
@@ -338,45 +346,14 @@ class LessonService:
     async def evaluate_lesson(self, request: SummaryLessonRequest, native_lang: str = "cmn-CN", learning_lang: str = "en-US") -> Dict:
         from datetime import datetime
         current_date = datetime.now().strftime("%Y-%m-%d")
-
-        native_language_name = self.get_language_name(native_lang)
-        target_language_name = self.get_language_name(learning_lang)
-        
-        system_prompt = f"""你是一个{target_language_name}教育专家，本次{target_language_name}课程为{request.mode}模式。
-        今天的日期是：{current_date}
-
-        本次课程的内容、用户信息以及对话见后。其中user表示用户的对话，assistant表示助手的回复。
-        user的会话是通过语音识别输入，所以如果有单词让你疑惑或者出现其他语言的文字，可能是语音识别问题，当然也可能是用户发音不标准的问题，你可以猜测用户的意思进行回答即可。评分时适当放宽这方面的问题。
-        TASK: 你的任务是基于这些信息评估学生本课的完成情况以及本课中表现的英语水平。Please use {native_language_name} language to describe the reason.
-
-        英语水平评测标准为
-9分 专家水平：具有完全的英语运用能力，做到适当、精确、流利并能完全理解语言
-8分 优秀水平：能将英语运用自如,只是有零星的错误或用词不当，在不熟悉语境下可能出现误解，可将复杂细节的争论掌握的相当好
-7分 良好水平：能有效运用英语,虽然偶尔出现不准确、不适当和误解，大致可将复杂的英语掌握的不错，也能理解详细的推理
-6分 合格水平：大致能有效运用英语，虽然有不准确、不适当和误解发生，能使用并理解比较复杂的英语，特别是在熟悉的语境下
-5分 基础水平：可部分运用英语，虽然经常出现错误，但在大多数情况下可明白大致的意思，在经常涉及的领域内可应付基本的沟通
-4分 有限水平：只限在熟悉的状况下有基本的理解力，在理解与表达上常发生问题，无法使用复杂英语
-3分 极有限水平：在极熟悉的情况下也只能进行一般的沟通，频繁发生沟通障碍
-2分 初学水平：难以听懂或者看懂英语
-1分 不懂英语：掌握个别单词，几乎无法交流，最多能说出个别单词，根本无法用英语沟通
-0分 英语0基础：完全不懂英语，英语有多少字母都不知道
-
-        输出格式为有效的json，格式如下：
-        {{
-            "text": str,  # 一句话总结评分原因, Please use {native_language_name} language.
-            "eval": {{
-                "score": int,  # 本课的完成情况，1-3分，3分最高，表示完成了课程要求的所有内容，2分表示完成了课程要求的大部分要求，1分最低，表示大部分要求没有完成。
-                "reason": str  # 评级原因，如"要求进行的练习没有完成，或者回答的内容不够详细。", Please use {native_language_name} language.
-                }}
-            "level": {{
-                "score": number,  # 综合得分, 按上面的雅思口语评分标准，得分0-9
-                "reason": str  # 得分原因，如合格水平：大致能有效运用英语，虽然有不准确、不适当和误解发生，能使用并理解比较复杂的英语，特别是在熟悉的语境下. Please use {native_language_name} language.
-            }}
-        }}
-        """
+        system_prompt = self.prompts.render("lesson_evaluate", native_lang, learning_lang, mode=request.mode, current_date=current_date)
         
         response = await self.llm_service.structured_chat(
-            messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": str(request)}]
+            messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": compact(request)}],
+            response_schema=LESSON_EVALUATION_SCHEMA,
+            output_model=LessonEvaluation,
+            cache=True,
+            profile="lesson_evaluate"
         )
         return response
 
@@ -386,31 +363,17 @@ class LessonService:
         生成每周学习总结和下周计划
         """
         try:
-            # 获取语言名称
-            native_language_name = self.get_language_name(native_lang)
-            target_language_name = self.get_language_name(learning_lang)
-            
-            system_prompt = f"""你是一个{target_language_name}教育专家，一位{native_language_name}母语的学习者本周学习报告如下，你需要生成一份总结报告。
-        根据这一周的报告的平均水平以及用户当前水平评价是否需要调整用户的水平评价(level:0-9的雅思口语标准)和语速(speed：slowest, slow, normal),
-        如需调整就加入到action中，否则action为空。注意一定要是变化明显的时候才调整，避免频繁调整。
-        输出格式为json，格式如下：
-        {{
-            "summary": str,  # 本周学习重点回顾
-            "achievements": str,  # 进步与成就
-            "weaknesses": str,  # 需要加强的领域
-            "suggestions": str,  # 下周学习建议
-            "action": [{{
-                "type": str, # 行为类型，目前只有level和speed
-                "value": str, # 行为值
-                "reason": str # 行为原因
-            }}]
-        }}
-        """
+            system_prompt = self.prompts.render("weekly_summary", native_lang, learning_lang)
         
             response = await self.llm_service.structured_chat(
-                messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": str(request)}]
+                messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": compact(request)}],
+                response_schema=WEEKLY_SUMMARY_SCHEMA,
+                output_model=WeeklySummary,
+                profile="weekly_summary"
             )
             return response
 
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             raise Exception(f"Weekly summary generation failed: {str(e)}")
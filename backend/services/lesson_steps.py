@@ -0,0 +1,210 @@
+import logging
+import os
+import re
+from typing import AsyncIterator, Dict, List, Optional, Union
+
+from services.lesson import LessonService
+from services.metrics import metrics
+from services.prompt_format import compact
+
+logger = logging.getLogger(__name__)
+
+# 模型在 displayText 中输出这个标记表示学生完成了当前步骤的练习
+STEP_COMPLETE = "<step_complete>"
+
+_SENTENCE_END = re.compile(r"(?<=[.!?。！？])\s+")
+# 比较确认语时忽略的标点和空白
+_ACK_PUNCTUATION = re.compile(r"[\s.,!~。，！、～…]+")
+
+
+class LessonStepEngine:
+    """
+    按步骤进行的学习模式课程（步骤由 LessonService.compile_steps 在创建课程时生成一次）
+
+    会话中保存 steps（LessonStep 格式的 dict）和 step_state {"index", "active", "turns"}：
+    - 讲解性的步骤（requires_interaction 为 false）不调用模型，直接返回步骤中预先生成的 speechText 和展示内容
+    - 需要互动的步骤调用模型，系统提示不变，当前步骤作为指令追加在最后一条 user 消息之后；
+      模型输出 <step_complete> 或者达到最大轮数时进入下一个步骤，下一个步骤的内容接在模型的回复之后
+    - 不在互动步骤中时，学生的确认语（ACKNOWLEDGEMENTS，如 "OK"、"好的"）直接进入下一个步骤；
+      其他输入由模型结合当前步骤回答，模型输出 <step_complete> 或者达到最大轮数时再返回下一个步骤
+    """
+    # 视为 "继续" 的输入（小写，去掉标点和空白后比较）；语音识别的结果通常没有标点，
+    # 不能按长度或问号判断，"what does that mean"、"不懂" 这样的输入都要交给模型
+    ACKNOWLEDGEMENTS = frozenset({
+        "ok", "okay", "ok thanks", "okay thanks", "yes", "yeah", "yep", "sure", "alright", "all right",
+        "got it", "i see", "i got it", "understood", "next", "continue", "go on", "lets go", "let's go",
+        "ready", "im ready", "i'm ready", "thank you", "thanks", "good", "great", "cool",
+        "好", "好的", "好啊", "嗯", "嗯嗯", "是的", "对", "继续", "明白", "明白了", "知道了", "懂了", "可以",
+        "下一步", "下一个", "开始吧", "谢谢",
+        "はい", "わかりました", "次", "네", "알겠어요",
+    })
+
+    def __init__(self, lesson_service: LessonService):
+        self.lesson_service = lesson_service
+        # 一个互动步骤（或两个讲解步骤之间的提问）最多进行的轮数，超过后自动进入下一个步骤
+        self.max_turns = int(os.getenv('LESSON_STEP_MAX_TURNS', '4'))
+
+    @staticmethod
+    def initial_state() -> Dict:
+        return {"index": 0, "active": False, "turns": 0}
+
+    def route(self, session: Dict, user_input: str) -> str:
+        """
+        这一轮由谁处理：step 为当前的互动步骤（调用模型），local 为本地直接返回下一个步骤，
+        question 为模型结合当前步骤回应确认语以外的输入，free 为所有步骤完成后由模型收尾
+        """
+        state = session["step_state"]
+        if state["active"]:
+            return "step"
+        if state["index"] >= len(session["steps"]):
+            return "free"
+        return "local" if self._is_ack(user_input) else "question"
+
+    def _is_ack(self, user_input: str) -> bool:
+        text = _ACK_PUNCTUATION.sub(" ", user_input.lower()).strip()
+        return text in self.ACKNOWLEDGEMENTS
+
+    async def turn(self, session: Dict, history: List[Dict], user_input: str, diagnose: Optional[str] = None) -> Dict:
+        """
+        进行一轮对话，返回与 LessonService.conduct_lesson 相同的格式；session 的 step_state 在这里更新，
+        由调用方在这一轮成功后保存
+        """
+        handler = self.route(session, user_input)
+        metrics.incr("lesson_step_turns", handler=handler)
+        if handler == "local":
+            return self._present(session)
+
+        result = await self.lesson_service.conduct_lesson(
+            session["lesson"],
+            user=session["user"],
+            user_message=user_input,
+            conversation_history=history,
+            native_lang=session["native_lang"],
+            learning_lang=session["learning_lang"],
+            diagnose=diagnose,
+            step_instruction=self._instruction(session, handler)
+        )
+        return self._after_llm(session, handler, result)
+
+    async def turn_stream(self, session: Dict, history: List[Dict], user_input: str, diagnose: Optional[str] = None) -> AsyncIterator[Dict]:
+        """
+        流式版本的 turn，事件与 LessonService.conduct_lesson_stream 相同：
+        本地的步骤直接产出每句 speechText 的 item 事件和 done；
+        调用模型时，进入下一个步骤后接在回复之后的句子在 done 之前以 item 事件产出
+        """
+        handler = self.route(session, user_input)
+        metrics.incr("lesson_step_turns", handler=handler)
+        if handler == "local":
+            result = self._present(session)
+            for index, sentence in enumerate(result["speechText"]):
+                yield {"type": "item", "field": "speechText", "index": index, "value": sentence}
+            yield {"type": "field", "field": "displayText", "value": result["displayText"]}
+            yield {"type": "done", "value": result}
+            return
+
+        replied = 0
+        async for event in self.lesson_service.conduct_lesson_stream(
+                session["lesson"],
+                user=session["user"],
+                user_message=user_input,
+                conversation_history=history,
+                native_lang=session["native_lang"],
+                learning_lang=session["learning_lang"],
+                diagnose=diagnose,
+                step_instruction=self._instruction(session, handler)):
+            if event["type"] == "item" and event["field"] == "speechText":
+                # 与 done 中的 speechText 一致：去掉标记，只剩标记的句子不返回
+                sentence = self._strip_marker(event["value"])
+                if not sentence:
+                    continue
+                event = {**event, "index": replied, "value": sentence}
+                replied += 1
+            elif event["type"] == "field" and event["field"] == "displayText":
+                event = {**event, "value": self._strip_marker(event["value"])}
+            elif event["type"] == "done":
+                replied = len(self._clean_speech(event["value"].get("speechText")))
+                result = self._after_llm(session, handler, event["value"])
+                for index, sentence in enumerate(result["speechText"][replied:], replied):
+                    yield {"type": "item", "field": "speechText", "index": index, "value": sentence}
+                event = {"type": "done", "value": result}
+            yield event
+
+    def _instruction(self, session: Dict, handler: str) -> Optional[str]:
+        """调用模型时追加的当前步骤指令（services/prompt_templates/lesson.py 的 lesson_step_turn）"""
+        steps, state = session["steps"], session["step_state"]
+        prompts = self.lesson_service.prompts
+        native_lang, learning_lang = session["native_lang"], session["learning_lang"]
+        if handler == "step":
+            index, variant = state["index"], "step"
+        elif state["index"] >= len(steps):
+            return prompts.render("lesson_step_turn", native_lang, learning_lang, variant="finished")
+        else:
+            # 学生对刚讲完的步骤提问，第一个步骤之前为即将开始的步骤
+            index, variant = max(state["index"] - 1, 0), "question"
+        return prompts.render("lesson_step_turn", native_lang, learning_lang, variant=variant,
+                              position=f"{index + 1}/{len(steps)}", step=compact(steps[index]))
+
+    def _present(self, session: Dict) -> Dict:
+        """
+        在本地返回当前步骤的内容：讲解性的步骤返回后前进到下一个步骤，互动步骤开始等待学生的练习
+        """
+        state = session["step_state"]
+        step = session["steps"][state["index"]]
+        speech_text = []
+        for content in step["contents"]:
+            speech = content.get("speechText") or content.get("text", "")
+            speech_text += [s for s in _SENTENCE_END.split(speech.strip()) if s]
+        # display_type 为 text 的内容只需要说，不需要展示
+        display_text = "\n\n".join(c["text"] for c in step["contents"] if c.get("display_type", "text") != "text")
+
+        if step.get("requires_interaction"):
+            state.update(active=True, turns=0)
+        else:
+            state.update(index=state["index"] + 1, active=False, turns=0)
+        return {
+            "role": "assistant",
+            "content": speech_text,
+            "speechText": speech_text,
+            "displayText": display_text,
+            "diagnose": [],
+            "usage": None
+        }
+
+    def _after_llm(self, session: Dict, handler: str, result: Dict) -> Dict:
+        """
+        去掉模型回复中的 <step_complete>；当前的互动步骤完成，或者学生的提问已经回答完时，
+        把下一个步骤的内容接在回复之后
+        """
+        display_text = result.get("displayText") or ""
+        completed = STEP_COMPLETE in display_text
+        result = {**result, "speechText": self._clean_speech(result.get("speechText")), "displayText": self._strip_marker(display_text)}
+        result["content"] = result["speechText"]
+
+        state = session["step_state"]
+        if handler == "free":
+            return result
+        state["turns"] += 1
+        if not completed and state["turns"] < self.max_turns:
+            return result
+
+        metrics.incr("lesson_step_advances", handler=handler, reason="marker" if completed else "max_turns")
+        if handler == "step":
+            state.update(index=state["index"] + 1, active=False, turns=0)
+        if state["index"] >= len(session["steps"]):
+            return result
+        following = self._present(session)
+        result["speechText"] = result["speechText"] + following["speechText"]
+        result["content"] = result["speechText"]
+        result["displayText"] = "\n\n".join(t for t in (result["displayText"], following["displayText"]) if t)
+        return result
+
+    @classmethod
+    def _clean_speech(cls, speech_text: Union[List[str], str, None]) -> List[str]:
+        """去掉 speechText 中的 <step_complete>，以及去掉后为空的句子；模型偶尔把 speechText 输出为字符串，按一句处理"""
+        if isinstance(speech_text, str):
+            speech_text = [speech_text]
+        return [s for s in (cls._strip_marker(s) for s in speech_text or []) if s]
+
+    @staticmethod
+    def _strip_marker(text: Optional[str]) -> Optional[str]:
+        return text.replace(STEP_COMPLETE, "").strip() if text else text
@@ -0,0 +1,126 @@
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(*parts: Any) -> str:
+    """
+    请求的规范化哈希：按键排序、去掉多余空白后序列化，内容相同的请求得到相同的 key
+    """
+    canonical = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    LLM 响应缓存：进程内的 LRU（带 TTL），可选 SQLite 磁盘层，重启后仍然有效
+
+    值以 JSON 文本保存，每次读取都返回新的副本，调用方修改结果（如 pop("usage")）不会影响缓存
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 3600, db_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.ttl > 0
+
+    async def get(self, key: str) -> Optional[Any]:
+        """
+        先查内存，再查磁盘层（命中后放回内存），未命中或已过期时返回 None
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, text = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    metrics.incr("llm_cache", result="hit", tier="memory")
+                    return json.loads(text)
+                del self._entries[key]
+
+        if self.db_path:
+            row = await asyncio.to_thread(self._db_get, key, now)
+            if row is not None:
+                expires_at, text = row
+                self._remember(key, text, expires_at)
+                metrics.incr("llm_cache", result="hit", tier="disk")
+                return json.loads(text)
+
+        metrics.incr("llm_cache", result="miss")
+        return None
+
+    async def set(self, key: str, value: Any) -> None:
+        text = json.dumps(value, ensure_ascii=False, default=str)
+        expires_at = time.time() + self.ttl
+        self._remember(key, text, expires_at)
+        if self.db_path:
+            await asyncio.to_thread(self._db_set, key, text, expires_at)
+
+    def close(self) -> None:
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _remember(self, key: str, text: str, expires_at: float) -> None:
+        with self._lock:
+            self._entries[key] = (expires_at, text)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            metrics.set_gauge("llm_cache_entries", len(self._entries))
+
+    def _connection(self) -> sqlite3.Connection:
+        # 在 to_thread 的工作线程中调用，连接由 _db_lock 保护
+        if self._db is None:
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.commit()
+        return self._db
+
+    def _db_get(self, key: str, now: float):
+        try:
+            with self._db_lock:
+                db = self._connection()
+                row = db.execute("SELECT expires_at, value FROM llm_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None and row[0] <= now:
+                    db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    db.commit()
+                    return None
+                return row
+        except sqlite3.Error as e:
+            logger.warning(f"LLM cache read failed: {e}")
+            return None
+
+    def _db_set(self, key: str, text: str, expires_at: float) -> None:
+        try:
+            with self._db_lock:
+                db = self._connection()
+                db.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, text, expires_at)
+                )
+                db.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (time.time(),))
+                db.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"LLM cache write failed: {e}")
@@ -0,0 +1,112 @@
+import logging
+import os
+from typing import Dict, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# 建议的各接口配置（LLM_PROFILE_DEFAULTS=true 时启用）：模型档位（fast / default / large，对应的模型见 llm_router.PROVIDER_DEFAULTS 的 tiers）、
+# 输出 token 上限（max_tokens，被截断时由续写补全）、单次请求的超时秒数
+# 和排队的优先级（interactive / report / batch，见 scheduler.py）
+ENDPOINT_PROFILES = {
+    # 交互式的对话：每轮只需要几句话，使用响应最快的模型
+    "lesson_turn": {"tier": "fast", "max_tokens": 2048, "timeout": 30, "priority": "interactive"},
+    "assessment_chat": {"tier": "fast", "max_tokens": 2048, "timeout": 30, "priority": "interactive"},
+    "conversation_summary": {"tier": "fast", "max_tokens": 1024, "timeout": 60, "priority": "batch"},
+    # diagnose 为 split 时单独诊断学习者的最后一句话，不阻塞老师的回复
+    "lesson_diagnose": {"tier": "fast", "max_tokens": 1024, "timeout": 30, "priority": "report"},
+    # 课程的生成、总结和评估
+    "lesson_create": {"tier": "default", "max_tokens": 4096, "timeout": 60, "priority": "interactive"},
+    # 学习模式的课程编排为步骤（create_lesson 的 steps=true），整节课的内容一次生成
+    "lesson_steps": {"tier": "default", "max_tokens": 8192, "timeout": 120, "priority": "interactive"},
+    "lesson_summary": {"tier": "default", "max_tokens": 4096, "timeout": 120, "priority": "report"},
+    "lesson_evaluate": {"tier": "default", "max_tokens": 4096, "timeout": 120, "priority": "report"},
+    "weekly_summary": {"tier": "default", "max_tokens": 4096, "timeout": 120, "priority": "batch"},
+    "profile": {"tier": "default", "max_tokens": 4096, "timeout": 120, "priority": "report"},
+    # 多周的学习计划，输出长、需要更强的模型
+    "total_plan": {"tier": "large", "max_tokens": 8192, "timeout": 180, "priority": "report"},
+    "weekly_plan": {"tier": "large", "max_tokens": 8192, "timeout": 180, "priority": "batch"},
+}
+
+
+class EndpointProfile:
+    """
+    一个接口的模型选择和请求限制
+
+    tier 按 provider 解析为具体的模型，切换 provider 时使用对应档位的模型；
+    model 为指定的模型名称，只对主 provider 生效（模型名称不能跨 provider 使用）
+    """
+
+    def __init__(self, name: str, tier: str = "default", model: Optional[str] = None,
+                 max_tokens: Optional[int] = None, timeout: Optional[float] = None, num_ctx: Optional[int] = None,
+                 priority: str = "report"):
+        self.name = name
+        self.tier = tier
+        self.model = model
+        self.max_tokens = max_tokens
+        self.timeout = timeout
+        # Ollama provider 的上下文长度，为 None 时使用 OLLAMA_NUM_CTX（见 services/ollama.py）
+        self.num_ctx = num_ctx
+        self.priority = priority
+
+    def model_for(self, provider, is_primary: bool) -> str:
+        if self.model and is_primary:
+            return self.model
+        return provider.model_for(self.tier)
+
+    def with_model(self, model: Optional[str]) -> "EndpointProfile":
+        """调用时显式传入 model 参数，覆盖配置的模型"""
+        if not model or model == self.model:
+            return self
+        return EndpointProfile(self.name, self.tier, model, self.max_tokens, self.timeout, self.num_ctx, self.priority)
+
+    def cache_parts(self) -> tuple:
+        """影响模型输出的配置，作为缓存 key 的一部分"""
+        return (self.tier, self.model, self.max_tokens)
+
+
+def load_profiles() -> Dict[str, EndpointProfile]:
+    """
+    读取各接口的配置，环境变量 LLM_PROFILE_<NAME>_TIER、_MODEL、_MAX_TOKENS、_TIMEOUT、_NUM_CTX、_PRIORITY 覆盖默认值，
+    如 LLM_PROFILE_LESSON_TURN_MODEL=gemini-2.5-flash-lite；MAX_TOKENS 或 TIMEOUT 为 0 时不限制
+
+    ENDPOINT_PROFILES 中的档位、max_tokens 和超时只在 LLM_PROFILE_DEFAULTS=true 时作为默认值；
+    默认不启用，没有单独配置的接口使用 LLM_MODEL、不限制输出长度、超时为 LLM_REQUEST_TIMEOUT
+    """
+    use_defaults = os.getenv("LLM_PROFILE_DEFAULTS", "false").lower() in ("1", "true", "yes")
+    profiles = {}
+    for name, defaults in ENDPOINT_PROFILES.items():
+        prefix = f"LLM_PROFILE_{name.upper()}"
+        if not use_defaults:
+            defaults = {**defaults, "tier": "default", "max_tokens": 0, "timeout": 0}
+        max_tokens = int(os.getenv(f"{prefix}_MAX_TOKENS", str(defaults["max_tokens"])))
+        timeout = float(os.getenv(f"{prefix}_TIMEOUT", str(defaults["timeout"])))
+        profiles[name] = EndpointProfile(
+            name,
+            tier=os.getenv(f"{prefix}_TIER", defaults["tier"]).lower(),
+            model=os.getenv(f"{prefix}_MODEL") or None,
+            max_tokens=max_tokens or None,
+            timeout=timeout or None,
+            num_ctx=int(os.getenv(f"{prefix}_NUM_CTX", "0")) or None,
+            priority=os.getenv(f"{prefix}_PRIORITY", defaults["priority"]).lower()
+        )
+    return profiles
+
+
+class ProfileTable:
+    """接口名称到 EndpointProfile 的映射，未配置的名称使用主 provider 的默认模型、不限制输出长度"""
+
+    def __init__(self, profiles: Optional[Dict[str, EndpointProfile]] = None):
+        self.profiles = profiles if profiles is not None else load_profiles()
+        self.default = EndpointProfile("default")
+
+    def resolve(self, profile: Union[str, EndpointProfile, None], model: Optional[str] = None) -> EndpointProfile:
+        if isinstance(profile, EndpointProfile):
+            resolved = profile
+        elif profile is None:
+            resolved = self.default
+        else:
+            resolved = self.profiles.get(profile)
+            if resolved is None:
+                logger.warning(f"Unknown LLM endpoint profile {profile}, using defaults")
+                resolved = self.default
+        return resolved.with_model(model)
@@ -0,0 +1,315 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from services.deadline import DeadlineExceeded
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 各 provider 的接口地址、默认模型、API key 环境变量和支持的 response_format 类型，
+# tiers 为 fast / large 档位的模型（见 llm_profiles.py），没有配置的档位使用默认模型；
+# api_env 为选择接口格式的环境变量：openai（OpenAI 兼容的 /chat/completions，默认）或 ollama（Ollama 原生的 /api/chat，见 ollama.py），
+# 使用 ollama 时按 ollama_response_formats 发送 format
+PROVIDER_DEFAULTS = {
+    "aliyun": {
+        "base_url": "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions",
+        "model": "qwen-plus",
+        "tiers": {"fast": "qwen-turbo", "large": "qwen-max"},
+        "api_key_env": "ALIYUN_API_KEY",
+        "response_formats": ("json_object",),
+    },
+    "promptai": {
+        "base_url": "https://llm.promptai.cn/pk/api/chat",
+        "model": "pkqwen2.5-32b:latest",
+        "tiers": {},
+        "api_env": "PROMPTAI_API",
+        "api_key_env": "PROMPTAI_API_KEY",
+        "response_formats": (),
+        "ollama_response_formats": ("json_object",),
+    },
+    "google": {
+        "base_url": "https://generativelanguage.googleapis.com/v1beta/openai/chat/completions",
+        "model": "gemini-2.5-pro-preview-03-25",
+        "tiers": {"fast": "gemini-2.5-flash"},
+        "api_key_env": "GOOGLE_API_KEY",
+        "response_formats": ("json_object", "json_schema"),
+    },
+}
+
+
+class ProviderStats:
+    """
+    单个 provider 最近 window 次请求的耗时和成功情况，用于计算 p50/p95 和错误率
+
+    max_age: 超过这个秒数的请求结果不再计入错误率；被判为不可用的 provider 排到最后后很少再收到请求，
+    旧的失败过期后它重新按耗时参与排序，恢复后就能重新使用
+    """
+
+    def __init__(self, window: int = 100, max_age: Optional[float] = None):
+        self.latencies = deque(maxlen=window)
+        # (time.monotonic(), ok)
+        self.outcomes = deque(maxlen=window)
+        self.max_age = max_age
+
+    def record(self, latency: Optional[float], ok: bool) -> None:
+        if latency is not None:
+            self.latencies.append(latency)
+        self.outcomes.append((time.monotonic(), ok))
+
+    def recent_outcomes(self) -> List[bool]:
+        """最近 max_age 秒内的请求结果"""
+        if self.max_age is None:
+            return [ok for _, ok in self.outcomes]
+        since = time.monotonic() - self.max_age
+        return [ok for at, ok in self.outcomes if at >= since]
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    @property
+    def p50(self) -> Optional[float]:
+        return self.percentile(0.5)
+
+    @property
+    def p95(self) -> Optional[float]:
+        return self.percentile(0.95)
+
+    @property
+    def error_rate(self) -> float:
+        outcomes = self.recent_outcomes()
+        if not outcomes:
+            return 0.0
+        return outcomes.count(False) / len(outcomes)
+
+
+class LLMProvider:
+    """
+    一个 LLM 上游：接口地址、模型、请求头，以及路由用的统计信息
+
+    stats 为所有请求的统计（错误率和指标）；不同接口的耗时相差很大（一轮对话几秒，生成计划一两分钟），
+    排序和 hedge 使用的耗时按接口（EndpointProfile 的名称）分别统计，见 latency_stats
+    """
+
+    def __init__(self, name: str, base_url: str, model: str, headers: Dict, response_formats: Tuple = (), window: int = 100, tiers: Optional[Dict[str, str]] = None, api: str = "openai", max_age: Optional[float] = None):
+        self.name = name
+        self.api = api
+        self.base_url = base_url
+        self.model = model
+        self.headers = headers
+        self.response_formats = response_formats
+        self.tiers = tiers or {}
+        self.window = window
+        self.stats = ProviderStats(window, max_age)
+        self.endpoint_stats: Dict[str, ProviderStats] = {}
+
+    def latency_stats(self, endpoint: Optional[str] = None) -> ProviderStats:
+        """endpoint 的耗时统计，endpoint 为 None 时为所有请求的统计"""
+        if endpoint is None:
+            return self.stats
+        stats = self.endpoint_stats.get(endpoint)
+        if stats is None:
+            stats = self.endpoint_stats[endpoint] = ProviderStats(self.window)
+        return stats
+
+    def model_for(self, tier: str) -> str:
+        """档位对应的模型，没有配置时使用默认模型"""
+        return self.tiers.get(tier) or self.model
+
+    def adapt_response_format(self, response_format: Optional[Dict]) -> Optional[Dict]:
+        """
+        按该 provider 的支持情况调整 response_format：不支持 json_schema 时退回 json_object，都不支持时不发送
+        """
+        if not response_format:
+            return None
+        if response_format["type"] in self.response_formats:
+            return response_format
+        if "json_object" in self.response_formats:
+            return {"type": "json_object"}
+        return None
+
+
+def load_providers(primary: str) -> List[LLMProvider]:
+    """
+    从环境变量读取 provider 列表，主 provider（LLM_PROVIDER）排在第一位
+
+    LLM_PROVIDERS: 逗号分隔的 provider 名称，默认只有主 provider
+    LLM_MODEL: 主 provider 使用的模型
+    LLM_MODEL_<NAME>、LLM_BASE_URL_<NAME>: 覆盖各 provider 的模型和接口地址，如 LLM_MODEL_ALIYUN=qwen-max
+    LLM_MODEL_<NAME>_FAST、LLM_MODEL_<NAME>_LARGE: 覆盖各 provider 的 fast / large 档位的模型
+    """
+    window = int(os.getenv('LLM_ROUTER_WINDOW', '100'))
+    max_age = float(os.getenv('LLM_ROUTER_ERROR_TTL', '300')) or None
+    names = [primary]
+    for name in os.getenv('LLM_PROVIDERS', '').split(','):
+        name = name.strip().lower()
+        if name and name not in names:
+            names.append(name)
+
+    providers = []
+    for name in names:
+        model = os.getenv(f'LLM_MODEL_{name.upper()}') or (os.getenv('LLM_MODEL') if name == primary else None)
+        provider = create_provider(name, model, window=window, max_age=max_age)
+        if provider is None:
+            logger.warning(f"Unknown LLM provider {name}, skipped")
+            continue
+        providers.append(provider)
+    return providers
+
+
+def create_provider(name: str, model: Optional[str] = None, window: int = 100, label: Optional[str] = None, max_age: Optional[float] = None) -> Optional[LLMProvider]:
+    """
+    按 PROVIDER_DEFAULTS 和环境变量创建一个 provider，未知的名称返回 None
+
+    model: 默认模型，为 None 时使用 provider 的默认模型
+    label: provider 的名称（连接池、限流器和指标按名称区分），默认与 name 相同
+    """
+    defaults = PROVIDER_DEFAULTS.get(name)
+    if defaults is None:
+        return None
+    api = os.getenv(defaults["api_env"], "openai") if "api_env" in defaults else "openai"
+    return LLMProvider(
+        name=label or name,
+        base_url=os.getenv(f'LLM_BASE_URL_{name.upper()}', defaults["base_url"]),
+        model=model or defaults["model"],
+        headers={
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {os.getenv(defaults['api_key_env'])}"
+        },
+        response_formats=defaults["ollama_response_formats"] if api == "ollama" else defaults["response_formats"],
+        window=window,
+        max_age=max_age,
+        api=api,
+        tiers={
+            tier: os.getenv(f'LLM_MODEL_{name.upper()}_{tier.upper()}') or defaults["tiers"].get(tier)
+            for tier in ("fast", "large")
+        }
+    )
+
+
+class LLMRouter:
+    """
+    在多个 provider 之间路由请求
+
+    - 按最近的错误率和同一接口的 p50 耗时选择 provider，没有足够样本时保持配置的顺序
+    - 请求失败时依次切换到下一个 provider
+    - 开启 hedge 时，请求超过当前 provider 在同一接口上的 p95 仍未返回，就向下一个 provider 发送相同的请求，取先返回的结果
+
+    endpoint 为 EndpointProfile 的名称，为 None 时使用所有请求的统计
+    """
+
+    def __init__(self, providers: List[LLMProvider]):
+        self.providers = providers
+        self.hedge = os.getenv('LLM_HEDGE', 'false').lower() in ('1', 'true', 'yes')
+        self.hedge_min_samples = int(os.getenv('LLM_HEDGE_MIN_SAMPLES', '20'))
+        self.hedge_min_delay = float(os.getenv('LLM_HEDGE_MIN_DELAY', '1'))
+        self.min_samples = int(os.getenv('LLM_ROUTER_MIN_SAMPLES', '5'))
+        self.max_error_rate = float(os.getenv('LLM_ROUTER_MAX_ERROR_RATE', '0.5'))
+
+    def ranked(self, endpoint: Optional[str] = None) -> List[LLMProvider]:
+        """
+        按优先级排序的 provider：最近 LLM_ROUTER_ERROR_TTL 秒内错误率超过 max_error_rate 的排到最后，
+        其余按 endpoint 的 p50 排序；样本不足的 provider 排在有样本的之后并保持配置的顺序
+        （备用 provider 在切换或 hedge 时积累样本）
+        """
+        def score(item):
+            index, provider = item
+            outcomes = provider.stats.recent_outcomes()
+            unhealthy = len(outcomes) >= self.min_samples and provider.stats.error_rate > self.max_error_rate
+            latencies = provider.latency_stats(endpoint)
+            if len(latencies.latencies) < self.min_samples:
+                return (unhealthy, float("inf"), index)
+            return (unhealthy, latencies.p50, index)
+        return [provider for _, provider in sorted(enumerate(self.providers), key=score)]
+
+    def record(self, provider: LLMProvider, latency: Optional[float], ok: bool, endpoint: Optional[str] = None) -> None:
+        provider.stats.record(latency, ok)
+        if endpoint is not None and latency is not None:
+            provider.latency_stats(endpoint).record(latency, ok)
+        metrics.incr("llm_requests", provider=provider.name, status="ok" if ok else "error")
+        if latency is not None:
+            metrics.observe("llm_latency_seconds", latency, provider=provider.name)
+        if provider.stats.p95 is not None:
+            metrics.set_gauge("llm_provider_p50_seconds", provider.stats.p50, provider=provider.name)
+            metrics.set_gauge("llm_provider_p95_seconds", provider.stats.p95, provider=provider.name)
+        metrics.set_gauge("llm_provider_error_rate", provider.stats.error_rate, provider=provider.name)
+
+    async def run(self, call: Callable[[LLMProvider], Awaitable], endpoint: Optional[str] = None):
+        """
+        在最合适的 provider 上执行 call(provider)，失败时切换到下一个，所有 provider 都失败时抛出最后一个错误
+        """
+        pending = self.ranked(endpoint)
+        tried = []
+        last_error = None
+        while pending:
+            provider = pending.pop(0)
+            tried.append(provider)
+            backup = pending[0] if pending else None
+            try:
+                if backup is not None and self._hedge_delay(provider, endpoint) is not None:
+                    return await self._run_hedged(call, provider, backup, tried, endpoint)
+                return await self._timed(call, provider, endpoint)
+            except (asyncio.CancelledError, DeadlineExceeded):
+                # 请求的剩余时间用完时切换 provider 也没有意义
+                raise
+            except Exception as e:
+                last_error = e
+                # hedge 时 backup 也已经尝试过了
+                pending = [p for p in pending if p not in tried]
+                if pending:
+                    metrics.incr("llm_failovers", provider=provider.name)
+                    logger.warning(f"LLM provider {provider.name} failed, failing over to {pending[0].name}: {e}")
+        raise last_error if last_error else Exception("No LLM provider configured")
+
+    def _hedge_delay(self, provider: LLMProvider, endpoint: Optional[str] = None) -> Optional[float]:
+        stats = provider.latency_stats(endpoint)
+        if not self.hedge or len(stats.latencies) < self.hedge_min_samples:
+            return None
+        return max(stats.p95, self.hedge_min_delay)
+
+    async def _timed(self, call: Callable[[LLMProvider], Awaitable], provider: LLMProvider, endpoint: Optional[str] = None):
+        start = time.monotonic()
+        try:
+            result = await call(provider)
+        except (asyncio.CancelledError, DeadlineExceeded):
+            raise
+        except Exception:
+            self.record(provider, None, False, endpoint)
+            raise
+        self.record(provider, time.monotonic() - start, True, endpoint)
+        return result
+
+    async def _run_hedged(self, call: Callable[[LLMProvider], Awaitable], primary: LLMProvider, backup: LLMProvider, tried: List[LLMProvider], endpoint: Optional[str] = None):
+        """
+        先向 primary 发送请求，超过其 p95 未返回时再向 backup 发送（并记入 tried），返回先成功的结果，
+        另一个请求会被取消；都失败时抛出 primary 的错误
+        """
+        tasks = {asyncio.ensure_future(self._timed(call, primary, endpoint)): primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self._hedge_delay(primary, endpoint))
+            if not done:
+                metrics.incr("llm_hedged_requests", provider=primary.name, backup=backup.name)
+                tasks[asyncio.ensure_future(self._timed(call, backup, endpoint))] = backup
+                tried.append(backup)
+
+            errors = {}
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if len(tasks) > 1:
+                            metrics.incr("llm_hedge_wins", provider=tasks[task].name)
+                        return task.result()
+                    errors[tasks[task]] = task.exception()
+            raise errors.get(primary) or next(iter(errors.values()))
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
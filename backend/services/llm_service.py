@@ -1,264 +1,807 @@
 import aiohttp
+import asyncio
+import copy
 import json
-from typing import List, Dict, Optional
+import logging
+from typing import AsyncIterator, Awaitable, Callable, Iterable, List, Dict, Optional, Type, Union
 import os
+import time
+from pydantic import BaseModel, ValidationError
+from services.json_parsing import IncrementalJSONParser, extract_json, repair_json
+from services.deadline import DeadlineExceeded, budget
+from services.llm_cache import LLMCache, cache_key
+from services.llm_profiles import EndpointProfile, ProfileTable
+from services.llm_router import PROVIDER_DEFAULTS, LLMProvider, LLMRouter, load_providers
+from services.ollama import OllamaAPI
+from services.rate_limit import UpstreamError, UpstreamLimiter, get_limiter, parse_retry_after, retry_budget
+from services.scheduler import PriorityScheduler
+from services.shadow import ShadowTraffic
+from services.structured_logging import log_payload
+from services.prompt_format import estimate_tokens
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
 
 class LLMService:
+    # 输出被截断后让模型继续生成的提示
+    CONTINUE_PROMPT = "你的输出因长度限制被截断了。请从中断的位置直接继续输出剩余的内容，不要重复已经输出的内容，不要添加任何说明或代码块标记。"
+
     def __init__(self):
         # Get LLM provider from environment variable, default to 'google'
         llm_provider = os.getenv('LLM_PROVIDER', 'google').lower()
-        
-        # Configure base_url and model based on the provider
-        if llm_provider == 'aliyun':
-            self.base_url = "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions"
-            self.model = os.getenv('LLM_MODEL', 'qwen-plus')
-            self.headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {os.getenv('ALIYUN_API_KEY')}"
-            }
-        elif llm_provider == 'promptai':
-            self.base_url = "https://llm.promptai.cn/pk/api/chat"
-            self.model = os.getenv('LLM_MODEL', 'pkqwen2.5-32b:latest')
-            self.headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {os.getenv('PROMPTAI_API_KEY')}"
-            }
-        else:  # default to google
-            self.base_url = "https://generativelanguage.googleapis.com/v1beta/openai/chat/completions"
-            self.model = os.getenv('LLM_MODEL', 'gemini-2.5-pro-preview-03-25')
-            self.headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {os.getenv('GOOGLE_API_KEY')}"
-            }
+        if llm_provider not in PROVIDER_DEFAULTS:
+            llm_provider = 'google'
+        self.provider = llm_provider
+
+        # 主 provider 之外，LLM_PROVIDERS 中配置的 provider 也保持可用，由 router 按耗时和错误率选择、失败时切换
+        # 各 provider 的接口地址和模型见 services/llm_router.py
+        self.router = LLMRouter(load_providers(llm_provider))
+        self.primary = self.router.providers[0]
+        # 各接口（课程对话、计划生成等）使用的模型档位、max_tokens 和超时，见 services/llm_profiles.py
+        self.profiles = ProfileTable()
+        # 所有 provider 共用的并发名额，按 profile 的优先级排队，对话优先于计划生成等批量任务
+        self.scheduler = PriorityScheduler()
+        # api 为 ollama 的 provider（promptai）使用原生 /api/chat 接口
+        self.ollama = OllamaAPI()
+        self._background: List[asyncio.Task] = []
+
+        # 连接池配置：每个 provider 一个长连接 session，避免每轮对话重新做 DNS/TCP/TLS 握手
+        self.pool_limit = int(os.getenv('LLM_POOL_LIMIT', '100'))
+        self.pool_limit_per_host = int(os.getenv('LLM_POOL_LIMIT_PER_HOST', '20'))
+        self.dns_cache_ttl = int(os.getenv('LLM_DNS_CACHE_TTL', '300'))
+        self.keepalive_timeout = float(os.getenv('LLM_KEEPALIVE_TIMEOUT', '60'))
+        self.request_timeout = float(os.getenv('LLM_REQUEST_TIMEOUT', '180'))
+        self._sessions: Dict[str, aiohttp.ClientSession] = {}
+        self._session_lock = asyncio.Lock()
+        # 进行中的请求，key 为请求的规范化哈希，见 _single_flight
+        self._inflight: Dict[str, Dict] = {}
+
+        # 结构化输出模式：off（默认，只靠提示词约束）、json_object 或 json_schema
+        # provider 不支持 json_schema 时退回 json_object，不支持 JSON mode 时不发送 response_format
+        self.response_format_mode = os.getenv('LLM_RESPONSE_FORMAT', 'off').lower()
+        # 结构校验失败时，只针对缺失或格式错误的字段追问的最大次数
+        self.max_reasks = int(os.getenv('LLM_MAX_REASKS', '1'))
+        # 输出被截断（finish_reason == "length"）时自动续写的最大次数，0 表示不续写
+        self.max_continuations = int(os.getenv('LLM_MAX_CONTINUATIONS', '3'))
+
+        # 响应缓存，只对调用时传入 cache=True 的请求生效（计划生成、课程评估/总结等相同输入会重复请求的接口）
+        # LLM_CACHE_SIZE 或 LLM_CACHE_TTL 为 0 时关闭，设置 LLM_CACHE_DB 时同时写入 SQLite，重启后仍然有效
+        self.cache = LLMCache(
+            max_entries=int(os.getenv('LLM_CACHE_SIZE', '256')),
+            ttl=float(os.getenv('LLM_CACHE_TTL', '3600')),
+            db_path=os.getenv('LLM_CACHE_DB') or None
+        )
+
+        # 影子流量：按比例把 structured_chat 请求在后台复制给候选的 provider / 模型做对比，见 services/shadow.py
+        self.shadow = ShadowTraffic(self)
             
         # Log which provider and model we're using
-        print(f"Using LLM provider: {llm_provider}, model: {self.model}")
+        logger.info(f"Using LLM provider: {llm_provider}, model: {self.model}")
+        if len(self.router.providers) > 1:
+            logger.info(f"Fallback LLM providers: {', '.join(p.name for p in self.router.providers[1:])}, hedge: {self.router.hedge}")
+
+    # 主 provider 的接口地址、模型和请求头
+    @property
+    def base_url(self) -> str:
+        return self.primary.base_url
+
+    @base_url.setter
+    def base_url(self, value: str):
+        self.primary.base_url = value
+
+    @property
+    def model(self) -> str:
+        return self.primary.model
+
+    @model.setter
+    def model(self, value: str):
+        self.primary.model = value
+
+    @property
+    def headers(self) -> Dict:
+        return self.primary.headers
+
+    @headers.setter
+    def headers(self, value: Dict):
+        self.primary.headers = value
+
+    async def startup(self):
+        """
+        在应用启动时（FastAPI lifespan）预先创建连接池，并在后台预加载 Ollama provider 的模型
+        """
+        for provider in self.router.providers:
+            session = await self._get_session(provider.name)
+            if provider.api == "ollama" and self.ollama.preload_enabled:
+                models = list(dict.fromkeys([provider.model, *provider.tiers.values()]))
+                self._background.append(asyncio.create_task(self.ollama.preload(session, provider, [m for m in models if m])))
+
+    async def shutdown(self):
+        """
+        关闭所有 provider 的连接池，在应用退出时调用
+        """
+        for task in self._background:
+            task.cancel()
+        self._background.clear()
+        await self.shadow.close()
+        async with self._session_lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            await session.close()
+        self.cache.close()
+        # 给 SSL 连接一点时间完成关闭，避免 "Unclosed connection" 警告
+        if sessions:
+            await asyncio.sleep(0.25)
 
-    async def chat_completion(self, messages: List[Dict], model: Optional[str] = None) -> Dict:
+    async def _get_session(self, provider: str) -> aiohttp.ClientSession:
+        """
+        获取 provider 对应的共享 ClientSession，不存在或已关闭时按需创建
+        （在 FastAPI 之外运行脚本时不会经过 lifespan，这里也能懒加载）
+        """
+        session = self._sessions.get(provider)
+        if session is not None and not session.closed:
+            return session
+        async with self._session_lock:
+            session = self._sessions.get(provider)
+            if session is None or session.closed:
+                connector = aiohttp.TCPConnector(
+                    ssl=False,
+                    limit=self.pool_limit,
+                    limit_per_host=self.pool_limit_per_host,
+                    ttl_dns_cache=self.dns_cache_ttl,
+                    keepalive_timeout=self.keepalive_timeout,
+                )
+                session = aiohttp.ClientSession(
+                    connector=connector,
+                    timeout=aiohttp.ClientTimeout(total=self.request_timeout)
+                )
+                self._sessions[provider] = session
+                logger.info(f"Created pooled HTTP session for LLM provider {provider}")
+            return session
+
+    async def chat_completion(self, messages: List[Dict], model: Optional[str] = None, response_format: Optional[Dict] = None, cache: bool = False, profile: Union[str, EndpointProfile, None] = None) -> Dict:
         """
         调用 Ollama API 进行对话
+
+        输出因达到 token 上限被截断（finish_reason == "length"）时，自动让模型从中断处继续生成并拼接，
+        最多续写 max_continuations 次，返回的 usage 为所有请求的合计
+
+        参数:
+            model: 指定主 provider 使用的模型，覆盖 profile 的配置
+            cache: 是否使用响应缓存，命中时直接返回之前的响应（包括当时的 usage）
+            profile: 接口名称（见 services/llm_profiles.py），决定模型档位、max_tokens 和超时
         """
-        try:
-            ssl_context = aiohttp.TCPConnector(verify_ssl=False)
-            # Increase timeout to 120 seconds (2 minutes)
-            timeout = aiohttp.ClientTimeout(total=180)
-            async with aiohttp.ClientSession(connector=ssl_context, timeout=timeout) as session:
-                payload = {
-                    "model": model or self.model,
-                    "messages": messages,
-                    "stream": False
-                }
-                
-                async with session.post(
-                    self.base_url,
-                    headers=self.headers,
-                    json=payload
-                ) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        raise Exception(f"API call failed: {error_text}")
-                    
-                    result = await response.json()
-                    return {
-                        "role": "assistant", 
-                        "content": result["choices"][0]["message"]["content"],
-                        "usage": result["usage"]
-                    }
-                    #return {"role": "assistant", "content": result["message"]["content"]}
+        profile = self.profiles.resolve(profile, model)
+        key = cache_key("chat", self.provider, self.model, profile.cache_parts(), messages, response_format)
+        use_cache = cache and self.cache.enabled
+        if use_cache:
+            cached = await self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        async def call():
+            result = await self._chat_completion(messages, profile, response_format)
+            if use_cache:
+                await self.cache.set(key, result)
+            return result
+
+        return await self._single_flight(key, call)
 
+    async def _chat_completion(self, messages: List[Dict], profile: EndpointProfile, response_format: Optional[Dict]) -> Dict:
+        try:
+            return await self.router.run(lambda provider: self._complete_on(provider, messages, profile, response_format), profile.name)
+        except (asyncio.CancelledError, DeadlineExceeded):
+            # 原样抛出，接口据此返回 504（见 api/request_control.py），客户端断开时正常取消
+            raise
         except Exception as e:
             raise Exception(f"Chat completion failed: {str(e)}")
 
-    async def structured_chat(self, messages: List[Dict], output_format: Optional[str] = None, model: Optional[str] = None) -> Dict:
+    async def _complete_on(self, provider: LLMProvider, messages: List[Dict], profile: EndpointProfile, response_format: Optional[Dict]) -> Dict:
+        """
+        在指定 provider 上完成一次对话（包括截断后的续写，续写始终使用同一个 provider）
+        """
+        content, usage, finish_reason = await self._complete_once(provider, messages, profile, response_format)
+
+        continuations = 0
+        while finish_reason == "length" and continuations < self.max_continuations:
+            continuations += 1
+            metrics.incr("llm_continuations", provider=provider.name)
+            logger.info(f"Output truncated, continuation {continuations} after {len(content)} chars")
+            continuation_messages = list(messages) + [
+                {"role": "assistant", "content": content},
+                {"role": "user", "content": self.CONTINUE_PROMPT}
+            ]
+            # 续写的是同一个文档的后半部分，不能再要求 provider 输出完整的 JSON 对象
+            more, more_usage, finish_reason = await self._complete_once(provider, continuation_messages, profile, None)
+            content = self._join_continuation(content, more)
+            usage = self._merge_usage(usage, more_usage)
+
+        if finish_reason == "length":
+            metrics.incr("llm_truncated_responses", provider=provider.name)
+        return {
+            "role": "assistant",
+            "content": content,
+            "usage": usage
+        }
+
+    async def _complete_once(self, provider: LLMProvider, messages: List[Dict], profile: EndpointProfile, response_format: Optional[Dict]):
+        """
+        在 provider 的限流下发送一次非流式请求（429/503 等按退避规则重试），返回 (content, usage, finish_reason)
+        """
+        limiter = self._limiter(provider)
+        estimated = self._estimate_tokens(messages)
+        async with self.scheduler.slot(profile.priority):
+            content, usage, finish_reason = await limiter.call(
+                lambda: self._post_once(provider, messages, profile, response_format),
+                estimated
+            )
+        limiter.record_tokens(estimated, (usage or {}).get("total_tokens"))
+        return content, usage, finish_reason
+
+    async def _post_once(self, provider: LLMProvider, messages: List[Dict], profile: EndpointProfile, response_format: Optional[Dict]):
+        session = await self._get_session(provider.name)
+        payload = self._payload(provider, messages, profile, response_format, stream=False)
+
+        async with session.post(
+            provider.base_url,
+            headers=provider.headers,
+            json=payload,
+            **self._timeout(profile, stream=False)
+        ) as response:
+            if response.status != 200:
+                raise await self._upstream_error(response)
+
+            result = await response.json()
+            if provider.api == "ollama":
+                content, usage, finish_reason = self.ollama.parse(provider.name, result)
+                return content, self._record_usage(provider, usage), finish_reason
+            choice = result["choices"][0]
+            return choice["message"]["content"], self._record_usage(provider, result.get("usage")), choice.get("finish_reason")
+
+    @staticmethod
+    def _record_usage(provider: LLMProvider, usage: Optional[Dict]) -> Optional[Dict]:
+        """
+        统计 prompt token 中命中 provider 前缀缓存的部分，并把它提到 usage 的顶层字段 cached_tokens
+        （OpenAI 兼容接口放在 prompt_tokens_details.cached_tokens 中）
+        """
+        if not usage:
+            return usage
+        details = usage.get("prompt_tokens_details") or {}
+        cached = details.get("cached_tokens", usage.get("cached_tokens"))
+        if cached is not None:
+            usage = {**usage, "cached_tokens": cached}
+            metrics.incr("llm_cached_prompt_tokens", cached, provider=provider.name)
+        if usage.get("prompt_tokens"):
+            metrics.incr("llm_prompt_tokens", usage["prompt_tokens"], provider=provider.name)
+        return usage
+
+    @staticmethod
+    async def _upstream_error(response: aiohttp.ClientResponse) -> UpstreamError:
+        error_text = await response.text()
+        return UpstreamError(
+            response.status,
+            f"API call failed: {error_text}",
+            parse_retry_after(response.headers.get("Retry-After"))
+        )
+
+    def _limiter(self, provider: LLMProvider) -> UpstreamLimiter:
+        """provider 对应的出站限流器，默认并发上限与连接池的单 host 上限一致"""
+        return get_limiter(f"llm_{provider.name}", self.pool_limit_per_host)
+
+    @staticmethod
+    def _estimate_tokens(messages: List[Dict]) -> int:
+        """粗略估算请求的 token 数，用于 tpm 限流，响应后按实际用量修正"""
+        return sum(estimate_tokens(str(message.get("content", ""))) for message in messages) + 1
+
+    def _payload(self, provider: LLMProvider, messages: List[Dict], profile: EndpointProfile, response_format: Optional[Dict], stream: bool) -> Dict:
+        """
+        构造请求体：模型按 profile 的档位从 provider 的配置中选择（指定的 model 只对主 provider 生效）；
+        response_format 按 provider 的支持情况调整
+        """
+        model = profile.model_for(provider, provider is self.primary)
+        response_format = provider.adapt_response_format(response_format)
+        if provider.api == "ollama":
+            return self.ollama.payload(model, messages, profile.max_tokens, profile.num_ctx, response_format, stream)
+        payload = {
+            "model": model,
+            "messages": messages,
+            "stream": stream
+        }
+        if profile.max_tokens:
+            payload["max_tokens"] = profile.max_tokens
+        if stream:
+            payload["stream_options"] = {"include_usage": True}
+        if response_format:
+            payload["response_format"] = response_format
+        return payload
+
+    def _timeout(self, profile: EndpointProfile, stream: bool) -> Dict:
+        """
+        单次上游请求的超时：profile 配置的超时（没有配置时为 LLM_REQUEST_TIMEOUT），不超过请求剩余的时间。
+        非流式请求限制总时间；流式请求的总时间只受请求剩余时间限制，profile 的超时限制两块数据之间的间隔
+        """
+        timeout = profile.timeout or self.request_timeout
+        if stream:
+            return {"timeout": aiohttp.ClientTimeout(total=budget(None), sock_read=budget(timeout))}
+        return {"timeout": aiohttp.ClientTimeout(total=budget(timeout))}
+
+    @staticmethod
+    def _join_continuation(content: str, more: str) -> str:
+        """
+        拼接续写的内容：去掉模型重新打开的 ```json 代码块标记，以及与已有内容末尾重复的部分
+        """
+        text = more
+        stripped = text.lstrip()
+        if stripped.startswith("```"):
+            text = stripped.split("\n", 1)[1] if "\n" in stripped else ""
+        # 模型从头重新生成了整个文档时，以新的输出为准
+        head = content.lstrip()[:64]
+        if len(head) == 64 and text.lstrip().startswith(head):
+            return text
+        # 模型经常先重复上一段的末尾再继续，找出最长的重叠部分（太短的重叠可能只是巧合，不处理）
+        for size in range(min(len(content), len(text), 500), 7, -1):
+            if content.endswith(text[:size]):
+                return content + text[size:]
+        return content + text
+
+    async def stream_chat_completion(self, messages: List[Dict], model: Optional[str] = None, response_format: Optional[Dict] = None, profile: Union[str, EndpointProfile, None] = None) -> AsyncIterator[Dict]:
+        """
+        以流式方式调用 OpenAI 兼容接口，逐块返回生成的内容，model 和 profile 同 chat_completion
+        
+        产出:
+            {"delta": str}  # 新生成的文本片段
+            {"usage": dict, "finish_reason": str}  # 最后一块，包含 token 用量（provider 未返回时为 None）
+        """
+        profile = self.profiles.resolve(profile, model)
+        # 还没有产出任何内容时失败可以切换到下一个 provider，已经开始输出后无法切换
+        last_error = None
+        estimated = self._estimate_tokens(messages)
+        for provider in self.router.ranked(profile.name):
+            limiter = self._limiter(provider)
+            retry_budget.deposit()
+            attempt = 0
+            started = False
+            start = time.monotonic()
+            while True:
+                try:
+                    async with self.scheduler.slot(profile.priority), limiter.slot(estimated):
+                        async for chunk in self._stream_once(provider, messages, profile, response_format):
+                            started = True
+                            if "usage" in chunk and chunk["usage"]:
+                                limiter.record_tokens(estimated, chunk["usage"].get("total_tokens"))
+                            yield chunk
+                    self.router.record(provider, None, True)
+                    metrics.observe("llm_stream_seconds", time.monotonic() - start, provider=provider.name)
+                    return
+                except (asyncio.CancelledError, DeadlineExceeded):
+                    raise
+                except Exception as e:
+                    # 限流或临时错误且还没有输出时，先在同一个 provider 上退避重试
+                    if not started and await limiter.backoff(attempt, e):
+                        attempt += 1
+                        continue
+                    self.router.record(provider, None, False)
+                    last_error = e
+                    break
+            if started:
+                break
+            metrics.incr("llm_failovers", provider=provider.name)
+            logger.warning(f"LLM provider {provider.name} stream failed: {last_error}")
+        raise Exception(f"Streaming chat completion failed: {str(last_error)}")
+
+    async def _stream_once(self, provider: LLMProvider, messages: List[Dict], profile: EndpointProfile, response_format: Optional[Dict]) -> AsyncIterator[Dict]:
+        session = await self._get_session(provider.name)
+        payload = self._payload(provider, messages, profile, response_format, stream=True)
+        usage = None
+        finish_reason = None
+
+        async with session.post(
+            provider.base_url,
+            headers=provider.headers,
+            json=payload,
+            **self._timeout(profile, stream=True)
+        ) as response:
+            if response.status != 200:
+                raise await self._upstream_error(response)
+
+            if provider.api == "ollama":
+                # Ollama 每行一个 JSON 对象，最后一块 done 为 true，包含 token 数和耗时
+                async for raw_line in response.content:
+                    chunk = self.ollama.stream_chunk(raw_line)
+                    if chunk is None:
+                        continue
+                    if chunk.get("done"):
+                        _, usage, finish_reason = self.ollama.parse(provider.name, chunk)
+                        break
+                    delta = (chunk.get("message") or {}).get("content")
+                    if delta:
+                        yield {"delta": delta}
+                yield {"usage": self._record_usage(provider, usage), "finish_reason": finish_reason}
+                return
+
+            # SSE 格式：每个事件为一行 "data: {...}"，以 "data: [DONE]" 结束
+            async for raw_line in response.content:
+                line = raw_line.decode("utf-8").strip()
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                if chunk.get("usage"):
+                    usage = chunk["usage"]
+                for choice in chunk.get("choices") or []:
+                    delta = (choice.get("delta") or {}).get("content")
+                    if delta:
+                        yield {"delta": delta}
+                    if choice.get("finish_reason"):
+                        finish_reason = choice["finish_reason"]
+
+        yield {"usage": self._record_usage(provider, usage), "finish_reason": finish_reason}
+
+    async def stream_structured_chat(self, messages: List[Dict], model: Optional[str] = None, stream_fields: Iterable[str] = ("speechText",), response_schema: Optional[Dict] = None, output_model: Optional[Type[BaseModel]] = None, profile: Union[str, EndpointProfile, None] = None) -> AsyncIterator[Dict]:
+        """
+        流式的结构化对话，在模型生成过程中增量解析 JSON，response_schema、output_model 和 profile 同 structured_chat
+        
+        产出:
+            {"type": "delta", "delta": str}  # 模型新生成的文本片段
+            {"type": "item", "field": str, "index": int, "value": Any}  # stream_fields 数组中新完成的元素，如一句 speechText
+            {"type": "field", "field": str, "value": Any}  # 已完成的顶层字段
+            {"type": "done", "value": Dict}  # 最后一个事件，与 structured_chat 的返回相同（包含 usage）
+        """
+        response_format = self.response_format_for(response_schema)
+        profile = self.profiles.resolve(profile, model)
+        parser = IncrementalJSONParser(stream_fields)
+        parts = []
+        usage = None
+        async for chunk in self.stream_chat_completion(messages, response_format=response_format, profile=profile):
+            if "delta" in chunk:
+                parts.append(chunk["delta"])
+                yield {"type": "delta", "delta": chunk["delta"]}
+                for event in parser.feed(chunk["delta"]):
+                    # 完整结果以最终的解析（含修复逻辑）为准
+                    if event["type"] != "done":
+                        yield event
+            else:
+                usage = chunk["usage"]
+
+        result = await self.parse_structured_response(
+            {"content": "".join(parts), "usage": usage},
+            messages,
+            profile,
+            response_format,
+            output_model
+        )
+        yield {"type": "done", "value": result}
+
+    async def structured_chat(self, messages: List[Dict], output_format: Optional[str] = None, model: Optional[str] = None, response_schema: Optional[Dict] = None, output_model: Optional[Type[BaseModel]] = None, cache: bool = False, profile: Union[str, EndpointProfile, None] = None) -> Dict:
         """
         进行结构化输出的对话
+        
+        参数:
+            response_schema: 期望输出的 JSON Schema（见 models/output_schemas.py），
+                             开启 LLM_RESPONSE_FORMAT 时作为 response_format 传给支持的 provider
+            output_model: 期望输出的 Pydantic 模型（见 models/output_models.py），解析后校验结构，
+                          缺失或格式错误的字段会单独追问模型补全，而不是重新生成整个响应
+            cache: 是否缓存解析后的结果（同 chat_completion），解析失败的响应不会被缓存
+            model, profile: 同 chat_completion，修复和追问的请求使用相同的配置
+        """
+        response_format = self.response_format_for(response_schema)
+        profile = self.profiles.resolve(profile, model)
+        output_name = output_model.__name__ if output_model else None
+        key = cache_key("structured", self.provider, self.model, profile.cache_parts(), messages, response_format, output_name)
+        use_cache = cache and self.cache.enabled
+        if use_cache:
+            cached = await self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        async def call():
+            shadow = self.shadow.mirror(messages, profile, response_format, output_model)
+            start = time.monotonic()
+            response = None
+            try:
+                response = await self.chat_completion(messages, response_format=response_format, profile=profile)
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                raise Exception(f"Structured chat failed: {str(e)}")
+            finally:
+                if shadow is not None:
+                    shadow.primary_done(response, time.monotonic() - start)
+            result = await self.parse_structured_response(response, messages, profile, response_format, output_model)
+            # 解析失败时返回的原始内容不带 usage，这种结果不缓存，下次请求重新生成
+            if use_cache and "usage" in result:
+                await self.cache.set(key, result)
+            return result
+
+        return await self._single_flight(key, call)
+
+    async def _single_flight(self, key: str, call: Callable[[], Awaitable[Dict]]) -> Dict:
         """
+        合并相同的并发请求：key 相同的调用共享同一个上游请求（如前端超时重试、重复点击生成计划）
+
+        上游请求在独立的 task 中运行，等待者按引用计数，只有所有等待者都取消后才取消上游请求；
+        每个等待者拿到结果的独立副本
+        """
+        flight = self._inflight.get(key)
+        if flight is None:
+            flight = {"task": asyncio.ensure_future(call()), "waiters": 0}
+            self._inflight[key] = flight
+            flight["task"].add_done_callback(lambda _: self._end_flight(key, flight))
+            metrics.incr("llm_single_flight", result="leader")
+        else:
+            metrics.incr("llm_single_flight", result="joined")
+
+        flight["waiters"] += 1
         try:
+            result = await asyncio.shield(flight["task"])
+        except asyncio.CancelledError:
+            flight["waiters"] -= 1
+            if flight["waiters"] == 0 and not flight["task"].done():
+                # 最后一个等待者离开，取消上游请求；之后的相同请求重新发起
+                self._end_flight(key, flight)
+                flight["task"].cancel()
+                metrics.incr("llm_single_flight_cancelled")
+            raise
+        flight["waiters"] -= 1
+        return copy.deepcopy(result)
 
-            response = await self.chat_completion(messages, model)
-            content = response["content"]
-            
-            print("\n=== API 响应内容 ===\n")
-            print(content)
-            print()
-            
-            # 删除可能的代码块标记和空行
-            content = content.replace('```json', '').replace('```', '')
-            
-            lines = [line.strip() for line in content.split('\n') if line.strip()]
-            content = '\n'.join(lines)
+    def _end_flight(self, key: str, flight: Dict) -> None:
+        if self._inflight.get(key) is flight:
+            del self._inflight[key]
+
+    def response_format_for(self, response_schema: Optional[Dict]) -> Optional[Dict]:
+        """
+        根据 LLM_RESPONSE_FORMAT 生成 response_format，不适用时返回 None；
+        发送时再按实际使用的 provider 的支持情况调整（见 LLMProvider.adapt_response_format）
+        """
+        # JSON mode 只能约束顶层为对象的输出
+        if response_schema is None or response_schema.get("type") != "object":
+            return None
+        if self.response_format_mode == "json_schema":
+            return {
+                "type": "json_schema",
+                "json_schema": {
+                    "name": response_schema.get("title", "response"),
+                    "schema": {k: v for k, v in response_schema.items() if k != "title"}
+                }
+            }
+        if self.response_format_mode == "json_object":
+            return {"type": "json_object"}
+        return None
+
+    async def parse_structured_response(self, response: Dict, messages: List[Dict], profile: Union[str, EndpointProfile, None] = None, response_format: Optional[Dict] = None, output_model: Optional[Type[BaseModel]] = None) -> Dict:
+        """
+        从模型的完整输出中解析 JSON，解析失败时先在本地修复常见的格式错误，仍失败才让模型修复一次
+        
+        参数:
+            response: chat_completion 格式的响应，包含 content 和 usage
+            messages: 产生该响应的原始消息，用于修复时提供格式要求
+            profile: 生成该响应时使用的接口配置，修复和追问时沿用
+            response_format: 生成该响应时使用的 response_format，修复时沿用
+            output_model: 解析成功后用于校验结构的 Pydantic 模型，为 None 时不校验
+        """
+        json_mode = response_format["type"] if response_format else "off"
+        metrics.incr("llm_structured_responses", provider=self.provider, json_mode=json_mode)
+        content = response["content"]
+        
+        log_payload(logger, "LLM response", content)
+
+        try:
+            return await self._finish_structured(extract_json(content), response["usage"], messages, profile, output_model)
+        except ValueError as e:
+            logger.warning(f"JSON parse error: {e}")
+
+            repaired = self._repair_locally(content, json_mode)
+            if repaired is not None:
+                return await self._finish_structured(repaired, response["usage"], messages, profile, output_model)
             
-           # print("\n=== 清理后的内容 ===\n")
-            #print(content)
-            #print()
+            logger.info("Asking the model to repair the JSON response")
+            metrics.incr("llm_json_repair_calls", provider=self.provider, json_mode=json_mode)
             
-            # 先检查是否是数组
-            array_start = content.find('[')
-            object_start = content.find('{')
+            # 添加重试消息
+            system_message = {
+                "role": "system",
+                "content": "下面返回的内容不是一个有效的json格式，请将下面错误的json格式修复返回，仅返回json即可，无需其他说明。原始的格式要求如下：" + messages[0]["content"] if isinstance(messages[0], dict) else str(messages[0])
+            }
+            user_message = {
+                "role": "user",
+                "content": "返回的错误json格式内容：" + content
+            }
+            retry_messages = [system_message, user_message]
             
-            # 尝试解析 JSON
             try:
-                if array_start != -1 and (object_start == -1 or array_start < object_start):
-                    start = array_start
-                elif object_start != -1:
-                    start = object_start
-                else:
-                    raise Exception("No valid JSON found in response")
-                # 找到结束的花括号或方括号
-                end = -1
-                stack = []
-                in_string = False
-                escape = False
-                
-                for i, char in enumerate(content[start:]):
-                    if char == '\\' and not escape:
-                        escape = True
-                        continue
-                    
-                    if char == '"' and not escape:
-                        in_string = not in_string
-                    
-                    if not in_string:
-                        if char in '{[':
-                            stack.append(char)
-                            #print(f"Push: {char}, Stack: {stack}")
-                        elif char in '}]':
-                            if not stack:
-                                print(f"Error: Found closing {char} but stack is empty")
-                                break
-                            if (char == '}' and stack[-1] == '{') or (char == ']' and stack[-1] == '['):
-                                stack.pop()
-                                #print(f"Pop: {char}, Stack: {stack}")
-                                if not stack:  # 找到匹配的结束括号
-                                    end = i + 1
-                                    #print(f"Found matching end at position {end}")
-                                    break
-                            else:
-                                print(f"Error: Mismatched brackets. Found {char} but expected matching for {stack[-1]}")
-                    
-                    escape = False
-                
-                if end == -1:
-                    raise Exception("Could not find matching closing bracket")
-                
-                json_str = content[start:start + end]
-                #print("\n=== 提取的 JSON 字符串 ===\n")
-                #print(json_str)
-                #print()
-                
-                result = json.loads(json_str)
-                # 如果结果是字符串，尝试解析为 JSON
-                if isinstance(result, str):
-                    result = json.loads(result)
-                
-                # 如果结果是数组，将其放入content字段中，确保返回的始终是一个对象
-                if isinstance(result, list):
-                    result = {"content": result}
-                    
-                # 添加usage信息
-                result["usage"] = response["usage"]
-                return result
-            except Exception as e:
-                print("\n=== JSON 解析错误 ===\n")
-                print(f"Error: {str(e)}")
-                print()
-                
-                print("尝试重新生成符合格式要求的响应...")
-                
-                # 添加重试消息
-                system_message = {
-                    "role": "system",
-                    "content": "下面返回的内容不是一个有效的json格式，请将下面错误的json格式修复返回，仅返回json即可，无需其他说明。原始的格式要求如下：" + messages[0]["content"] if isinstance(messages[0], dict) else str(messages[0])
-                }
-                user_message = {
-                    "role": "user",
-                    "content": "返回的错误json格式内容：" + content
-                }
-                retry_messages = [system_message, user_message]
+                # 重新调用API
+                retry_response = await self.chat_completion(retry_messages, response_format=response_format, profile=profile)
+                retry_content = retry_response["content"]
                 
+                log_payload(logger, "LLM repaired response", retry_content)
+
                 try:
-                    # 重新调用API
-                    retry_response = await self.chat_completion(retry_messages, model)
-                    retry_content = retry_response["content"]
-                    
-                    print("\n=== 重试生成的内容 ===\n")
-                    print(retry_content)
-                    print()
-                    
-                    # 清理内容
-                    retry_content = retry_content.replace('```json', '').replace('```', '')
-                    lines = [line.strip() for line in retry_content.split('\n') if line.strip()]
-                    retry_content = '\n'.join(lines)
-                    
-                    # 尝试解析JSON
-                    array_start = retry_content.find('[')
-                    object_start = retry_content.find('{')
-                    
-                    if array_start != -1 and (object_start == -1 or array_start < object_start):
-                        start = array_start
-                    elif object_start != -1:
-                        start = object_start
-                    else:
-                        raise Exception("No valid JSON found in retry response")
-                        
-                    # 找到结束的花括号或方括号
-                    end = -1
-                    stack = []
-                    in_string = False
-                    escape = False
-                    
-                    for i, char in enumerate(retry_content[start:]):
-                        if char == '\\' and not escape:
-                            escape = True
-                            continue
-                        
-                        if char == '"' and not escape:
-                            in_string = not in_string
-                        
-                        if not in_string:
-                            if char in '{[':
-                                stack.append(char)
-                            elif char in '}]':
-                                if not stack:
-                                    print(f"Error: Found closing {char} but stack is empty")
-                                    break
-                                if (char == '}' and stack[-1] == '{') or (char == ']' and stack[-1] == '['):
-                                    stack.pop()
-                                    if not stack:  # 找到匹配的结束括号
-                                        end = i + 1
-                                        break
-                                else:
-                                    print(f"Error: Mismatched brackets. Found {char} but expected matching for {stack[-1]}")
-                        
-                        escape = False
-                    
-                    if end == -1:
-                        raise Exception("Could not find matching closing bracket in retry response")
-                    
-                    json_str = retry_content[start:start + end]
-                    retry_result = json.loads(json_str)
-                    
-                    # 如果结果是字符串，尝试解析为 JSON
-                    if isinstance(retry_result, str):
-                        retry_result = json.loads(retry_result)
-                    
-                    # 如果结果是数组，将其放入content字段中，确保返回的始终是一个对象
-                    if isinstance(retry_result, list):
-                        retry_result = {"content": retry_result}
-                    
-                    # 添加usage信息
-                    retry_result["usage"] = response["usage"]
-                    
-                    return retry_result
-                except Exception as retry_e:
-                    print(f"\n=== 重试解析错误 ===\n")
-                    print(f"Error: {str(retry_e)}")
-                    print()
-                
-                # 如果重试也失败或没有输出格式要求，返回原始内容
-                return {"content": content}
+                    retry_result = extract_json(retry_content)
+                except ValueError:
+                    retry_result = self._repair_locally(retry_content, json_mode)
+                    if retry_result is None:
+                        raise
+                usage = self._merge_usage(response["usage"], retry_response.get("usage"))
+                return await self._finish_structured(retry_result, usage, messages, profile, output_model)
+            except Exception as retry_e:
+                metrics.incr("llm_json_repair_failures", provider=self.provider, json_mode=json_mode)
+                logger.warning(f"JSON repair failed: {retry_e}")
             
-        except json.JSONDecodeError as e:
-            raise Exception(f"Failed to parse JSON response: {str(e)}\nContent: {content}")
+            # 如果重试也失败，返回去掉代码块标记的原始内容
+            return {"content": content.replace('```json', '').replace('```', '').strip()}
+
+    def _repair_locally(self, content: str, json_mode: str):
+        """
+        尝试在本地修复 JSON（尾逗号、未转义换行、单引号、None/True、截断等），无法修复时返回 None
+        """
+        try:
+            result, repairs = repair_json(content)
+        except ValueError as e:
+            metrics.incr("llm_json_local_repair_failures", provider=self.provider, json_mode=json_mode)
+            logger.info(f"Local JSON repair failed: {e}")
+            return None
+        metrics.incr("llm_json_local_repairs", provider=self.provider, json_mode=json_mode)
+        for kind in repairs:
+            metrics.incr("llm_json_local_repair_kinds", kind=kind)
+        logger.info(f"Repaired JSON locally: {', '.join(repairs)}")
+        return result
+
+    async def _finish_structured(self, result, usage: Optional[Dict], messages: List[Dict], profile, output_model: Optional[Type[BaseModel]]) -> Dict:
+        """
+        按 output_model 校验解析出的 JSON（需要时追问缺失的字段），再统一结果格式
+        """
+        if output_model is not None:
+            result, usage = await self._validate_output(result, usage, messages, profile, output_model)
+        return self._to_structured_result(result, usage)
+
+    async def _validate_output(self, result, usage: Optional[Dict], messages: List[Dict], profile, output_model: Type[BaseModel]):
+        """
+        用 output_model 校验结果，失败时只追问缺失或格式错误的顶层字段（数组结果为出错的元素），
+        把模型返回的字段合并回原结果后重新校验，最多追问 max_reasks 次。
+        仍然不符合时返回当前结果，由调用方按原来的方式兼容处理
+        """
+        name = output_model.__name__
+        for attempt in range(self.max_reasks + 1):
+            try:
+                output_model.model_validate(result)
+                if attempt:
+                    metrics.incr("llm_schema_reask_fixed", model=name)
+                return result, usage
+            except ValidationError as e:
+                errors = e.errors()
+            if attempt == 0:
+                metrics.incr("llm_schema_validation_failures", model=name)
+            fields = self._invalid_fields(result, errors)
+            if attempt == self.max_reasks or not fields:
+                break
+            metrics.incr("llm_schema_reasks", model=name)
+            patch, reask_usage = await self._reask_fields(result, errors, fields, messages, profile)
+            usage = self._merge_usage(usage, reask_usage)
+            if patch is None:
+                break
+            result = self._merge_fields(result, patch, fields)
+
+        metrics.incr("llm_schema_invalid", model=name)
+        logger.warning(f"{name} validation failed: {self._describe_errors(errors)}")
+        return result, usage
+
+    @staticmethod
+    def _invalid_fields(result, errors: List[Dict]) -> List:
+        """
+        出错的顶层字段名（对象）或元素下标（数组），整体类型不对时返回空列表
+        """
+        if not isinstance(result, (dict, list)):
+            return []
+        fields = []
+        for error in errors:
+            if not error["loc"]:
+                return []
+            if error["loc"][0] not in fields:
+                fields.append(error["loc"][0])
+        return fields
+
+    @staticmethod
+    def _describe_errors(errors: List[Dict], limit: int = 20) -> str:
+        lines = []
+        for error in errors[:limit]:
+            loc = ".".join(str(part) for part in error["loc"])
+            lines.append(f"- {loc}: {error['msg']}")
+        return "\n".join(lines)
+
+    async def _reask_fields(self, result, errors: List[Dict], fields: List, messages: List[Dict], profile):
+        """
+        在原始对话后附上已生成的 JSON，让模型只返回需要修正的字段，返回 (字段 JSON 对象, usage)，失败时字段为 None
+        """
+        problems = self._describe_errors(errors)
+        if isinstance(result, list):
+            indices = ", ".join(str(index) for index in fields)
+            prompt = (
+                f"上面 JSON 数组中下标为 {indices} 的元素缺失字段或格式不正确：\n{problems}\n"
+                f"请只返回一个 JSON 对象，键为元素下标，值为按原始格式要求修正后的完整元素，"
+                f"例如 {{\"{fields[0]}\": {{...}}}}，不要返回其他元素或说明。"
+            )
+        else:
+            names = ", ".join(str(field) for field in fields)
+            prompt = (
+                f"上面 JSON 中以下字段缺失或格式不正确：\n{problems}\n"
+                f"请只返回一个包含 {names} 字段的 JSON 对象，按原始格式要求补全或修正这些字段，不要返回其他字段或说明。"
+            )
+        reask_messages = list(messages) + [
+            {"role": "assistant", "content": json.dumps(result, ensure_ascii=False)},
+            {"role": "user", "content": prompt}
+        ]
+        try:
+            response = await self.chat_completion(reask_messages, profile=profile)
         except Exception as e:
-            raise Exception(f"Structured chat failed: {str(e)}")
+            logger.warning(f"Re-ask for invalid fields failed: {e}")
+            return None, None
+        try:
+            patch = extract_json(response["content"])
+        except ValueError:
+            try:
+                patch, _ = repair_json(response["content"])
+            except ValueError as e:
+                logger.warning(f"Re-ask returned invalid JSON: {e}")
+                return None, response["usage"]
+        if not isinstance(patch, dict):
+            return None, response["usage"]
+        return patch, response["usage"]
+
+    @staticmethod
+    def _merge_fields(result, patch: Dict, fields: List):
+        """把追问得到的字段（或数组元素）合并回原结果，只接受需要修正的字段"""
+        if isinstance(result, list):
+            merged = list(result)
+            for key, value in patch.items():
+                try:
+                    index = int(key)
+                except (TypeError, ValueError):
+                    continue
+                if index in fields and 0 <= index < len(merged):
+                    merged[index] = value
+            return merged
+        merged = dict(result)
+        for field in fields:
+            if field in patch:
+                merged[field] = patch[field]
+        return merged
+
+    @staticmethod
+    def _merge_usage(usage: Optional[Dict], extra: Optional[Dict]) -> Optional[Dict]:
+        """累加两次调用的 token 用量（包括 prompt_tokens_details 等嵌套的明细），任一方为 None 时返回另一方"""
+        if not usage or not extra:
+            return usage or extra
+        merged = dict(usage)
+        for key, value in extra.items():
+            if isinstance(value, dict) and isinstance(merged.get(key), dict):
+                merged[key] = LLMService._merge_usage(merged[key], value)
+            elif isinstance(value, (int, float)) and isinstance(merged.get(key, 0), (int, float)):
+                merged[key] = merged.get(key, 0) + value
+        return merged
+
+    @staticmethod
+    def _to_structured_result(result, usage: Optional[Dict]) -> Dict:
+        """
+        统一结构化结果的格式：数组以及字符串、数字等其他 JSON 值放入 content 字段，确保返回的始终是一个对象，并附上 usage
+        """
+        if not isinstance(result, dict):
+            result = {"content": result}
+        result["usage"] = usage
+        return result
+
+
+_shared_llm_service: Optional[LLMService] = None
+
+
+def get_llm_service() -> LLMService:
+    """
+    获取进程内共享的 LLMService 实例，LessonService 和 AssessmentService 共用同一个连接池
+    """
+    global _shared_llm_service
+    if _shared_llm_service is None:
+        _shared_llm_service = LLMService()
+    return _shared_llm_service
@@ -0,0 +1,61 @@
+import threading
+from typing import Dict
+
+
+class Metrics:
+    """
+    进程内的简单指标收集，按 "名称{标签}" 聚合计数器和耗时等观测值，通过 /api/metrics 查看
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = {}
+        self._gauges: Dict[str, float] = {}
+        self._observations: Dict[str, Dict[str, float]] = {}
+
+    @staticmethod
+    def _key(name: str, labels: Dict) -> str:
+        if not labels:
+            return name
+        label_text = ",".join(f"{k}={labels[k]}" for k in sorted(labels))
+        return f"{name}{{{label_text}}}"
+
+    def incr(self, name: str, value: float = 1, **labels) -> None:
+        """计数器加 value"""
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels) -> None:
+        """设置当前值，如队列长度"""
+        key = self._key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """记录一次观测值（如耗时），汇总为 count/sum/min/max"""
+        key = self._key(name, labels)
+        with self._lock:
+            stats = self._observations.get(key)
+            if stats is None:
+                self._observations[key] = {"count": 1, "sum": value, "min": value, "max": value}
+            else:
+                stats["count"] += 1
+                stats["sum"] += value
+                stats["min"] = min(stats["min"], value)
+                stats["max"] = max(stats["max"], value)
+
+    def snapshot(self) -> Dict:
+        """返回当前所有指标的副本"""
+        with self._lock:
+            observations = {}
+            for key, stats in self._observations.items():
+                observations[key] = dict(stats, avg=stats["sum"] / stats["count"])
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "observations": observations
+            }
+
+
+metrics = Metrics()
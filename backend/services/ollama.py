@@ -0,0 +1,116 @@
+import json
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class OllamaAPI:
+    """
+    Ollama 原生 /api/chat 接口（api 为 "ollama" 的 provider，如 promptai）的请求体和响应格式
+
+    - keep_alive：模型在两次请求之间保持加载的时间，默认 -1（不卸载），避免空闲后第一轮对话等待模型加载
+    - num_ctx：上下文长度；Ollama 在 num_ctx 变化时会重新加载模型，所以同一个模型的所有请求使用相同的值，
+      只有在 profile 中单独配置时才覆盖
+    - num_predict：输出 token 上限，取 profile 的 max_tokens
+
+    配置来自环境变量 OLLAMA_KEEP_ALIVE、OLLAMA_NUM_CTX、OLLAMA_PRELOAD
+    """
+
+    def __init__(self):
+        keep_alive = os.getenv('OLLAMA_KEEP_ALIVE', '-1')
+        # 纯数字为秒数，其他格式（如 "30m"）原样传给 Ollama
+        self.keep_alive = int(keep_alive) if keep_alive.lstrip('-').isdigit() else keep_alive
+        self.num_ctx = int(os.getenv('OLLAMA_NUM_CTX', '8192'))
+        self.preload_enabled = os.getenv('OLLAMA_PRELOAD', 'true').lower() == 'true'
+
+    def payload(self, model: str, messages: List[Dict], max_tokens: Optional[int], num_ctx: Optional[int],
+                response_format: Optional[Dict], stream: bool) -> Dict:
+        options = {"num_ctx": num_ctx or self.num_ctx}
+        if max_tokens:
+            options["num_predict"] = max_tokens
+        payload = {
+            "model": model,
+            "messages": messages,
+            "stream": stream,
+            "keep_alive": self.keep_alive,
+            "options": options
+        }
+        # Ollama 的 format 为 "json" 或 JSON Schema 对象
+        if response_format:
+            if response_format["type"] == "json_schema":
+                payload["format"] = response_format["json_schema"]["schema"]
+            else:
+                payload["format"] = "json"
+        return payload
+
+    def parse(self, provider_name: str, result: Dict) -> Tuple[str, Optional[Dict], Optional[str]]:
+        """
+        解析非流式响应（或流式响应的最后一块），返回 (content, usage, finish_reason)，
+        usage 转换为 OpenAI 格式，同时记录 Ollama 返回的各阶段耗时
+        """
+        if "error" in result:
+            raise Exception(f"Ollama error: {result['error']}")
+        content = (result.get("message") or {}).get("content", "")
+        return content, self.usage(provider_name, result), result.get("done_reason")
+
+    @staticmethod
+    def usage(provider_name: str, result: Dict) -> Optional[Dict]:
+        if "eval_count" not in result and "prompt_eval_count" not in result:
+            return None
+        # 整个 prompt 都命中了 Ollama 的 KV 缓存时不返回 prompt_eval_count
+        prompt_tokens = result.get("prompt_eval_count", 0)
+        completion_tokens = result.get("eval_count", 0)
+        model = result.get("model", "")
+        # 耗时的单位为纳秒
+        for field, name in (("load_duration", "ollama_load_seconds"),
+                            ("prompt_eval_duration", "ollama_prompt_eval_seconds"),
+                            ("eval_duration", "ollama_eval_seconds")):
+            if result.get(field):
+                metrics.observe(name, result[field] / 1e9, provider=provider_name, model=model)
+        if result.get("eval_duration") and completion_tokens:
+            metrics.set_gauge("ollama_eval_tokens_per_second", completion_tokens / (result["eval_duration"] / 1e9),
+                              provider=provider_name, model=model)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+
+    @staticmethod
+    def stream_chunk(line: bytes) -> Optional[Dict]:
+        """流式响应每行一个 JSON 对象（NDJSON），空行返回 None"""
+        line = line.strip()
+        if not line:
+            return None
+        chunk = json.loads(line)
+        if "error" in chunk:
+            raise Exception(f"Ollama error: {chunk['error']}")
+        return chunk
+
+    async def preload(self, session: aiohttp.ClientSession, provider, models: List[str]) -> None:
+        """
+        发送不含消息的请求让 Ollama 加载模型并按 keep_alive 保持，在应用启动时调用
+        """
+        for model in models:
+            try:
+                async with session.post(
+                    provider.base_url,
+                    headers=provider.headers,
+                    json={"model": model, "messages": [], "keep_alive": self.keep_alive,
+                          "options": {"num_ctx": self.num_ctx}}
+                ) as response:
+                    if response.status != 200:
+                        logger.warning(f"Preloading {model} on {provider.name} failed: {await response.text()}")
+                        continue
+                    result = await response.json()
+                    if result.get("load_duration"):
+                        metrics.observe("ollama_load_seconds", result["load_duration"] / 1e9, provider=provider.name, model=model)
+                    logger.info(f"Preloaded {model} on {provider.name}")
+            except Exception as e:
+                logger.warning(f"Preloading {model} on {provider.name} failed: {e}")
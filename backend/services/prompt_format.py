@@ -0,0 +1,56 @@
+import json
+import re
+import textwrap
+from enum import Enum
+from typing import Any
+
+from pydantic import BaseModel
+
+# 中日韩文字大约每个字符一个 token，其他文字大约每 4 个字符一个 token
+_CJK = re.compile(r'[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]')
+
+
+def prune(value: Any) -> Any:
+    """
+    去掉值为 None、空字符串、空列表和空对象的字段，Pydantic 模型和枚举转换为普通的 dict 和值
+    """
+    if isinstance(value, BaseModel):
+        value = value.model_dump()
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, dict):
+        pruned = {key: prune(item) for key, item in value.items()}
+        return {key: item for key, item in pruned.items() if item not in (None, "", [], {})}
+    if isinstance(value, (list, tuple)):
+        return [item for item in map(prune, value) if item not in (None, "", [], {})]
+    return value
+
+
+def compact(value: Any) -> str:
+    """
+    嵌入提示词的数据使用最小化的 JSON：去掉空字段、不加空格、键按固定顺序排列（相同的数据生成的提示词完全相同）
+    """
+    return json.dumps(prune(value), ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def prompt_text(template: str) -> str:
+    """
+    去掉提示词模板的源码缩进（只去掉各行共同的前缀，嵌套列表和 JSON 示例的相对缩进保持不变）、
+    行尾空白和连续的空行；紧跟在引号之后的第一行不参与计算共同的前缀。
+    在模板定义时调用一次（见 prompt_registry.PromptTemplate），不要在每次请求时调用
+    """
+    first, _, rest = template.expandtabs().partition("\n")
+    lines = []
+    for line in [first.strip()] + textwrap.dedent(rest).splitlines():
+        line = line.rstrip()
+        if line or (lines and lines[-1]):
+            lines.append(line)
+    while lines and not lines[-1]:
+        lines.pop()
+    return "\n".join(lines)
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的 token 数，用于限流的 tpm 预扣和提示词大小的对比，不依赖具体的 tokenizer"""
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
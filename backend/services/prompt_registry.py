@@ -0,0 +1,144 @@
+import json
+import logging
+import os
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from services.metrics import metrics
+from services.prompt_format import prompt_text
+
+logger = logging.getLogger(__name__)
+
+# 语言代码到语言名称的映射
+LANGUAGE_NAMES = {
+    "cmn-CN": "中文",
+    "en-US": "English",
+    "fr-FR": "French",
+    "es-ES": "Spanish",
+    "de-DE": "German",
+    "ja-JP": "Japanese",
+    "ko-KR": "Korean"
+}
+
+
+def language_name(lang_code: str) -> str:
+    """语言代码对应的语言名称，找不到时返回代码本身"""
+    return LANGUAGE_NAMES.get(lang_code, lang_code)
+
+
+class PromptTemplate:
+    """
+    一个系统提示词模板（str.format 格式），可用的变量为 native_language_name、target_language_name
+    和渲染时传入的参数
+
+    variant: 同一个提示词的不同写法，如课程的 study / practice 模式、评估的 en / zh 提示语言
+    version: 提示词的版本，新版本（如精简后的提示词）可以通过环境变量切换，见 PromptRegistry
+    dynamic: 每次请求都会变化的参数（如当前日期、用户档案中的字段），不参与缓存，每次渲染时替换
+
+    模板的源码缩进和多余空行在创建时去掉一次（prompt_format.prompt_text）
+    """
+
+    def __init__(self, name: str, text: str, variant: str = "default", version: str = "v1", dynamic: Iterable[str] = ()):
+        self.name = name
+        self.text = prompt_text(text)
+        self.variant = variant
+        self.version = version
+        self.dynamic = tuple(dynamic)
+
+    def compile(self, native_lang: str, learning_lang: str, params: Dict) -> str:
+        """代入语言名称和不变的参数，动态参数先替换为占位标记"""
+        values = {
+            "native_language_name": language_name(native_lang),
+            "target_language_name": language_name(learning_lang),
+            **params,
+            **{name: self._marker(name) for name in self.dynamic}
+        }
+        return self.text.format_map(values)
+
+    def fill(self, compiled: str, params: Dict) -> str:
+        for name in self.dynamic:
+            compiled = compiled.replace(self._marker(name), str(params[name]))
+        return compiled
+
+    @staticmethod
+    def _marker(name: str) -> str:
+        return f"\x00{name}\x00"
+
+
+class PromptRegistry:
+    """
+    所有系统提示词模板（见 services/prompt_templates），每个模板按
+    (版本, variant, 母语, 学习语言, 不变的参数) 编译一次后缓存，之后的请求直接使用编译好的文本
+
+    每个提示词默认使用 v1，环境变量 PROMPT_VERSION_<NAME>（如 PROMPT_VERSION_LESSON_TURN=v2）切换版本，
+    渲染次数按版本记录为 prompt_renders{prompt,version}，便于对比不同版本的效果；
+    各提示词在所有语言组合下的 token 数见 prompt_report.py
+    """
+
+    def __init__(self, templates: Iterable[PromptTemplate], max_entries: int = 1024):
+        self.templates: Dict[Tuple[str, str, str], PromptTemplate] = {}
+        for template in templates:
+            self.templates[(template.name, template.version, template.variant)] = template
+        self.versions = {name: os.getenv(f"PROMPT_VERSION_{name.upper()}", "v1") for name in self.names()}
+        self.max_entries = max_entries
+        self._compiled: "OrderedDict[Tuple, str]" = OrderedDict()
+
+    def names(self) -> List[str]:
+        return sorted({name for name, _, _ in self.templates})
+
+    def template(self, name: str, variant: str = "default", version: Optional[str] = None) -> PromptTemplate:
+        """查找模板，指定的版本或 variant 不存在时退回 v1 / default"""
+        version = version or self.versions.get(name, "v1")
+        for key in ((name, version, variant), (name, version, "default"), (name, "v1", variant), (name, "v1", "default")):
+            template = self.templates.get(key)
+            if template is not None:
+                if key[1] != version:
+                    logger.warning(f"Prompt {name} has no version {version}, using v1")
+                return template
+        raise KeyError(f"Unknown prompt template {name} ({variant})")
+
+    def render(self, name: str, native_lang: str, learning_lang: str, variant: str = "default",
+               version: Optional[str] = None, **params) -> str:
+        """
+        渲染提示词，params 为模板中除语言名称之外的参数（动态参数见 PromptTemplate.dynamic）
+        """
+        template = self.template(name, variant, version)
+        static = {key: value for key, value in params.items() if key not in template.dynamic}
+        key = (template.name, template.version, template.variant, native_lang, learning_lang, self._params_key(static))
+        compiled = self._compiled.get(key)
+        if compiled is None:
+            compiled = template.compile(native_lang, learning_lang, static)
+            self._compiled[key] = compiled
+            while len(self._compiled) > self.max_entries:
+                self._compiled.popitem(last=False)
+        else:
+            self._compiled.move_to_end(key)
+        metrics.incr("prompt_renders", prompt=name, version=template.version)
+        return template.fill(compiled, params)
+
+    @staticmethod
+    def _params_key(static: Dict):
+        """不变的参数作为缓存 key 的一部分；值不可哈希（dict、list）时按排序后的 JSON 文本区分"""
+        items = tuple(sorted(static.items()))
+        try:
+            hash(items)
+        except TypeError:
+            return json.dumps(static, sort_keys=True, ensure_ascii=False, default=str)
+        return items
+
+    def clear(self) -> None:
+        self._compiled.clear()
+
+
+_shared_registry: Optional[PromptRegistry] = None
+
+
+def get_prompt_registry() -> PromptRegistry:
+    """
+    获取进程内共享的 PromptRegistry，LessonService 和 AssessmentService 共用编译好的提示词
+    """
+    global _shared_registry
+    if _shared_registry is None:
+        from services.prompt_templates import TEMPLATES
+        _shared_registry = PromptRegistry(TEMPLATES)
+    return _shared_registry
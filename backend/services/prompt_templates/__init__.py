@@ -0,0 +1,4 @@
+from services.prompt_templates import assessment, lesson
+
+# 所有的提示词模板，新增的模板（包括已有提示词的新版本）加入对应模块的 TEMPLATES
+TEMPLATES = lesson.TEMPLATES + assessment.TEMPLATES
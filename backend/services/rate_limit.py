@@ -0,0 +1,250 @@
+import aiohttp
+import asyncio
+import logging
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, Optional
+
+from services.deadline import DeadlineExceeded, remaining
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 可以重试的上游状态码：限流和临时不可用
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+
+class UpstreamError(Exception):
+    """
+    上游返回了错误状态码，retry_after 为上游在 Retry-After 头中要求的等待秒数
+    """
+
+    def __init__(self, status: int, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        return self.status in RETRYABLE_STATUS
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 头，支持秒数和 HTTP 日期两种格式"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    令牌桶，容量为每分钟的配额，按速率连续补充；per_minute 为 0 时不限制
+
+    consume 可以透支（如按实际 token 用量补扣），之后的 acquire 会等到余额恢复
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1) -> None:
+        if not self.enabled:
+            return
+        amount = min(amount, self.capacity)
+        # 排队获取，先到先得
+        async with self._lock:
+            self._refill()
+            while self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= amount
+
+    def consume(self, amount: float) -> None:
+        if self.enabled:
+            self._refill()
+            self.tokens -= amount
+
+
+class RetryBudget:
+    """
+    全局重试预算：每个请求存入 ratio 个令牌，每次重试取出一个，另有每秒 min_per_second 的保底额度，
+    上游大面积故障时重试不会成倍放大请求量
+    """
+
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 1, max_tokens: float = 100):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.updated = time.monotonic()
+
+    def deposit(self) -> None:
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_withdraw(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.max_tokens, self.tokens + (now - self.updated) * self.min_per_second)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class UpstreamLimiter:
+    """
+    单个上游（某个 LLM provider、TTS、ASR）的出站限制：请求数/分钟、token 数/分钟和最大并发数
+
+    配置来自环境变量 <NAME>_RPM、<NAME>_TPM、<NAME>_CONCURRENCY（如 LLM_GOOGLE_RPM、TTS_CONCURRENCY），0 表示不限制
+    """
+
+    def __init__(self, name: str, rpm: float = 0, tpm: float = 0, concurrency: int = 0,
+                 max_retries: int = 2, base_delay: float = 0.5, max_delay: float = 20):
+        self.name = name
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.semaphore = asyncio.Semaphore(concurrency) if concurrency > 0 else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.waiting = 0
+
+    @classmethod
+    def from_env(cls, name: str, concurrency: int = 0) -> "UpstreamLimiter":
+        prefix = name.upper()
+        return cls(
+            name,
+            rpm=float(os.getenv(f'{prefix}_RPM', '0')),
+            tpm=float(os.getenv(f'{prefix}_TPM', '0')),
+            concurrency=int(os.getenv(f'{prefix}_CONCURRENCY', str(concurrency))),
+            max_retries=int(os.getenv(f'{prefix}_MAX_RETRIES', os.getenv('UPSTREAM_MAX_RETRIES', '2'))),
+            base_delay=float(os.getenv('UPSTREAM_RETRY_BASE_DELAY', '0.5')),
+            max_delay=float(os.getenv('UPSTREAM_RETRY_MAX_DELAY', '20'))
+        )
+
+    @asynccontextmanager
+    async def slot(self, tokens: float = 0):
+        """
+        等待并发名额和 rpm/tpm 配额后执行请求，排队时间记录为 upstream_queue_wait_seconds
+        """
+        start = time.monotonic()
+        self.waiting += 1
+        metrics.set_gauge("upstream_queued", self.waiting, upstream=self.name)
+        acquired = False
+        try:
+            if self.semaphore is not None:
+                await self.semaphore.acquire()
+                acquired = True
+            await self.requests.acquire(1)
+            if tokens:
+                await self.tokens.acquire(tokens)
+        except BaseException:
+            if acquired:
+                self.semaphore.release()
+            raise
+        finally:
+            self.waiting -= 1
+            metrics.set_gauge("upstream_queued", self.waiting, upstream=self.name)
+        metrics.observe("upstream_queue_wait_seconds", time.monotonic() - start, upstream=self.name)
+        try:
+            yield
+        finally:
+            if self.semaphore is not None:
+                self.semaphore.release()
+
+    def record_tokens(self, estimated: float, actual: Optional[float]) -> None:
+        """用实际的 token 用量修正请求前按估算扣除的 tpm 配额"""
+        if actual is not None:
+            self.tokens.consume(actual - estimated)
+
+    async def backoff(self, attempt: int, error: Exception) -> bool:
+        """
+        第 attempt 次（从 0 开始）失败后判断是否重试：只重试限流/临时错误和连接错误，
+        受重试次数和全局重试预算限制；需要重试时按 Retry-After 或指数退避加随机抖动等待后返回 True
+
+        客户端的超时不重试：慢但正常的请求（如生成计划）重试也会再次超时，由调用方切换 provider
+        """
+        if isinstance(error, UpstreamError):
+            if not error.retryable:
+                return False
+        elif isinstance(error, (DeadlineExceeded, asyncio.TimeoutError, TimeoutError)):
+            return False
+        elif not isinstance(error, (aiohttp.ClientConnectionError, OSError)):
+            return False
+        if attempt >= self.max_retries:
+            return False
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None and retry_after > self.max_delay:
+            # 上游要求等待的时间过长时不在这里等，交给调用方处理（如切换 provider）
+            return False
+        if not retry_budget.try_withdraw():
+            metrics.incr("upstream_retry_budget_exhausted", upstream=self.name)
+            return False
+        if retry_after is not None:
+            delay = retry_after
+        else:
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        left = remaining()
+        if left is not None and delay >= left:
+            # 等待后请求已经没有剩余时间了
+            return False
+        metrics.incr("upstream_retries", upstream=self.name, status=getattr(error, "status", "network"))
+        logger.warning(f"{self.name} request failed ({error}), retrying in {delay:.2f}s")
+        await asyncio.sleep(delay)
+        return True
+
+    async def call(self, request: Callable[[], Awaitable], tokens: float = 0):
+        """
+        在限流下执行 request()，失败时按 backoff 的规则重试
+        """
+        retry_budget.deposit()
+        attempt = 0
+        while True:
+            try:
+                async with self.slot(tokens):
+                    return await request()
+            except Exception as e:
+                if not await self.backoff(attempt, e):
+                    raise
+                attempt += 1
+
+
+retry_budget = RetryBudget(
+    ratio=float(os.getenv('UPSTREAM_RETRY_BUDGET_RATIO', '0.2')),
+    min_per_second=float(os.getenv('UPSTREAM_RETRY_BUDGET_MIN_PER_SECOND', '1'))
+)
+
+_limiters: Dict[str, UpstreamLimiter] = {}
+
+
+def get_limiter(name: str, concurrency: int = 0) -> UpstreamLimiter:
+    """
+    获取上游对应的限流器（进程内共享），concurrency 为未配置 <NAME>_CONCURRENCY 时的默认并发上限
+    """
+    limiter = _limiters.get(name)
+    if limiter is None:
+        limiter = UpstreamLimiter.from_env(name, concurrency)
+        _limiters[name] = limiter
+    return limiter
@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional
+
+from services.deadline import DeadlineExceeded, budget
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 优先级从高到低：interactive 为正在进行的对话（每轮需要几秒内回复），report 为用户在等待的报告和计划，
+# batch 为可以晚一些完成的后台任务（每周计划和总结、对话摘要、影子流量）
+PRIORITIES = ("interactive", "report", "batch")
+
+# 默认的权重（并发名额空出时各优先级被选中的比例）和最多占用的并发名额比例
+DEFAULT_WEIGHTS = {"interactive": 8, "report": 3, "batch": 1}
+DEFAULT_SHARES = {"interactive": 1.0, "report": 0.75, "batch": 0.5}
+
+
+class _Waiter:
+    __slots__ = ("priority", "future", "enqueued")
+
+    def __init__(self, priority: str, future: asyncio.Future):
+        self.priority = priority
+        self.future = future
+        self.enqueued = time.monotonic()
+
+
+class PriorityScheduler:
+    """
+    所有 LLM 上游请求共用的并发名额，按优先级排队
+
+    - 加权公平排队：名额空出时按 stride scheduling 选择优先级，每个优先级被选中的次数与权重成正比，
+      低优先级的请求不会被完全饿死
+    - 老化：排队超过 aging 秒的请求不再按权重排序，按入队的先后优先获得名额
+    - 每个优先级最多占用一部分名额，长时间的批量任务占满名额时交互式的对话仍然可以立即开始
+
+    名额按单次上游请求占用（包括限流重试），同一个接口的续写、修复等后续请求重新排队，
+    所以批量任务在两次请求之间会让出名额给对话
+
+    配置来自环境变量 LLM_SCHEDULER_CONCURRENCY（0 表示不排队）、LLM_SCHEDULER_AGING、
+    LLM_SCHEDULER_WEIGHT_<PRIORITY>、LLM_SCHEDULER_SHARE_<PRIORITY>
+    """
+
+    def __init__(self, concurrency: Optional[int] = None, weights: Optional[Dict[str, float]] = None,
+                 shares: Optional[Dict[str, float]] = None, aging: Optional[float] = None):
+        self.concurrency = concurrency if concurrency is not None else int(os.getenv('LLM_SCHEDULER_CONCURRENCY', '16'))
+        self.aging = aging if aging is not None else float(os.getenv('LLM_SCHEDULER_AGING', '30'))
+        weights = weights or {p: float(os.getenv(f'LLM_SCHEDULER_WEIGHT_{p.upper()}', str(DEFAULT_WEIGHTS[p]))) for p in PRIORITIES}
+        shares = shares or {p: float(os.getenv(f'LLM_SCHEDULER_SHARE_{p.upper()}', str(DEFAULT_SHARES[p]))) for p in PRIORITIES}
+        self.weights = {p: max(weights.get(p, 1), 0.01) for p in PRIORITIES}
+        # 每个优先级至少可以占用一个名额
+        self.limits = {p: max(1, int(self.concurrency * shares.get(p, 1.0))) for p in PRIORITIES}
+        self.queues: Dict[str, Deque[_Waiter]] = {p: deque() for p in PRIORITIES}
+        self.running = {p: 0 for p in PRIORITIES}
+        self.active = 0
+        # stride scheduling：每个优先级的 pass 值，被选中后增加 1/weight，选择 pass 最小的优先级
+        self._passes = {p: 0.0 for p in PRIORITIES}
+        self._virtual = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.concurrency > 0
+
+    @asynccontextmanager
+    async def slot(self, priority: str):
+        """
+        等待一个并发名额，等待时间不超过请求剩余的时间（见 services/deadline.py）
+        """
+        if not self.enabled:
+            yield
+            return
+        if priority not in self.queues:
+            priority = "report"
+
+        waiter = _Waiter(priority, asyncio.get_running_loop().create_future())
+        queue = self.queues[priority]
+        if not queue:
+            # 空闲后重新开始排队的优先级从当前的进度开始，不能用之前积累的 pass 值连续占用名额
+            self._passes[priority] = max(self._passes[priority], self._virtual)
+        queue.append(waiter)
+        self._dispatch()
+
+        try:
+            await asyncio.wait_for(waiter.future, budget(None))
+        except BaseException as e:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._release(priority)
+            else:
+                try:
+                    queue.remove(waiter)
+                except ValueError:
+                    pass
+                self._report()
+            if isinstance(e, asyncio.TimeoutError) and not isinstance(e, DeadlineExceeded):
+                raise DeadlineExceeded("Request deadline exceeded while queued") from e
+            raise
+        metrics.observe("llm_scheduler_wait_seconds", time.monotonic() - waiter.enqueued, priority=priority)
+
+        try:
+            yield
+        finally:
+            self._release(priority)
+
+    def _release(self, priority: str) -> None:
+        self.running[priority] -= 1
+        self.active -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """把空出的名额分配给排队的请求"""
+        while self.active < self.concurrency:
+            waiter = self._next()
+            if waiter is None:
+                break
+            self.running[waiter.priority] += 1
+            self.active += 1
+            waiter.future.set_result(None)
+        self._report()
+
+    def _next(self) -> Optional[_Waiter]:
+        # 已经取消的等待者（如客户端断开）直接丢弃
+        for queue in self.queues.values():
+            while queue and queue[0].future.done():
+                queue.popleft()
+
+        candidates = [p for p in PRIORITIES if self.queues[p] and self.running[p] < self.limits[p]]
+        if not candidates:
+            return None
+
+        now = time.monotonic()
+        aged = [p for p in candidates if now - self.queues[p][0].enqueued >= self.aging]
+        if aged:
+            priority = min(aged, key=lambda p: self.queues[p][0].enqueued)
+            metrics.incr("llm_scheduler_aged", priority=priority)
+        else:
+            priority = min(candidates, key=lambda p: (self._passes[p], PRIORITIES.index(p)))
+        self._virtual = self._passes[priority]
+        self._passes[priority] += 1 / self.weights[priority]
+        return self.queues[priority].popleft()
+
+    def _report(self) -> None:
+        for p in PRIORITIES:
+            metrics.set_gauge("llm_scheduler_queued", len(self.queues[p]), priority=p)
+            metrics.set_gauge("llm_scheduler_running", self.running[p], priority=p)
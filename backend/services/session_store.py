@@ -0,0 +1,287 @@
+import asyncio
+import json
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+import weakref
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class SessionTooLarge(ValueError):
+    """会话的固定部分（课程内容、用户信息等）超过了 SESSION_MAX_BYTES"""
+
+
+class SessionBackend(ABC):
+    """会话的持久化层，值为会话的 JSON 文本，ttl 秒后过期"""
+
+    @abstractmethod
+    async def load(self, session_id: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    async def save(self, session_id: str, text: str, ttl: float) -> None:
+        ...
+
+    @abstractmethod
+    async def touch(self, session_id: str, ttl: float) -> None:
+        """读取会话后延长过期时间（不重写会话内容）"""
+
+    @abstractmethod
+    async def delete(self, session_id: str) -> None:
+        ...
+
+    async def close(self) -> None:
+        pass
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """本地开发用的 SQLite 持久化层，重启后会话仍然有效"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    async def load(self, session_id: str) -> Optional[str]:
+        return await asyncio.to_thread(self._load, session_id)
+
+    async def save(self, session_id: str, text: str, ttl: float) -> None:
+        await asyncio.to_thread(self._save, session_id, text, time.time() + ttl)
+
+    async def touch(self, session_id: str, ttl: float) -> None:
+        await asyncio.to_thread(self._touch, session_id, time.time() + ttl)
+
+    async def delete(self, session_id: str) -> None:
+        await asyncio.to_thread(self._delete, session_id)
+
+    async def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _connection(self) -> sqlite3.Connection:
+        # 在 to_thread 的工作线程中调用，连接由 _lock 保护
+        if self._db is None:
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.commit()
+        return self._db
+
+    def _load(self, session_id: str) -> Optional[str]:
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT value FROM sessions WHERE id = ? AND expires_at > ?", (session_id, time.time())
+            ).fetchone()
+            return row[0] if row else None
+
+    def _save(self, session_id: str, text: str, expires_at: float) -> None:
+        with self._lock:
+            db = self._connection()
+            db.execute("INSERT OR REPLACE INTO sessions (id, value, expires_at) VALUES (?, ?, ?)", (session_id, text, expires_at))
+            db.execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),))
+            db.commit()
+
+    def _touch(self, session_id: str, expires_at: float) -> None:
+        with self._lock:
+            db = self._connection()
+            db.execute("UPDATE sessions SET expires_at = ? WHERE id = ?", (expires_at, session_id))
+            db.commit()
+
+    def _delete(self, session_id: str) -> None:
+        with self._lock:
+            db = self._connection()
+            db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            db.commit()
+
+
+class RedisSessionBackend(SessionBackend):
+    """
+    生产环境的持久化层，使用 Redis 协议兼容的存储（Redis、Valkey、KeyDB 等），多个 worker 共享会话；
+    需要安装 redis 包（可选依赖）
+    """
+
+    def __init__(self, url: str, prefix: str = "session:"):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("SESSION_BACKEND=redis requires the redis package (pip install redis)") from e
+        self.prefix = prefix
+        self._client = redis.from_url(url, decode_responses=True)
+
+    async def load(self, session_id: str) -> Optional[str]:
+        return await self._client.get(self.prefix + session_id)
+
+    async def save(self, session_id: str, text: str, ttl: float) -> None:
+        await self._client.set(self.prefix + session_id, text, ex=max(1, int(ttl)))
+
+    async def touch(self, session_id: str, ttl: float) -> None:
+        await self._client.expire(self.prefix + session_id, max(1, int(ttl)))
+
+    async def delete(self, session_id: str) -> None:
+        await self._client.delete(self.prefix + session_id)
+
+    async def close(self) -> None:
+        await self._client.close()
+
+
+class SessionStore:
+    """
+    服务端保存的课程 / 评估会话：创建时上传一次课程内容和已有的对话，之后每轮只需要 session_id 和用户输入
+
+    - 会话以 JSON 文本保存在进程内的 LRU 中（最多 max_entries 个），每次读取返回新的副本；
+      配置了 backend 时同时写入持久化层，不在内存中的会话从持久化层读取
+    - ttl 为空闲过期时间，每次读写都会延长（内存和持久化层都从最后一次访问开始计算，
+      只读取会话的请求也会延长持久化层中的过期时间）
+    - 对话超过 max_messages 条或会话超过 max_bytes 时丢弃最早的消息（保留第一条，练习模式的场景设定在其中）
+
+    会话数据的格式：{"id", "kind", "native_lang", "learning_lang", "messages": [...], 以及各接口需要的其他字段}
+    """
+
+    def __init__(self, backend: Optional[SessionBackend] = None, max_entries: int = 1000, ttl: float = 3600,
+                 max_messages: int = 200, max_bytes: int = 256 * 1024):
+        self.backend = backend
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        # 同一个会话的请求依次处理，避免并发的两轮对话互相覆盖（只在同一进程内生效）；没有请求使用时自动释放
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    async def create(self, kind: str, native_lang: str, learning_lang: str, messages: Optional[List[Dict]] = None, **data) -> Dict:
+        session = {
+            "id": secrets.token_urlsafe(16),
+            "kind": kind,
+            "native_lang": native_lang,
+            "learning_lang": learning_lang,
+            **data,
+            "messages": list(messages or [])
+        }
+        await self.save(session)
+        metrics.incr("sessions_created", kind=kind)
+        return session
+
+    async def get(self, session_id: str, kind: Optional[str] = None) -> Optional[Dict]:
+        """读取会话，不存在、已过期或类型不符时返回 None"""
+        now = time.time()
+        text = None
+        entry = self._entries.get(session_id)
+        if entry is not None:
+            expires_at, text = entry
+            if expires_at > now:
+                self._entries.move_to_end(session_id)
+                self._entries[session_id] = (now + self.ttl, text)
+            else:
+                del self._entries[session_id]
+                text = None
+        if text is None and self.backend is not None:
+            text = await self.backend.load(session_id)
+            if text is not None:
+                self._remember(session_id, text)
+        if text is None:
+            metrics.incr("session_lookups", result="miss")
+            return None
+        session = json.loads(text)
+        if kind is not None and session.get("kind") != kind:
+            metrics.incr("session_lookups", result="miss")
+            return None
+        if self.backend is not None:
+            await self.backend.touch(session_id, self.ttl)
+        metrics.incr("session_lookups", result="hit")
+        return session
+
+    async def save(self, session: Dict) -> None:
+        """保存会话（写入内存和持久化层），超过大小限制时先丢弃最早的消息"""
+        text = self._bounded_text(session)
+        self._remember(session["id"], text)
+        if self.backend is not None:
+            await self.backend.save(session["id"], text, self.ttl)
+
+    async def delete(self, session_id: str) -> None:
+        self._entries.pop(session_id, None)
+        if self.backend is not None:
+            await self.backend.delete(session_id)
+        metrics.set_gauge("session_entries", len(self._entries))
+
+    def lock(self, session_id: str) -> asyncio.Lock:
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = self._locks[session_id] = asyncio.Lock()
+        return lock
+
+    async def close(self) -> None:
+        if self.backend is not None:
+            await self.backend.close()
+
+    def _bounded_text(self, session: Dict) -> str:
+        messages = session["messages"]
+        dropped = 0
+        if self.max_messages and len(messages) > self.max_messages:
+            dropped = len(messages) - self.max_messages
+            messages = messages[:1] + messages[1 + dropped:]
+        text = json.dumps({**session, "messages": messages}, ensure_ascii=False)
+        while self.max_bytes and len(text.encode("utf-8")) > self.max_bytes:
+            if len(messages) <= 1:
+                raise SessionTooLarge(f"Session is larger than {self.max_bytes} bytes")
+            # 一次丢弃多条，避免对很长的会话逐条重新序列化
+            count = max(1, (len(messages) - 1) // 10)
+            messages = messages[:1] + messages[1 + count:]
+            dropped += count
+            text = json.dumps({**session, "messages": messages}, ensure_ascii=False)
+        if dropped:
+            session["messages"] = messages
+            metrics.incr("session_trimmed_messages", dropped)
+        return text
+
+    def _remember(self, session_id: str, text: str) -> None:
+        if self.max_entries <= 0:
+            return
+        self._entries[session_id] = (time.time() + self.ttl, text)
+        self._entries.move_to_end(session_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        metrics.set_gauge("session_entries", len(self._entries))
+
+
+_shared_store: Optional[SessionStore] = None
+
+
+def create_backend() -> Optional[SessionBackend]:
+    """
+    SESSION_BACKEND：memory（默认，只保存在进程内）、sqlite（SESSION_DB，默认 sessions.db）
+    或 redis（SESSION_REDIS_URL）
+    """
+    kind = os.getenv('SESSION_BACKEND', 'memory').lower()
+    if kind == 'sqlite':
+        return SQLiteSessionBackend(os.getenv('SESSION_DB', 'sessions.db'))
+    if kind == 'redis':
+        return RedisSessionBackend(os.getenv('SESSION_REDIS_URL', 'redis://localhost:6379/0'))
+    if kind != 'memory':
+        logger.warning(f"Unknown SESSION_BACKEND {kind}, sessions are kept in memory only")
+    return None
+
+
+def get_session_store() -> SessionStore:
+    """获取进程内共享的 SessionStore，课程和评估接口共用"""
+    global _shared_store
+    if _shared_store is None:
+        _shared_store = SessionStore(
+            backend=create_backend(),
+            max_entries=int(os.getenv('SESSION_CACHE_SIZE', '1000')),
+            ttl=float(os.getenv('SESSION_TTL', '3600')),
+            max_messages=int(os.getenv('SESSION_MAX_MESSAGES', '200')),
+            max_bytes=int(os.getenv('SESSION_MAX_BYTES', str(256 * 1024)))
+        )
+    return _shared_store
@@ -0,0 +1,175 @@
+import asyncio
+import copy
+import json
+import logging
+import os
+import random
+import time
+from typing import Dict, List, Optional, Set, Type
+
+from pydantic import BaseModel, ValidationError
+
+from services.deadline import set_deadline
+from services.json_parsing import extract_json, repair_json
+from services.llm_profiles import EndpointProfile
+from services.llm_router import create_provider
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ShadowRequest:
+    """一次影子请求，主请求结束时通过 primary_done 传入主请求的响应（失败或取消时为 None）和耗时"""
+
+    def __init__(self):
+        self._primary: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    def primary_done(self, response: Optional[Dict], seconds: float) -> None:
+        if not self._primary.done():
+            self._primary.set_result((response, seconds))
+
+    async def primary(self):
+        return await self._primary
+
+
+class ShadowTraffic:
+    """
+    影子流量：按比例把 structured_chat 请求在后台复制一份发送给候选的 provider / 模型，
+    记录双方的耗时、token 用量、JSON 能否解析和输出长度，用于在切换模型前用真实请求做对比
+
+    - 候选请求在独立的任务中运行，不等待、不影响主请求，用户只会看到主请求的响应
+    - 候选 provider 使用单独的连接池和限流器（名称为 shadow_<provider>，可以用 LLM_SHADOW_<PROVIDER>_RPM 等限制），
+      同时进行的影子请求超过 LLM_SHADOW_CONCURRENCY 时不再复制
+    - 结果按行追加到 LLM_SHADOW_LOG（JSON Lines），不记录消息和输出的内容
+
+    配置来自环境变量 LLM_SHADOW_PROVIDER、LLM_SHADOW_MODEL、LLM_SHADOW_SAMPLE、LLM_SHADOW_PROFILES、
+    LLM_SHADOW_CONCURRENCY、LLM_SHADOW_LOG，LLM_SHADOW_PROVIDER 为空或 LLM_SHADOW_SAMPLE 为 0 时关闭
+    """
+
+    def __init__(self, llm):
+        self.llm = llm
+        self.sample_rate = float(os.getenv('LLM_SHADOW_SAMPLE', '0'))
+        self.concurrency = int(os.getenv('LLM_SHADOW_CONCURRENCY', '2'))
+        self.log_path = os.getenv('LLM_SHADOW_LOG', 'shadow_traffic.jsonl')
+        # 只复制这些接口的请求（见 services/llm_profiles.py），为空时复制所有 structured_chat 请求
+        self.profiles = {name.strip() for name in os.getenv('LLM_SHADOW_PROFILES', '').split(',') if name.strip()}
+
+        self.provider = None
+        name = os.getenv('LLM_SHADOW_PROVIDER', '').strip().lower()
+        if name:
+            model = os.getenv('LLM_SHADOW_MODEL') or None
+            self.provider = create_provider(name, model, label=f"shadow_{name}")
+            if self.provider is None:
+                logger.warning(f"Unknown shadow LLM provider {name}, shadow traffic disabled")
+            elif model:
+                # 指定了候选模型时所有档位都使用该模型，否则按档位选择候选 provider 的模型
+                self.provider.tiers = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def enabled(self) -> bool:
+        return self.provider is not None and self.sample_rate > 0
+
+    def mirror(self, messages: List[Dict], profile: EndpointProfile, response_format: Optional[Dict],
+               output_model: Optional[Type[BaseModel]]) -> Optional[ShadowRequest]:
+        """
+        按采样比例在后台向候选 provider 发送相同的请求，返回 ShadowRequest；没有抽中或并发已满时返回 None
+        """
+        if not self.enabled or (self.profiles and profile.name not in self.profiles):
+            return None
+        if random.random() >= self.sample_rate:
+            return None
+        if len(self._tasks) >= self.concurrency:
+            metrics.incr("llm_shadow_requests", result="skipped")
+            return None
+        request = ShadowRequest()
+        task = asyncio.get_running_loop().create_task(self._run(request, messages, profile, response_format, output_model))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return request
+
+    async def _run(self, request: ShadowRequest, messages: List[Dict], profile: EndpointProfile,
+                   response_format: Optional[Dict], output_model: Optional[Type[BaseModel]]) -> None:
+        # 候选请求只受 profile 的超时限制，不受触发它的用户请求的截止时间限制
+        set_deadline(None)
+        # 影子请求以最低的优先级排队（见 services/scheduler.py），不和用户的请求抢并发名额
+        profile = copy.copy(profile)
+        profile.priority = "batch"
+        start = time.monotonic()
+        error = None
+        try:
+            response = await self.llm._complete_on(self.provider, messages, profile, response_format)
+        except Exception as e:
+            response, error = None, e
+        seconds = time.monotonic() - start
+        candidate = self._describe(self.provider.name, profile.model_for(self.provider, False), response, seconds, output_model)
+        if error is not None:
+            candidate["error"] = str(error)[:200]
+        metrics.incr("llm_shadow_requests", result="error" if error else "ok")
+        metrics.observe("llm_shadow_seconds", seconds, provider=self.provider.name)
+
+        primary_response, primary_seconds = await request.primary()
+        primary = self._describe(self.llm.provider, profile.model_for(self.llm.primary, True),
+                                 primary_response, primary_seconds, output_model)
+        record = {
+            "ts": round(time.time(), 3),
+            "profile": profile.name,
+            "response_format": response_format["type"] if response_format else None,
+            "primary": primary,
+            "candidate": candidate
+        }
+        if primary.get("chars") and candidate.get("chars") is not None:
+            record["size_ratio"] = round(candidate["chars"] / primary["chars"], 3)
+        if primary_seconds:
+            record["latency_ratio"] = round(seconds / primary_seconds, 3)
+        try:
+            await asyncio.to_thread(self._append, record)
+        except OSError as e:
+            logger.warning(f"Writing shadow traffic log failed: {e}")
+
+    @staticmethod
+    def _describe(provider: str, model: str, response: Optional[Dict], seconds: float,
+                  output_model: Optional[Type[BaseModel]]) -> Dict:
+        """一侧的对比数据：耗时、token 用量、输出长度、JSON 能否直接解析 / 本地修复后解析，以及是否符合 output_model"""
+        result = {"provider": provider, "model": model, "seconds": round(seconds, 3)}
+        if response is None:
+            result["parse"] = "no_response"
+            return result
+        content = response.get("content") or ""
+        usage = response.get("usage") or {}
+        result.update({
+            "prompt_tokens": usage.get("prompt_tokens"),
+            "completion_tokens": usage.get("completion_tokens"),
+            "cached_tokens": usage.get("cached_tokens"),
+            "chars": len(content)
+        })
+        try:
+            parsed, result["parse"] = extract_json(content), "ok"
+        except ValueError:
+            try:
+                parsed, _ = repair_json(content)
+                result["parse"] = "repaired"
+            except ValueError:
+                result["parse"] = "failed"
+                return result
+        if output_model is not None:
+            try:
+                output_model.model_validate(parsed)
+                result["schema_valid"] = True
+            except ValidationError:
+                result["schema_valid"] = False
+        return result
+
+    def _append(self, record: Dict) -> None:
+        directory = os.path.dirname(self.log_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    async def close(self) -> None:
+        """应用退出时取消还没有完成的影子请求"""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
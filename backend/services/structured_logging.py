@@ -0,0 +1,135 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from contextvars import ContextVar, Token
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional
+
+# 当前请求是否开启了调试日志（X-Debug-Log），由 api/request_control.py 设置
+_request_debug: ContextVar[bool] = ContextVar("request_debug", default=False)
+
+_listener: Optional[QueueListener] = None
+# 大段内容（模型的原始响应、对话记录等）的输出配置，见 setup_logging
+_payload_config = {"sample": 0.0, "max_chars": 4000, "debug_token": ""}
+
+
+class TruncatingQueueHandler(QueueHandler):
+    """
+    把日志记录放入队列，由 QueueListener 的线程写到 stdout，请求处理中不做阻塞的写操作；
+    放入队列前格式化消息（参数和异常信息），超过 max_length 的部分截断
+    """
+
+    def __init__(self, log_queue: queue.Queue, max_length: int):
+        super().__init__(log_queue)
+        self.max_length = max_length
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = super().prepare(record)
+        # log_payload 输出的内容按 LOG_PAYLOAD_MAX_CHARS 截断
+        if self.max_length and not getattr(record, "payload_label", None) and len(record.msg) > self.max_length:
+            record.msg = truncate(record.msg, self.max_length)
+        return record
+
+
+class JSONFormatter(logging.Formatter):
+    """每条日志一行 JSON，便于容器日志的收集和检索"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        if getattr(record, "payload_label", None):
+            entry["payload"] = record.payload_label
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def truncate(text: str, max_length: int) -> str:
+    if len(text) <= max_length:
+        return text
+    return f"{text[:max_length]}...(+{len(text) - max_length} chars)"
+
+
+def setup_logging() -> None:
+    """
+    配置根 logger：通过队列在后台线程写日志，在应用启动时调用一次
+
+    LOG_LEVEL: 默认级别（INFO）
+    LOG_LEVELS: 逗号分隔的各模块级别，如 services.llm_service=DEBUG,services.google_auth=WARNING
+    LOG_FORMAT: text（默认）或 json
+    LOG_MAX_LENGTH: 单条日志的最大长度，超过的部分截断（2000，0 表示不截断）
+    LOG_PAYLOAD_SAMPLE / LOG_PAYLOAD_MAX_CHARS / LOG_DEBUG_TOKEN: 见 log_payload
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    _payload_config.update(
+        sample=float(os.getenv('LOG_PAYLOAD_SAMPLE', '0')),
+        max_chars=int(os.getenv('LOG_PAYLOAD_MAX_CHARS', '4000')),
+        debug_token=os.getenv('LOG_DEBUG_TOKEN', '')
+    )
+
+    stream = logging.StreamHandler(sys.stdout)
+    if os.getenv('LOG_FORMAT', 'text').lower() == 'json':
+        stream.setFormatter(JSONFormatter())
+    else:
+        stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    log_queue: queue.Queue = queue.Queue(-1)
+    root = logging.getLogger()
+    root.handlers = [TruncatingQueueHandler(log_queue, int(os.getenv('LOG_MAX_LENGTH', '2000')))]
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+    for item in os.getenv('LOG_LEVELS', '').split(','):
+        name, _, level = item.partition('=')
+        if name.strip() and level.strip():
+            logging.getLogger(name.strip()).setLevel(level.strip().upper())
+
+    _listener = QueueListener(log_queue, stream)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging() -> None:
+    """写完队列中剩余的日志并停止后台线程"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def debug_requested(header_value: Optional[bytes]) -> bool:
+    """X-Debug-Log 头与 LOG_DEBUG_TOKEN 一致时为该请求开启调试日志，没有配置 LOG_DEBUG_TOKEN 时不开启"""
+    token = _payload_config["debug_token"]
+    return bool(token) and header_value is not None and header_value.decode("latin-1") == token
+
+
+def set_request_debug(enabled: bool) -> Token:
+    return _request_debug.set(enabled)
+
+
+def reset_request_debug(token: Token) -> None:
+    _request_debug.reset(token)
+
+
+def log_payload(logger: logging.Logger, label: str, payload: Any) -> None:
+    """
+    输出大段内容（模型的原始响应、对话记录等）：只在当前请求开启了调试日志时输出，
+    其他请求按 LOG_PAYLOAD_SAMPLE 的比例抽样输出（默认不输出）；超过 LOG_PAYLOAD_MAX_CHARS 的部分截断。
+    不输出时不会把 payload 转换为字符串
+    """
+    if not _request_debug.get():
+        sample = _payload_config["sample"]
+        if sample <= 0 or random.random() >= sample:
+            return
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    text = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False, default=str)
+    text = truncate(text, _payload_config["max_chars"])
+    logger.info(f"{label}:\n{text}", extra={"payload_label": label})
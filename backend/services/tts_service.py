@@ -2,9 +2,12 @@ import os
 import json
 import base64
 import aiohttp
+import asyncio
 from typing import List, Optional, Dict, Any
 from fastapi import HTTPException
 import logging
+from services.deadline import budget
+from services.rate_limit import UpstreamError, get_limiter, parse_retry_after
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +19,10 @@ class TTSService:
         self.api_key = os.getenv("GOOGLE_TTS_API_KEY")
         if not self.api_key:
             logger.warning("GOOGLE_TTS_API_KEY environment variable not set")
+        # 出站限流和 429/503 重试，配置见 TTS_RPM / TTS_CONCURRENCY
+        self.limiter = get_limiter("tts", concurrency=8)
+        # 单次合成请求的超时，不超过客户端请求剩余的时间（见 services/deadline.py）
+        self.request_timeout = float(os.getenv("TTS_REQUEST_TIMEOUT", "300"))
     
     async def generate_speech(
         self, 
@@ -94,25 +101,23 @@ class TTSService:
                     payload["audioConfig"]["audioSeed"] = audio_seed
                 
                 try:
-                    async with session.post(
-                        f"{self.api_url}?key={self.api_key}", 
-                        json=payload,
-                        headers=headers
-                    ) as response:
-                        if response.status != 200:
-                            error_text = await response.text()
-                            logger.error(f"Google TTS API error: {error_text}")
-                            raise HTTPException(
-                                status_code=response.status,
-                                detail=f"Google TTS API error: {error_text}"
-                            )
-                        
-                        response_data = await response.json()
-                        results.append({
-                            "audio_content": response_data.get("audioContent", ""),
-                            "text": text
-                        })
-                        
+                    response_data = await self.limiter.call(lambda: self._synthesize(session, payload, headers))
+                    results.append({
+                        "audio_content": response_data.get("audioContent", ""),
+                        "text": text
+                    })
+
+                except UpstreamError as e:
+                    # 重试后仍被限流或上游不可用，把上游的状态码返回给客户端
+                    raise HTTPException(
+                        status_code=e.status,
+                        detail=f"Google TTS API error: {str(e)}"
+                    )
+                except asyncio.TimeoutError:
+                    raise HTTPException(
+                        status_code=504,
+                        detail="Google TTS API timeout"
+                    )
                 except Exception as e:
                     logger.error(f"Error calling Google TTS API: {str(e)}")
                     raise HTTPException(
@@ -121,3 +126,17 @@ class TTSService:
                     )
         
         return results
+
+    async def _synthesize(self, session: aiohttp.ClientSession, payload: Dict, headers: Dict) -> Dict:
+        """发送一次合成请求，返回的状态码不是 200 时抛出 UpstreamError"""
+        async with session.post(
+            f"{self.api_url}?key={self.api_key}", 
+            json=payload,
+            headers=headers,
+            timeout=aiohttp.ClientTimeout(total=budget(self.request_timeout))
+        ) as response:
+            if response.status != 200:
+                error_text = await response.text()
+                logger.error(f"Google TTS API error: {error_text}")
+                raise UpstreamError(response.status, error_text, parse_retry_after(response.headers.get("Retry-After")))
+            return await response.json()
@@ -0,0 +1,57 @@
+import asyncio
+
+from services.conversation_window import ConversationWindow
+
+
+class FakeLLM:
+    def __init__(self):
+        self.calls = []
+
+    async def chat_completion(self, messages, model=None, profile=None):
+        self.calls.append(messages[-1]["content"])
+        return {"content": f"summary #{len(self.calls)}"}
+
+
+def conversation(n):
+    return [{"role": "assistant" if i % 2 == 0 else "user", "content": f"message {i}"} for i in range(n)]
+
+
+def test_short_history_is_unchanged():
+    window = ConversationWindow(FakeLLM(), keep_turns=4, block_turns=2)
+    history = conversation(7)
+    assert window.apply(history) == history
+
+
+def test_older_turns_replaced_by_background_summary():
+    llm = FakeLLM()
+    window = ConversationWindow(llm, keep_turns=4, block_turns=2)
+
+    async def run():
+        history = conversation(11)
+        # 摘要还没有生成时原样发送，不等待
+        assert window.apply(history) == history
+        await asyncio.sleep(0)
+        await asyncio.gather(*window._pending.values())
+        return window.apply(history), window.apply(conversation(12))
+
+    compressed, next_turn = asyncio.run(run())
+    # 置顶的第一条 + 摘要 + 最近的消息
+    assert compressed[0]["content"] == "message 0"
+    assert compressed[1]["content"].endswith("summary #1")
+    assert [m["content"] for m in compressed[2:]] == [f"message {i}" for i in range(7, 11)]
+    # 摘要范围还没有推进时，下一轮的前缀与这一轮相同
+    assert next_turn[:len(compressed)] == compressed
+    assert len(llm.calls) == 1 and "message 6" in llm.calls[0]
+
+
+def test_repeated_display_text_is_dropped():
+    menu = "| item | price |\n" * 30
+    history = [
+        {"role": "assistant", "content": "Here is the menu", "displayText": menu},
+        {"role": "user", "content": "A latte"},
+        {"role": "assistant", "content": "Anything else?", "displayText": menu},
+    ]
+    result = ConversationWindow(FakeLLM(), keep_turns=0).apply(history)
+    assert result[0]["displayText"] == menu
+    assert result[2]["displayText"] is None
+    assert history[2]["displayText"] == menu
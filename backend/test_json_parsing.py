@@ -0,0 +1,119 @@
+import json
+
+import pytest
+
+from services.json_parsing import IncrementalJSONParser, extract_json, repair_json
+
+LESSON_RESPONSE = '''```json
+{
+    "diagnose": [{"type": "Grammar", "description": "\\"I goes\\" 应为 \\"I go\\"", "correct": "I go"}],
+    "speechText": ["Great job!", "Let's look at {this} [example].", "Say \\"hello\\" again."],
+    "displayText": "",
+    "score": 3,
+    "done": false
+}
+```'''
+
+
+def feed_in_chunks(text, size, stream_fields=("speechText",)):
+    parser = IncrementalJSONParser(stream_fields)
+    events = []
+    for i in range(0, len(text), size):
+        events.extend(parser.feed(text[i:i + size]))
+    return events
+
+
+def test_speech_items_emitted_in_order_for_any_chunk_size():
+    for size in (1, 2, 7, 64, len(LESSON_RESPONSE)):
+        events = feed_in_chunks(LESSON_RESPONSE, size)
+        items = [e["value"] for e in events if e["type"] == "item"]
+        assert items == ["Great job!", "Let's look at {this} [example].", 'Say "hello" again.']
+        assert [e["index"] for e in events if e["type"] == "item"] == [0, 1, 2]
+
+
+def test_fields_and_done_event():
+    events = feed_in_chunks(LESSON_RESPONSE, 5)
+    fields = {e["field"]: e["value"] for e in events if e["type"] == "field"}
+    assert fields["diagnose"][0]["correct"] == "I go"
+    assert fields["displayText"] == ""
+    assert fields["score"] == 3
+    assert fields["done"] is False
+    assert events[-1]["type"] == "done"
+    assert events[-1]["value"] == json.loads(LESSON_RESPONSE[len("```json"):-len("```")])
+
+
+def test_item_available_before_document_completes():
+    parser = IncrementalJSONParser()
+    events = parser.feed('{"speechText": ["First sentence.", "Sec')
+    assert events == [{"type": "item", "field": "speechText", "index": 0, "value": "First sentence."}]
+    assert not parser.done
+
+
+def test_top_level_array_only_emits_done():
+    events = feed_in_chunks('[{"day_number": 1}, {"day_number": 2}]', 3)
+    assert events == [{"type": "done", "value": [{"day_number": 1}, {"day_number": 2}]}]
+
+
+def test_long_stream_fed_one_character_at_a_time():
+    sentences = [f'Sentence {i} with "quotes" and {{braces}}.' for i in range(2000)]
+    text = json.dumps({"speechText": sentences, "displayText": "x" * 5000})
+    parser = IncrementalJSONParser()
+    events = [event for ch in text for event in parser.feed(ch)]
+
+    assert [e["value"] for e in events if e["type"] == "item"] == sentences
+    assert events[-1] == {"type": "done", "value": json.loads(text)}
+    # 只保留还在截取中的文本，结束后不再持有输出
+    assert parser._captures == {}
+
+
+def test_extract_json_ignores_fences_and_surrounding_text():
+    assert extract_json(LESSON_RESPONSE)["speechText"][0] == "Great job!"
+    assert extract_json('好的，计划如下：\n[{"day_number": 1}]\n以上。') == [{"day_number": 1}]
+
+
+def test_extract_json_skips_brackets_that_are_not_json():
+    assert extract_json('Note [see below]: {"a": [1, 2]}') == {"a": [1, 2]}
+
+
+def test_extract_json_raises_when_no_json():
+    with pytest.raises(ValueError):
+        extract_json("no json here")
+    with pytest.raises(ValueError):
+        extract_json('{"speechText": ["cut off')
+
+
+def test_extract_json_does_not_return_fragment_of_broken_object():
+    with pytest.raises(ValueError):
+        extract_json("{'speechText': ['Hi!'], 'diagnose': []")
+
+
+@pytest.mark.parametrize("broken, expected, kind", [
+    ('{"a": [1, 2,], "b": 3,}', {"a": [1, 2], "b": 3}, "trailing_commas"),
+    ('{"a": 1,, "b": 2}', {"a": 1, "b": 2}, "extra_commas"),
+    ('{"a": 1 "b": [1 2]}', {"a": 1, "b": [1, 2]}, "missing_commas"),
+    ("{'a': 'it\\'s'}", {"a": "it's"}, "single_quotes"),
+    ('{"a": "say "hi" now"}', {"a": 'say "hi" now'}, "inner_quotes"),
+    ('{"a": "line1\nline2"}', {"a": "line1\nline2"}, "control_chars"),
+    ('{"a": "\\s+"}', {"a": "\\s+"}, "invalid_escapes"),
+    ('{"a": None, "b": True}', {"a": None, "b": True}, "python_literals"),
+    ('{a: 1, speech_text: "x"}', {"a": 1, "speech_text": "x"}, "unquoted_keys"),
+    ('{"a": 1, // 说明\n"b": 2 # 注释\n}', {"a": 1, "b": 2}, "comments"),
+    ('{"a": ["x", "y', {"a": ["x", "y"]}, "truncated"),
+])
+def test_repair_json_fixes_common_errors(broken, expected, kind):
+    value, repairs = repair_json(broken)
+    assert value == expected
+    assert kind in repairs
+
+
+def test_repair_json_keeps_valid_json_unchanged():
+    value, repairs = repair_json(LESSON_RESPONSE)
+    assert value == extract_json(LESSON_RESPONSE)
+    assert repairs == []
+
+
+def test_repair_json_raises_when_unrepairable():
+    with pytest.raises(ValueError):
+        repair_json("Sorry, I can't help with that.")
+    with pytest.raises(ValueError):
+        repair_json('{"a": @@@}')
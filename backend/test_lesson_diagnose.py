@@ -0,0 +1,88 @@
+import asyncio
+import json
+
+import pytest
+
+from services.lesson import LessonService, LessonMode
+
+LESSON = {"mode": LessonMode.PRACTICE.value, "title": "Ordering coffee"}
+HISTORY = [
+    {"role": "assistant", "content": "What would you like?", "speechText": ["What would you like?"]},
+    {"role": "user", "content": "I wants a latte"},
+]
+
+
+class FakeLLM:
+    """记录每次调用的 profile；diagnose 的调用等待 release 后才返回"""
+
+    def __init__(self):
+        self.calls = []
+        self.release = asyncio.Event()
+
+    async def structured_chat(self, messages, response_schema=None, output_model=None, profile=None, **kwargs):
+        self.calls.append((profile, messages, output_model.__name__))
+        if profile == "lesson_diagnose":
+            await self.release.wait()
+            return {"diagnose": [{"type": "Grammar", "description": "wants", "correct": "I want a latte"}], "usage": {"total_tokens": 5}}
+        return {"speechText": ["Sure."], "displayText": "", "usage": {"total_tokens": 10}}
+
+    async def stream_structured_chat(self, messages, response_schema=None, output_model=None, profile=None, **kwargs):
+        self.calls.append((profile, messages, output_model.__name__))
+        yield {"type": "item", "index": 0, "value": "Sure."}
+        yield {"type": "done", "value": {"speechText": ["Sure."], "displayText": "", "usage": {"total_tokens": 10}}}
+
+
+def test_split_reply_prompt_leaves_out_diagnose():
+    service = LessonService(llm_service=FakeLLM())
+    inline = service._build_lesson_messages(dict(LESSON), None, "I wants a latte", HISTORY)
+    split = service._build_lesson_messages(dict(LESSON), None, "I wants a latte", HISTORY, split=True)
+
+    assert "diagnose" in inline[0]["content"]
+    assert "diagnose" not in split[0]["content"]
+    assert split[1:] == inline[1:]
+
+
+def test_chat_split_returns_reply_without_waiting_for_diagnose():
+    llm = FakeLLM()
+    service = LessonService(llm_service=llm)
+
+    result = asyncio.run(service.conduct_lesson(dict(LESSON), None, "I wants a latte", HISTORY, diagnose="split"))
+
+    assert result["speechText"] == ["Sure."] and result["diagnose"] is None
+    assert [(profile, model) for profile, _, model in llm.calls] == [("lesson_turn", "LessonReply")]
+    with pytest.raises(Exception):
+        asyncio.run(service.conduct_lesson(dict(LESSON), None, "hi", HISTORY, diagnose="later"))
+
+
+def test_stream_split_sends_diagnose_event_after_reply():
+    llm = FakeLLM()
+    service = LessonService(llm_service=llm)
+
+    async def run():
+        events = []
+        async for event in service.conduct_lesson_stream(dict(LESSON), None, "I wants a latte", HISTORY, diagnose="split"):
+            events.append(event)
+            if event["type"] == "done":
+                # 老师的回复已经完整返回，诊断此时才完成
+                llm.release.set()
+        return events
+
+    events = asyncio.run(run())
+    assert [event["type"] for event in events] == ["item", "done", "diagnose"]
+    assert events[1]["value"]["diagnose"] is None
+    assert events[2]["value"]["diagnose"][0]["correct"] == "I want a latte"
+    assert {profile for profile, _, _ in llm.calls} == {"lesson_turn", "lesson_diagnose"}
+
+
+def test_diagnose_sends_recent_context_once():
+    llm = FakeLLM()
+    llm.release.set()
+    service = LessonService(llm_service=llm)
+    history = [{"role": "user", "content": f"line {i}"} for i in range(10)] + HISTORY
+
+    result = asyncio.run(service.diagnose_turn("I wants a latte", history))
+
+    assert result["diagnose"][0]["type"] == "Grammar"
+    payload = json.loads(llm.calls[0][1][1]["content"])
+    assert payload["user_message"] == "I wants a latte"
+    assert [msg["content"] for msg in payload["context"]] == ["line 7", "line 8", "line 9", "What would you like?"]
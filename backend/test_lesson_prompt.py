@@ -0,0 +1,60 @@
+from services.lesson import LessonService, LessonMode
+from services.llm_service import LLMService
+from services.prompt_format import compact, prompt_text
+
+LESSON = {"mode": LessonMode.STUDY.value, "title": "Ordering coffee", "content": {"words": ["latte", "mocha"]}}
+USER = {"name": "Lin", "age": 9, "level": "A1"}
+
+
+def build(history, lesson=LESSON, user=USER):
+    service = LessonService(llm_service=object())
+    return service._build_lesson_messages(dict(lesson), dict(user), "hi", history)
+
+
+def test_prefix_is_stable_across_turns():
+    history = [
+        {"role": "assistant", "content": "Hello!", "speechText": ["Hello!"], "displayText": "**Hello**"},
+        {"role": "user", "content": "Hi Polly"},
+    ]
+    first = build(history)
+    history += [
+        {"role": "assistant", "content": "Do you like coffee?", "speechText": ["Do you like coffee?"]},
+        {"role": "user", "content": "Yes"},
+    ]
+    second = build(history)
+
+    assert second[:len(first)] == first
+    assert [m["role"] for m in second] == ["system", "user", "assistant", "user", "assistant", "user"]
+
+
+def test_lesson_context_is_serialized_canonically():
+    reordered_lesson = dict(reversed(list(LESSON.items())))
+    reordered_user = dict(reversed(list(USER.items())))
+    history = [{"role": "user", "content": "Hi"}]
+    assert build(history)[0] == build(history, reordered_lesson, reordered_user)[0]
+    assert build(history)[0]["content"].endswith('User info: {"age":9,"level":"A1","name":"Lin"}')
+
+
+def test_cached_tokens_are_surfaced_and_merged():
+    provider = type("Provider", (), {"name": "test"})()
+    usage = LLMService._record_usage(provider, {"prompt_tokens": 100, "prompt_tokens_details": {"cached_tokens": 80}})
+    assert usage["cached_tokens"] == 80
+
+    merged = LLMService._merge_usage(usage, usage)
+    assert merged["cached_tokens"] == 160
+    assert merged["prompt_tokens_details"] == {"cached_tokens": 160}
+
+
+def test_compact_drops_empty_fields_and_indentation():
+    assert compact({"b": [1, None, ""], "a": {"c": None}, "d": "x"}) == '{"b":[1],"d":"x"}'
+    assert prompt_text("""Line one
+        indented line
+          - nested item
+
+
+        last  """) == "Line one\nindented line\n  - nested item\n\nlast"
+    assert prompt_text("""
+    {
+        "level": {{ "score": int }}
+    }
+    """) == '{\n    "level": {{ "score": int }}\n}'
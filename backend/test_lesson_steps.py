@@ -0,0 +1,154 @@
+import asyncio
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api import lesson_api
+from services.lesson import LessonService
+from services.lesson_steps import LessonStepEngine
+from services.session_store import SessionStore
+
+STEPS = [
+    {"title": "Greetings", "requires_interaction": False, "contents": [
+        {"text": "Today we learn greetings.", "speechText": "Today we learn greetings. Let's start!", "content_type": "introduction", "display_type": "text"},
+        {"text": "- Hello\n- Hi", "speechText": "Hello and hi are common.", "content_type": "concept", "display_type": "list"}]},
+    {"title": "Say hello", "requires_interaction": True, "contents": [
+        {"text": "Say: Hello, nice to meet you.", "speechText": "Now say: Hello, nice to meet you.", "content_type": "exercise", "display_type": "exercise"}]},
+    {"title": "Summary", "requires_interaction": False, "contents": [
+        {"text": "Well done.", "speechText": "Well done today.", "content_type": "summary", "display_type": "text"}]},
+]
+
+
+class FakeLLMService:
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.calls = []
+
+    async def structured_chat(self, messages, response_schema=None, output_model=None, cache=False, profile=None):
+        self.calls.append(messages)
+        return {**self.replies.pop(0), "diagnose": [], "usage": {"total_tokens": 5}}
+
+    async def stream_structured_chat(self, messages, response_schema=None, output_model=None, profile=None):
+        result = await self.structured_chat(messages)
+        for index, sentence in enumerate(result["speechText"]):
+            yield {"type": "item", "field": "speechText", "index": index, "value": sentence}
+        yield {"type": "done", "value": result}
+
+
+def lesson_client(monkeypatch, replies):
+    llm = FakeLLMService(replies)
+    service = LessonService(llm)
+    monkeypatch.setattr(lesson_api, "lesson_service", service)
+    monkeypatch.setattr(lesson_api, "step_engine", LessonStepEngine(service))
+    monkeypatch.setattr(lesson_api, "session_store", SessionStore())
+    app = FastAPI()
+    app.include_router(lesson_api.router)
+    client = TestClient(app)
+    created = client.post("/api/lesson/session", json={
+        "lesson": {"mode": "study", "lesson_info": {"title": "Greetings"}},
+        "conversation_history": [{"role": "assistant", "content": "Welcome", "speechText": ["Welcome"]}],
+        "steps": STEPS
+    }).json()
+
+    def say(text):
+        return client.post("/api/lesson/session/chat", json={"session_id": created["session_id"], "user_input": text})
+    return llm, say
+
+
+def test_explanation_steps_are_served_without_the_llm(monkeypatch):
+    llm, say = lesson_client(monkeypatch, [])
+
+    first = say("OK")
+    second = say("好的")
+
+    assert first.json()["speechText"] == ["Today we learn greetings.", "Let's start!", "Hello and hi are common."]
+    assert first.json()["displayText"] == "- Hello\n- Hi"
+    assert "X-Total-Tokens" not in first.headers
+    assert second.json()["speechText"] == ["Now say: Hello, nice to meet you."]
+    assert llm.calls == []
+
+
+def test_interactive_step_calls_the_llm_until_the_step_is_complete(monkeypatch):
+    llm, say = lesson_client(monkeypatch, [
+        {"speechText": ["Almost, say it again."], "displayText": ""},
+        {"speechText": ["Great job!"], "displayText": "<step_complete>"},
+    ])
+    say("OK")
+    say("OK")
+
+    retry = say("Hello nice meet you")
+    done = say("Hello, nice to meet you")
+
+    assert retry.json()["speechText"] == ["Almost, say it again."]
+    # 完成练习后直接接上下一个讲解步骤
+    assert done.json()["speechText"] == ["Great job!", "Well done today."]
+    assert done.json()["displayText"] == ""
+    assert len(llm.calls) == 2
+    last_user = llm.calls[0][-1]
+    assert last_user["role"] == "user" and last_user["content"].startswith("Hello nice meet you")
+    assert "[Current step 2/3]" in last_user["content"] and "<step_complete>" in last_user["content"]
+    # 系统提示与不按步骤的课程相同
+    assert llm.calls[0][0] == llm.calls[1][0]
+
+
+def test_questions_go_to_the_llm_without_advancing(monkeypatch):
+    llm, say = lesson_client(monkeypatch, [
+        {"speechText": ["Hi is more casual."], "displayText": ""},
+        {"speechText": ["It means a greeting."], "displayText": ""},
+    ])
+    say("OK")
+
+    answer = say("What is the difference between hello and hi?")
+    # 语音识别的结果没有标点，短句也不一定是确认
+    short = say("what does that mean")
+    following = say("OK.")
+
+    assert answer.json()["speechText"] == ["Hi is more casual."]
+    assert short.json()["speechText"] == ["It means a greeting."]
+    assert "[Lesson step 1/3]" in llm.calls[0][-1]["content"]
+    assert following.json()["speechText"] == ["Now say: Hello, nice to meet you."]
+    assert len(llm.calls) == 2
+
+
+def test_reply_before_the_first_step_continues_when_the_learner_is_ready(monkeypatch):
+    llm, say = lesson_client(monkeypatch, [
+        {"speechText": ["Great, let's begin!", "<step_complete>"], "displayText": "<step_complete>"},
+    ])
+
+    started = say("I am excited to learn greetings today")
+
+    assert "[Lesson step 1/3]" in llm.calls[0][-1]["content"]
+    assert started.json()["speechText"] == ["Great, let's begin!", "Today we learn greetings.", "Let's start!", "Hello and hi are common."]
+
+
+def test_interactive_step_advances_after_max_turns(monkeypatch):
+    monkeypatch.setenv("LESSON_STEP_MAX_TURNS", "2")
+    engine = LessonStepEngine(LessonService(FakeLLMService([
+        {"speechText": ["Try again."], "displayText": ""},
+        {"speechText": ["<step_complete>", "Let's move on."], "displayText": ""},
+    ])))
+    session = {"lesson": {"mode": "study"}, "user": None, "native_lang": "cmn-CN", "learning_lang": "en-US",
+               "steps": STEPS[1:], "step_state": LessonStepEngine.initial_state()}
+
+    async def run():
+        await engine.turn(session, [], "OK")
+        assert session["step_state"] == {"index": 0, "active": True, "turns": 0}
+        await engine.turn(session, [{"role": "user", "content": "Hello"}], "Hello")
+        events = [e async for e in engine.turn_stream(session, [{"role": "user", "content": "Hello"}], "Hello")]
+        assert [(e["index"], e["value"]) for e in events if e["type"] == "item"] == [(0, "Let's move on."), (1, "Well done today.")]
+        assert events[-1]["value"]["speechText"] == ["Let's move on.", "Well done today."]
+        assert session["step_state"] == {"index": 2, "active": False, "turns": 0}
+
+    asyncio.run(run())
+
+
+def test_string_speech_text_is_kept_as_one_sentence(monkeypatch):
+    llm, say = lesson_client(monkeypatch, [
+        {"speechText": "Good try. <step_complete>", "displayText": "<step_complete>"},
+    ])
+    say("OK")
+    say("OK")
+
+    done = say("Hello, nice to meet you")
+
+    assert done.json()["speechText"] == ["Good try.", "Well done today."]
@@ -0,0 +1,132 @@
+import asyncio
+
+import pytest
+
+from services import llm_router
+from services.llm_router import LLMProvider, LLMRouter, create_provider
+
+
+def make_router(*names, hedge=False):
+    router = LLMRouter([LLMProvider(name, f"http://{name}", f"{name}-model", {}, ("json_object",)) for name in names])
+    router.hedge = hedge
+    router.hedge_min_samples = 5
+    router.hedge_min_delay = 0.01
+    return router
+
+
+def warm_up(provider, latency, count=20, ok=True):
+    for _ in range(count):
+        provider.stats.record(latency, ok)
+
+
+def test_ranked_prefers_faster_and_healthy_providers():
+    router = make_router("google", "aliyun", "promptai")
+    google, aliyun, promptai = router.providers
+    assert router.ranked() == [google, aliyun, promptai]
+
+    warm_up(google, 5.0)
+    warm_up(aliyun, 1.0)
+    warm_up(promptai, 0.5, ok=False)
+    assert router.ranked() == [aliyun, google, promptai]
+
+
+def test_failover_to_next_provider():
+    router = make_router("google", "aliyun")
+    calls = []
+
+    async def call(provider):
+        calls.append(provider.name)
+        if provider.name == "google":
+            raise Exception("503")
+        return provider.name
+
+    assert asyncio.run(router.run(call)) == "aliyun"
+    assert calls == ["google", "aliyun"]
+    assert router.providers[0].stats.error_rate == 1.0
+
+
+def test_all_providers_failing_raises_last_error():
+    router = make_router("google", "aliyun")
+
+    async def call(provider):
+        raise Exception(f"{provider.name} down")
+
+    with pytest.raises(Exception, match="aliyun down"):
+        asyncio.run(router.run(call))
+
+
+def test_hedged_request_returns_first_answer_and_cancels_the_other():
+    router = make_router("google", "aliyun", hedge=True)
+    google, aliyun = router.providers
+    warm_up(google, 0.02)
+    cancelled = []
+
+    async def call(provider):
+        try:
+            await asyncio.sleep(1 if provider is google else 0.01)
+        except asyncio.CancelledError:
+            cancelled.append(provider.name)
+            raise
+        return provider.name
+
+    assert asyncio.run(router.run(call)) == "aliyun"
+    assert cancelled == ["google"]
+
+
+def test_no_hedge_when_primary_answers_within_p95():
+    router = make_router("google", "aliyun", hedge=True)
+    warm_up(router.providers[0], 0.5)
+    calls = []
+
+    async def call(provider):
+        calls.append(provider.name)
+        return provider.name
+
+    assert asyncio.run(router.run(call)) == "google"
+    assert calls == ["google"]
+
+
+def test_latency_is_tracked_per_endpoint():
+    router = make_router("google", "aliyun", hedge=True)
+    google, aliyun = router.providers
+    for _ in range(20):
+        router.record(google, 2.0, True, "lesson_turn")
+        router.record(google, 80.0, True, "total_plan")
+        router.record(aliyun, 30.0, True, "total_plan")
+
+    # 生成计划的请求不按对话的 p95 hedge
+    assert router._hedge_delay(google, "lesson_turn") == 2.0
+    assert router._hedge_delay(google, "total_plan") == 80.0
+    assert router.ranked("total_plan") == [aliyun, google]
+    assert router.ranked("lesson_turn") == [google, aliyun]
+
+
+def test_unhealthy_provider_recovers_after_errors_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(llm_router.time, "monotonic", lambda: now[0])
+    router = LLMRouter([LLMProvider(name, f"http://{name}", f"{name}-model", {}, max_age=300) for name in ("google", "aliyun")])
+    google, aliyun = router.providers
+    warm_up(google, 0.5, ok=False)
+    warm_up(aliyun, 1.0)
+    assert router.ranked() == [aliyun, google]
+
+    now[0] += 301
+    assert google.stats.error_rate == 0.0
+    assert router.ranked() == [google, aliyun]
+
+
+def test_response_format_adapted_to_provider_support():
+    provider = LLMProvider("aliyun", "http://aliyun", "qwen-plus", {}, ("json_object",))
+    schema_format = {"type": "json_schema", "json_schema": {"name": "x", "schema": {}}}
+    assert provider.adapt_response_format(schema_format) == {"type": "json_object"}
+    assert LLMProvider("promptai", "http://promptai", "m", {}).adapt_response_format(schema_format) is None
+
+
+def test_promptai_uses_the_openai_format_unless_ollama_is_configured(monkeypatch):
+    monkeypatch.delenv("PROMPTAI_API", raising=False)
+    provider = create_provider("promptai")
+    assert provider.api == "openai" and provider.response_formats == ()
+
+    monkeypatch.setenv("PROMPTAI_API", "ollama")
+    provider = create_provider("promptai")
+    assert provider.api == "ollama" and provider.response_formats == ("json_object",)
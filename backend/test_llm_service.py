@@ -0,0 +1,238 @@
+import asyncio
+import json
+
+from services.llm_cache import LLMCache, cache_key
+from services.llm_service import LLMService
+
+
+class TruncatingLLMService(LLMService):
+    """按顺序返回预设的 (content, finish_reason)，模拟达到 token 上限被截断的输出"""
+
+    def __init__(self, replies):
+        super().__init__()
+        self.replies = list(replies)
+        self.calls = []
+
+    async def _complete_once(self, provider, messages, model, response_format):
+        self.calls.append((messages, response_format))
+        content, finish_reason = self.replies.pop(0)
+        usage = {"prompt_tokens": 100, "completion_tokens": 50, "total_tokens": 150}
+        return content, usage, finish_reason
+
+
+def test_truncated_output_is_continued_and_usage_summed():
+    plan = json.dumps([{"day_number": day, "topic": f"topic {day}"} for day in range(1, 4)])
+    service = TruncatingLLMService([
+        ("```json\n" + plan[:40], "length"),
+        # 续写时重复了上一段的末尾，并重新打开了代码块
+        ("```json\n" + plan[30:70], "length"),
+        (plan[70:] + "\n```", "stop"),
+    ])
+    messages = [{"role": "user", "content": "plan"}]
+    result = asyncio.run(service.chat_completion(messages, response_format={"type": "json_object"}))
+
+    assert result["content"] == "```json\n" + plan + "\n```"
+    assert result["usage"] == {"prompt_tokens": 300, "completion_tokens": 150, "total_tokens": 450}
+    assert len(service.calls) == 3
+    continuation_messages, continuation_format = service.calls[1]
+    assert continuation_messages[-2] == {"role": "assistant", "content": "```json\n" + plan[:40]}
+    assert continuation_format is None
+
+
+def test_continuation_stops_at_budget():
+    service = TruncatingLLMService([("[1, 2", "length")] * 5)
+    service.max_continuations = 2
+    result = asyncio.run(service.chat_completion([{"role": "user", "content": "plan"}]))
+    assert len(service.calls) == 3
+    assert result["content"] == "[1, 2[1, 2[1, 2"
+
+
+def test_restarted_output_replaces_partial():
+    document = '{"speechText": ["' + "word " * 30 + '"]}'
+    service = TruncatingLLMService([(document[:80], "length"), (document, "stop")])
+    result = asyncio.run(service.chat_completion([{"role": "user", "content": "hi"}]))
+    assert result["content"] == document
+
+
+class CountingLLMService(LLMService):
+    """返回固定回复并统计 chat 请求次数"""
+
+    def __init__(self, content):
+        super().__init__()
+        self.content = content
+        self.calls = 0
+
+    async def _chat_completion(self, messages, model, response_format):
+        self.calls += 1
+        return {"role": "assistant", "content": self.content, "usage": {"total_tokens": 42}}
+
+
+def test_cache_returns_copy_with_original_usage():
+    service = CountingLLMService('{"estimated_weeks": 4, "weeks_plan": ["a"]}')
+    messages = [{"role": "user", "content": "plan"}]
+
+    async def run():
+        first = await service.structured_chat(messages, cache=True)
+        first.pop("usage")
+        second = await service.structured_chat(messages, cache=True)
+        third = await service.structured_chat(messages)
+        return second, third
+
+    second, third = asyncio.run(run())
+    assert second == {"estimated_weeks": 4, "weeks_plan": ["a"], "usage": {"total_tokens": 42}}
+    # 没有 cache=True 的调用不读缓存
+    assert third == second
+    assert service.calls == 2
+
+
+def test_unparsed_structured_result_is_not_cached():
+    service = CountingLLMService("Sorry, I can't do that.")
+    service.max_reasks = 0
+
+    async def run():
+        for _ in range(2):
+            await service.structured_chat([{"role": "user", "content": "plan"}], cache=True)
+
+    asyncio.run(run())
+    # 每次都是一次生成加一次修复请求
+    assert service.calls == 4
+
+
+def test_lru_eviction_and_ttl():
+    async def run():
+        cache = LLMCache(max_entries=2, ttl=60)
+        for key in ("a", "b", "c"):
+            await cache.set(key, key)
+        assert await cache.get("a") is None
+        assert await cache.get("c") == "c"
+
+        expired = LLMCache(max_entries=2, ttl=-1)
+        await expired.set("a", "a")
+        assert await expired.get("a") is None
+
+    asyncio.run(run())
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    db_path = str(tmp_path / "llm_cache.db")
+    key = cache_key("chat", "google", "model", [{"role": "user", "content": "hi"}], None)
+
+    async def run():
+        cache = LLMCache(max_entries=4, ttl=60, db_path=db_path)
+        await cache.set(key, {"content": "hello", "usage": {"total_tokens": 3}})
+        cache.close()
+        restarted = LLMCache(max_entries=4, ttl=60, db_path=db_path)
+        value = await restarted.get(key)
+        restarted.close()
+        return value
+
+    assert asyncio.run(run()) == {"content": "hello", "usage": {"total_tokens": 3}}
+
+
+def test_cache_key_is_canonical():
+    assert cache_key({"a": 1, "b": [1, 2]}) == cache_key({"b": [1, 2], "a": 1})
+    assert cache_key({"a": 1}) != cache_key({"a": 2})
+
+
+class SlowLLMService(LLMService):
+    """上游请求在 release 之前一直挂起，用于测试并发请求的合并"""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+        self.cancelled = 0
+        self.release = None
+
+    async def _chat_completion(self, messages, model, response_format):
+        self.calls += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return {"role": "assistant", "content": '{"estimated_weeks": 4, "weeks_plan": []}', "usage": {"total_tokens": 42}}
+
+
+def test_identical_concurrent_requests_share_one_upstream_call():
+    service = SlowLLMService()
+    messages = [{"role": "user", "content": "plan"}]
+
+    async def run():
+        service.release = asyncio.Event()
+        callers = [asyncio.ensure_future(service.structured_chat(messages)) for _ in range(3)]
+        other = asyncio.ensure_future(service.structured_chat([{"role": "user", "content": "other"}]))
+        await asyncio.sleep(0)
+        service.release.set()
+        results = await asyncio.gather(*callers, other)
+        results[0].pop("usage")
+        return results
+
+    results = asyncio.run(run())
+    assert service.calls == 2
+    assert results[1] == {"estimated_weeks": 4, "weeks_plan": [], "usage": {"total_tokens": 42}}
+    assert not service._inflight
+
+
+def test_upstream_cancelled_only_when_every_waiter_leaves():
+    service = SlowLLMService()
+    messages = [{"role": "user", "content": "plan"}]
+
+    async def run():
+        service.release = asyncio.Event()
+        first = asyncio.ensure_future(service.chat_completion(messages))
+        second = asyncio.ensure_future(service.chat_completion(messages))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        assert service.cancelled == 0
+        second.cancel()
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        assert service.cancelled == 1
+
+        # 取消后相同的请求重新发起
+        service.release.set()
+        result = await service.chat_completion(messages)
+        assert result["usage"] == {"total_tokens": 42}
+
+    asyncio.run(run())
+    assert service.calls == 2
+
+
+def test_profiles_keep_the_configured_model_and_timeout_by_default(monkeypatch):
+    monkeypatch.setenv("LLM_PROFILE_WEEKLY_PLAN_MAX_TOKENS", "4096")
+    service = LLMService()
+    provider = service.primary
+    provider.tiers = {"fast": "small-model", "large": "big-model"}
+    messages = [{"role": "user", "content": "hi"}]
+
+    profile = service.profiles.resolve("lesson_turn")
+    turn = service._payload(provider, messages, profile, None, stream=False)
+    assert turn["model"] == provider.model
+    assert "max_tokens" not in turn
+    assert profile.timeout is None
+    # 单独配置的字段仍然生效
+    assert service._payload(provider, messages, service.profiles.resolve("weekly_plan"), None, stream=False)["max_tokens"] == 4096
+
+
+def test_endpoint_profile_selects_tier_model_and_max_tokens(monkeypatch):
+    monkeypatch.setenv("LLM_PROFILE_DEFAULTS", "true")
+    monkeypatch.setenv("LLM_PROFILE_TOTAL_PLAN_MAX_TOKENS", "0")
+    service = LLMService()
+    provider = service.primary
+    provider.tiers = {"fast": "small-model", "large": "big-model"}
+    messages = [{"role": "user", "content": "hi"}]
+
+    turn = service._payload(provider, messages, service.profiles.resolve("lesson_turn"), None, stream=False)
+    assert turn["model"] == "small-model"
+    assert turn["max_tokens"] == 2048
+
+    plan = service._payload(provider, messages, service.profiles.resolve("total_plan"), None, stream=False)
+    assert plan["model"] == "big-model"
+    assert "max_tokens" not in plan
+
+    # 显式指定的模型只对主 provider 生效，其他 provider 仍按档位选择
+    custom = service.profiles.resolve("lesson_turn", model="custom-model")
+    assert service._payload(provider, messages, custom, None, stream=False)["model"] == "custom-model"
+    backup = type(provider)("backup", "http://backup", "backup-default", {}, tiers={"fast": "backup-fast"})
+    assert service._payload(backup, messages, custom, None, stream=False)["model"] == "backup-fast"
@@ -0,0 +1,67 @@
+from services.llm_router import LLMProvider
+from services.llm_service import LLMService
+from services.ollama import OllamaAPI
+
+
+def test_native_payload_sets_keep_alive_context_and_output_limit(monkeypatch):
+    monkeypatch.setenv("OLLAMA_KEEP_ALIVE", "30m")
+    monkeypatch.setenv("OLLAMA_NUM_CTX", "4096")
+    monkeypatch.setenv("LLM_PROFILE_TOTAL_PLAN_NUM_CTX", "16384")
+    monkeypatch.setenv("LLM_PROFILE_DEFAULTS", "true")
+    service = LLMService()
+    provider = LLMProvider("local", "http://local/api/chat", "qwen3:8b", {}, response_formats=("json_object",), api="ollama")
+    messages = [{"role": "user", "content": "hi"}]
+
+    turn = service._payload(provider, messages, service.profiles.resolve("lesson_turn"), {"type": "json_object"}, stream=True)
+    assert turn == {
+        "model": "qwen3:8b",
+        "messages": messages,
+        "stream": True,
+        "keep_alive": "30m",
+        "options": {"num_ctx": 4096, "num_predict": 2048},
+        "format": "json"
+    }
+
+    # 单独配置了 num_ctx 的接口覆盖全局的上下文长度
+    plan = service._payload(provider, messages, service.profiles.resolve("total_plan"), None, stream=False)
+    assert plan["options"] == {"num_ctx": 16384, "num_predict": 8192}
+    assert "format" not in plan
+
+
+def test_json_schema_is_passed_as_format(monkeypatch):
+    monkeypatch.setenv("OLLAMA_KEEP_ALIVE", "-1")
+    schema = {"type": "object", "properties": {"speechText": {"type": "string"}}}
+    payload = OllamaAPI().payload("m", [], None, None, {"type": "json_schema", "json_schema": {"schema": schema}}, False)
+    assert payload["format"] == schema
+    assert payload["keep_alive"] == -1
+    assert "num_predict" not in payload["options"]
+
+
+def test_response_usage_is_mapped_to_openai_format():
+    result = {
+        "model": "qwen3:8b",
+        "message": {"role": "assistant", "content": "[1, 2"},
+        "done": True,
+        "done_reason": "length",
+        "prompt_eval_count": 120,
+        "eval_count": 30,
+        "load_duration": 5_000_000,
+        "eval_duration": 1_500_000_000
+    }
+    content, usage, finish_reason = OllamaAPI().parse("local", result)
+    assert content == "[1, 2"
+    # done_reason 与 OpenAI 的 finish_reason 取值一致，被截断时触发续写
+    assert finish_reason == "length"
+    assert usage == {"prompt_tokens": 120, "completion_tokens": 30, "total_tokens": 150}
+
+
+def test_stream_chunks_are_ndjson():
+    assert OllamaAPI.stream_chunk(b"\n") is None
+    chunk = OllamaAPI.stream_chunk(b'{"message": {"content": "Hel"}, "done": false}\n')
+    assert chunk["message"]["content"] == "Hel"
+    try:
+        OllamaAPI.stream_chunk(b'{"error": "model not found"}')
+    except Exception as e:
+        assert "model not found" in str(e)
+    else:
+        raise AssertionError("error chunk was not raised")
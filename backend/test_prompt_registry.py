@@ -0,0 +1,92 @@
+from itertools import permutations
+
+from services.prompt_registry import LANGUAGE_NAMES, PromptRegistry, PromptTemplate
+from services.prompt_templates import TEMPLATES
+
+TEMPLATE = "You teach {target_language_name} to a {native_language_name} speaker in {mode} mode. Today is {current_date}."
+
+
+def test_compiled_prompt_is_cached_and_dynamic_params_are_filled_per_render():
+    registry = PromptRegistry([PromptTemplate("lesson", TEMPLATE, dynamic=("current_date",))])
+
+    first = registry.render("lesson", "cmn-CN", "en-US", mode="study", current_date="2024-01-01")
+    second = registry.render("lesson", "cmn-CN", "en-US", mode="study", current_date="2024-01-02")
+
+    assert first == "You teach English to a 中文 speaker in study mode. Today is 2024-01-01."
+    assert second.endswith("Today is 2024-01-02.")
+    # 动态参数不参与缓存，两次渲染共用一个编译结果
+    assert len(registry._compiled) == 1
+    registry.render("lesson", "ja-JP", "en-US", mode="study", current_date="2024-01-01")
+    registry.render("lesson", "cmn-CN", "en-US", mode="practice", current_date="2024-01-01")
+    assert len(registry._compiled) == 3
+
+
+def test_cache_is_bounded():
+    registry = PromptRegistry([PromptTemplate("lesson", TEMPLATE, dynamic=("current_date",))], max_entries=2)
+    for mode in ("a", "b", "c"):
+        registry.render("lesson", "cmn-CN", "en-US", mode=mode, current_date="2024-01-01")
+    assert len(registry._compiled) == 2
+
+
+def test_version_is_selected_by_env_and_falls_back_to_v1(monkeypatch):
+    templates = [
+        PromptTemplate("turn", "long {target_language_name}", variant="study"),
+        PromptTemplate("turn", "long practice", variant="practice"),
+        PromptTemplate("turn", "short {target_language_name}", variant="study", version="v2"),
+    ]
+    monkeypatch.setenv("PROMPT_VERSION_TURN", "v2")
+    registry = PromptRegistry(templates)
+
+    assert registry.render("turn", "cmn-CN", "fr-FR", variant="study") == "short French"
+    # v2 没有 practice 的写法时使用 v1
+    assert registry.render("turn", "cmn-CN", "fr-FR", variant="practice") == "long practice"
+    assert registry.render("turn", "cmn-CN", "fr-FR", variant="study", version="v1") == "long French"
+
+
+def test_every_template_renders_for_all_language_pairs():
+    registry = PromptRegistry(TEMPLATES)
+    params = {"mode": "practice", "current_date": "2024-01-01", "english_level": 3,
+              "learning_goals": "travel", "study_time_per_day": 30,
+              "position": "1/2", "step": "Ordering a drink"}
+    for (name, version, variant) in registry.templates:
+        for native_lang, learning_lang in permutations(LANGUAGE_NAMES, 2):
+            text = registry.render(name, native_lang, learning_lang, variant=variant, version=version, **params)
+            assert "\x00" not in text
+            assert "{native_language_name}" not in text and "{target_language_name}" not in text
+
+
+def test_total_plan_renders_with_structured_user_data():
+    registry = PromptRegistry(TEMPLATES)
+    profile = {"english_level": {"cefr": "A2"}, "learning_goals": ["travel", "work"], "study_time_per_day": 30}
+
+    for variant in ("en", "zh"):
+        first = registry.render("total_plan", "cmn-CN", "en-US", variant=variant, **profile)
+        again = registry.render("total_plan", "cmn-CN", "en-US", variant=variant, **{**profile, "learning_goals": ["exam"]})
+        assert "\x00" not in first and "\x00" not in again
+    assert "['travel', 'work']" in first and "['exam']" in again
+    # 用户档案的字段在两种写法中都是动态参数，不会为每个用户编译一份
+    assert len(registry._compiled) == 2
+
+
+def test_unhashable_static_params_are_cached_by_value():
+    registry = PromptRegistry([PromptTemplate("lesson", "{target_language_name}: {lesson}")])
+
+    first = registry.render("lesson", "cmn-CN", "en-US", lesson={"title": "Greetings", "tags": ["a"]})
+    registry.render("lesson", "cmn-CN", "en-US", lesson={"tags": ["a"], "title": "Greetings"})
+    other = registry.render("lesson", "cmn-CN", "en-US", lesson={"title": "Food"})
+
+    assert first == "English: {'title': 'Greetings', 'tags': ['a']}"
+    assert other == "English: {'title': 'Food'}"
+    assert len(registry._compiled) == 2
+
+
+def test_templates_have_no_leftover_source_indentation():
+    # 缩进只用于 JSON 和列表的嵌套：每行最多比上一行多缩进一级，整段源码缩进的文字会超过
+    for template in TEMPLATES:
+        previous = 0
+        for line in template.text.splitlines():
+            if not line.strip():
+                continue
+            indent = len(line) - len(line.lstrip(" "))
+            assert indent <= previous + 4, f"{template.name}/{template.variant}: {line[:40]!r}"
+            previous = indent
@@ -0,0 +1,89 @@
+import asyncio
+import time
+from email.utils import formatdate
+
+import pytest
+
+from services import rate_limit
+from services.rate_limit import RetryBudget, TokenBucket, UpstreamError, UpstreamLimiter, parse_retry_after
+
+
+@pytest.fixture(autouse=True)
+def fresh_retry_budget(monkeypatch):
+    monkeypatch.setattr(rate_limit, "retry_budget", RetryBudget())
+
+
+def flaky(failures):
+    """前几次调用抛出 failures 中的错误，之后返回调用次数"""
+    calls = []
+
+    async def request():
+        calls.append(time.monotonic())
+        if len(calls) <= len(failures):
+            raise failures[len(calls) - 1]
+        return len(calls)
+
+    return request, calls
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    assert 8 < parse_retry_after(formatdate(time.time() + 10, usegmt=True)) <= 10
+
+
+def test_retries_throttled_request_honoring_retry_after():
+    limiter = UpstreamLimiter("test", max_retries=2, base_delay=0.01)
+    request, calls = flaky([UpstreamError(429, "slow down", retry_after=0.05), UpstreamError(503, "unavailable")])
+    assert asyncio.run(limiter.call(request)) == 3
+    assert calls[1] - calls[0] >= 0.05
+
+
+def test_non_retryable_errors_and_long_retry_after_are_not_retried():
+    limiter = UpstreamLimiter("test", max_retries=2, max_delay=1)
+    for error in (UpstreamError(400, "bad request"), UpstreamError(429, "quota", retry_after=60), ValueError("bug"),
+                  asyncio.TimeoutError()):
+        request, calls = flaky([error])
+        with pytest.raises(type(error)):
+            asyncio.run(limiter.call(request))
+        assert len(calls) == 1
+
+
+def test_retry_budget_limits_retries(monkeypatch):
+    monkeypatch.setattr(rate_limit, "retry_budget", RetryBudget(ratio=0, min_per_second=0, max_tokens=1))
+    limiter = UpstreamLimiter("test", max_retries=5, base_delay=0)
+    request, calls = flaky([UpstreamError(503, "down")] * 5)
+    with pytest.raises(UpstreamError):
+        asyncio.run(limiter.call(request))
+    # 预算只够一次重试
+    assert len(calls) == 2
+
+
+def test_concurrency_cap():
+    limiter = UpstreamLimiter("test", concurrency=2)
+    running = []
+    peak = []
+
+    async def request():
+        running.append(1)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.pop()
+
+    async def run():
+        await asyncio.gather(*(limiter.call(request) for _ in range(6)))
+
+    asyncio.run(run())
+    assert max(peak) == 2
+
+
+def test_token_bucket_waits_for_refill():
+    async def run():
+        bucket = TokenBucket(per_minute=600)  # 每秒 10 个
+        bucket.tokens = 0
+        start = time.monotonic()
+        await bucket.acquire(1)
+        return time.monotonic() - start
+
+    assert 0.08 <= asyncio.run(run()) < 0.5
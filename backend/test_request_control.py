@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api import lesson_api
+from api.request_control import RequestControlMiddleware
+from services import deadline
+from services.lesson import LessonService
+from services.llm_service import LLMService
+
+
+def http_scope(headers=(), method="POST"):
+    return {"type": "http", "method": method, "path": "/api/lesson/chat", "headers": list(headers)}
+
+
+def run(app, scope, disconnect_after=None):
+    """执行中间件，返回发送的消息；disconnect_after 秒后模拟客户端断开"""
+    sent = []
+    messages = [{"type": "http.request", "body": b"{}", "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        if disconnect_after is None:
+            await asyncio.Event().wait()
+        await asyncio.sleep(disconnect_after)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(RequestControlMiddleware(app)(scope, receive, send))
+    return sent
+
+
+def test_client_disconnect_cancels_handler():
+    events = []
+
+    async def app(scope, receive, send):
+        await receive()
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            events.append("cancelled")
+            raise
+
+    assert run(app, http_scope(), disconnect_after=0.01) == []
+    assert events == ["cancelled"]
+
+
+@pytest.mark.parametrize("scope", [http_scope(method="GET"), http_scope([(b"content-length", b"0")])])
+def test_disconnect_cancels_handler_that_never_reads_an_empty_body(scope):
+    events = []
+
+    async def app(scope, receive, send):
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            events.append("cancelled")
+            raise
+
+    assert run(app, scope, disconnect_after=0.01) == []
+    assert events == ["cancelled"]
+
+
+def test_empty_body_is_still_delivered_to_the_app():
+    received = []
+
+    async def app(scope, receive, send):
+        received.append(await receive())
+
+    run(app, http_scope(method="GET"))
+    assert received == [{"type": "http.request", "body": b"{}", "more_body": False}]
+
+
+def test_deadline_header_limits_upstream_budget_and_returns_504():
+    budgets = []
+
+    async def app(scope, receive, send):
+        await receive()
+        budgets.append(deadline.budget(180))
+        await asyncio.sleep(5)
+
+    sent = run(app, http_scope([(b"x-request-timeout", b"0.05")]))
+    assert 0 < budgets[0] <= 0.05
+    assert sent[0]["status"] == 504
+
+
+def test_budget_without_deadline_and_after_expiry():
+    assert deadline.budget(30) == 30
+
+    async def expired():
+        deadline.set_deadline(0)
+        await asyncio.sleep(0.001)
+        deadline.budget(30)
+
+    with pytest.raises(deadline.DeadlineExceeded):
+        asyncio.run(expired())
+
+
+def test_deadline_exceeded_upstream_returns_504_from_the_api(monkeypatch):
+    llm = LLMService()
+
+    async def expired(call, endpoint=None):
+        raise deadline.DeadlineExceeded("Request deadline exceeded")
+
+    monkeypatch.setattr(llm.router, "run", expired)
+    monkeypatch.setattr(lesson_api, "lesson_service", LessonService(llm))
+    app = FastAPI()
+    app.add_middleware(RequestControlMiddleware)
+    app.include_router(lesson_api.router)
+
+    response = TestClient(app).post("/api/lesson/chat", json={
+        "lesson": {"mode": "practice", "lesson_info": {"title": "Cafe"}},
+        "user_input": "A latte"
+    })
+
+    assert response.status_code == 504
+    assert response.json() == {"detail": "Request deadline exceeded"}
@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+
+from services.deadline import DeadlineExceeded, reset_deadline, set_deadline
+from services.scheduler import PriorityScheduler
+
+
+async def _hold(scheduler, priority, order, release):
+    async with scheduler.slot(priority):
+        order.append(priority)
+        await release.wait()
+
+
+def test_interactive_request_goes_ahead_of_queued_batch_work():
+    scheduler = PriorityScheduler(concurrency=1, shares={"batch": 1.0, "report": 1.0, "interactive": 1.0}, aging=60)
+    order = []
+
+    async def run():
+        release = asyncio.Event()
+        first = asyncio.ensure_future(_hold(scheduler, "batch", order, release))
+        await asyncio.sleep(0)
+        queued = [asyncio.ensure_future(_hold(scheduler, "batch", order, release)) for _ in range(3)]
+        await asyncio.sleep(0)
+        turn = asyncio.ensure_future(_hold(scheduler, "interactive", order, release))
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(first, turn, *queued)
+
+    asyncio.run(run())
+    assert order == ["batch", "interactive", "batch", "batch", "batch"]
+
+
+def test_weighted_fair_share_and_aging():
+    scheduler = PriorityScheduler(concurrency=1, weights={"interactive": 3, "report": 1, "batch": 1},
+                                  shares={"interactive": 1.0, "report": 1.0, "batch": 1.0}, aging=60)
+    order = []
+
+    async def run():
+        gate = asyncio.Event()
+        blocker = asyncio.ensure_future(_hold(scheduler, "report", [], gate))
+        await asyncio.sleep(0)
+        release = asyncio.Event()
+        release.set()
+        waiters = [asyncio.ensure_future(_hold(scheduler, p, order, release))
+                   for p in ["batch"] * 2 + ["interactive"] * 6]
+        await asyncio.sleep(0)
+        gate.set()
+        await asyncio.gather(blocker, *waiters)
+
+    asyncio.run(run())
+    # 低优先级的请求按权重穿插执行，不会等到高优先级的队列清空
+    assert order.index("batch") < 5
+    assert order.count("batch") == 2
+
+    scheduler = PriorityScheduler(concurrency=1, shares={"interactive": 1.0, "report": 1.0, "batch": 1.0}, aging=0)
+    order = []
+
+    async def run_aged():
+        gate = asyncio.Event()
+        blocker = asyncio.ensure_future(_hold(scheduler, "report", [], gate))
+        await asyncio.sleep(0)
+        release = asyncio.Event()
+        release.set()
+        waiters = [asyncio.ensure_future(_hold(scheduler, p, order, release)) for p in ("batch", "interactive")]
+        await asyncio.sleep(0)
+        gate.set()
+        await asyncio.gather(blocker, *waiters)
+
+    asyncio.run(run_aged())
+    # 超过老化时间后按入队顺序
+    assert order == ["batch", "interactive"]
+
+
+def test_batch_share_keeps_capacity_for_interactive():
+    scheduler = PriorityScheduler(concurrency=4, aging=60)
+    started = []
+
+    async def run():
+        release = asyncio.Event()
+        batch = [asyncio.ensure_future(_hold(scheduler, "batch", started, release)) for _ in range(4)]
+        await asyncio.sleep(0)
+        # batch 最多占一半的名额
+        assert started.count("batch") == 2
+        turn = asyncio.ensure_future(_hold(scheduler, "interactive", started, release))
+        await asyncio.sleep(0)
+        assert "interactive" in started
+        release.set()
+        await asyncio.gather(turn, *batch)
+
+    asyncio.run(run())
+    assert scheduler.active == 0
+
+
+def test_cancelled_and_expired_waiters_leave_the_queue():
+    scheduler = PriorityScheduler(concurrency=1, aging=60)
+
+    async def run():
+        release = asyncio.Event()
+        holder = asyncio.ensure_future(_hold(scheduler, "interactive", [], release))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(_hold(scheduler, "report", [], release))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert not scheduler.queues["report"]
+
+        token = set_deadline(0.01)
+        try:
+            with pytest.raises(DeadlineExceeded):
+                async with scheduler.slot("report"):
+                    pass
+        finally:
+            reset_deadline(token)
+        assert not scheduler.queues["report"]
+
+        release.set()
+        await holder
+
+    asyncio.run(run())
+    assert scheduler.active == 0
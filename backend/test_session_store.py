@@ -0,0 +1,138 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api import lesson_api
+from services import session_store as session_module
+from services.session_store import SessionStore, SessionTooLarge, SQLiteSessionBackend
+
+
+def test_sessions_are_copied_typed_and_expire(monkeypatch):
+    store = SessionStore(ttl=60)
+    now = [1000.0]
+    monkeypatch.setattr(session_module.time, "time", lambda: now[0])
+
+    async def run():
+        session = await store.create("lesson", "cmn-CN", "en-US", [{"role": "assistant", "content": "Hi"}], lesson={"mode": "study"})
+        loaded = await store.get(session["id"], "lesson")
+        loaded["messages"].append({"role": "user", "content": "changed"})
+        assert len((await store.get(session["id"]))["messages"]) == 1
+        assert await store.get(session["id"], "assessment") is None
+
+        # 空闲时间从最后一次访问开始计算
+        now[0] += 50
+        assert await store.get(session["id"]) is not None
+        now[0] += 50
+        assert await store.get(session["id"]) is not None
+        now[0] += 61
+        assert await store.get(session["id"]) is None
+
+    asyncio.run(run())
+
+
+def test_history_is_bounded_and_keeps_the_first_message():
+    store = SessionStore(max_messages=5, max_bytes=2000)
+
+    async def run():
+        session = await store.create("lesson", "cmn-CN", "en-US", [{"role": "assistant", "content": "scenario"}])
+        session["messages"] += [{"role": "user", "content": f"turn {i}"} for i in range(10)]
+        await store.save(session)
+        contents = [m["content"] for m in (await store.get(session["id"]))["messages"]]
+        assert contents == ["scenario", "turn 6", "turn 7", "turn 8", "turn 9"]
+
+        session["messages"] += [{"role": "user", "content": "x" * 600} for _ in range(3)]
+        await store.save(session)
+        assert len(str((await store.get(session["id"]))["messages"])) < 2000
+
+        with pytest.raises(SessionTooLarge):
+            await store.create("lesson", "cmn-CN", "en-US", lesson={"text": "x" * 3000})
+
+    asyncio.run(run())
+
+
+def test_evicted_sessions_are_reloaded_from_the_backend(tmp_path):
+    store = SessionStore(backend=SQLiteSessionBackend(str(tmp_path / "sessions.db")), max_entries=1)
+
+    async def run():
+        first = await store.create("assessment", "", "en-US", [{"role": "user", "content": "hello"}])
+        await store.create("assessment", "", "en-US")
+        assert first["id"] not in store._entries
+        assert (await store.get(first["id"], "assessment"))["messages"] == [{"role": "user", "content": "hello"}]
+        await store.delete(first["id"])
+        assert await store.get(first["id"]) is None
+        await store.close()
+
+    asyncio.run(run())
+
+
+class FakeLessonService:
+    def __init__(self):
+        self.histories = []
+
+    async def conduct_lesson(self, lesson_content, user=None, user_message=None, conversation_history=None, native_lang="cmn-CN", learning_lang="en-US", diagnose=None):
+        self.histories.append([m["content"] for m in conversation_history])
+        return {"speechText": [f"Reply {len(self.histories)}"], "displayText": "", "diagnose": [], "usage": {"total_tokens": 3}}
+
+
+def test_session_chat_only_needs_the_new_input(monkeypatch):
+    service = FakeLessonService()
+    monkeypatch.setattr(lesson_api, "lesson_service", service)
+    monkeypatch.setattr(lesson_api, "session_store", SessionStore())
+    app = FastAPI()
+    app.include_router(lesson_api.router)
+    client = TestClient(app)
+
+    created = client.post("/api/lesson/session", json={
+        "lesson": {"mode": "practice", "lesson_info": {"title": "Cafe"}},
+        "conversation_history": [{"role": "assistant", "content": "Welcome", "speechText": ["Welcome"]}]
+    }).json()
+    session_id = created["session_id"]
+
+    first = client.post("/api/lesson/session/chat", json={"session_id": session_id, "user_input": "A latte"})
+    second = client.post("/api/lesson/session/chat", json={"session_id": session_id, "user_input": "Thanks"})
+
+    assert first.json() == {"role": "assistant", "content": "Reply 1", "speechText": ["Reply 1"], "displayText": "", "diagnose": []}
+    assert first.headers["X-Total-Tokens"] == "3"
+    assert second.status_code == 200
+    assert service.histories == [["Welcome", "A latte"], ["Welcome", "A latte", "Reply 1", "Thanks"]]
+    history = client.get(f"/api/lesson/session/{session_id}").json()["conversation_history"]
+    assert [m["content"] for m in history] == ["Welcome", "A latte", "Reply 1", "Thanks", "Reply 2"]
+    assert client.post("/api/lesson/session/chat", json={"session_id": "missing", "user_input": "Hi"}).status_code == 404
+
+
+def test_session_chat_that_cannot_be_saved_returns_413(monkeypatch):
+    monkeypatch.setattr(lesson_api, "lesson_service", FakeLessonService())
+    monkeypatch.setattr(lesson_api, "session_store", SessionStore(max_bytes=1000))
+    app = FastAPI()
+    app.include_router(lesson_api.router)
+    client = TestClient(app)
+    session_id = client.post("/api/lesson/session", json={
+        "lesson": {"mode": "practice", "lesson_info": {"title": "Cafe"}}
+    }).json()["session_id"]
+
+    # 没有开场消息时只剩这一轮的用户输入，仍然超过大小限制
+    response = client.post("/api/lesson/session/chat", json={"session_id": session_id, "user_input": "x" * 2000})
+
+    assert response.status_code == 413
+    assert client.get(f"/api/lesson/session/{session_id}").json()["conversation_history"] == []
+
+
+def test_reads_extend_the_expiry_in_the_backend(tmp_path, monkeypatch):
+    # max_entries=0 时不缓存在内存中，每次都从持久化层读取
+    store = SessionStore(backend=SQLiteSessionBackend(str(tmp_path / "sessions.db")), max_entries=0, ttl=60)
+    now = [1000.0]
+    monkeypatch.setattr(session_module.time, "time", lambda: now[0])
+
+    async def run():
+        session = await store.create("lesson", "cmn-CN", "en-US")
+        now[0] += 50
+        assert await store.get(session["id"]) is not None
+        now[0] += 50
+        assert await store.get(session["id"]) is not None
+        now[0] += 61
+        assert await store.get(session["id"]) is None
+        await store.close()
+
+    asyncio.run(run())
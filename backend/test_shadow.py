@@ -0,0 +1,79 @@
+import asyncio
+import json
+
+from models.output_models import LessonTurn
+from services.llm_service import LLMService
+
+
+class ShadowedLLMService(LLMService):
+    """主 provider 返回合法的 JSON，候选 provider 返回被截断的 JSON"""
+
+    async def _complete_on(self, provider, messages, profile, response_format):
+        if provider.name.startswith("shadow_"):
+            await asyncio.sleep(0.01)
+            content = '{"speechText": ["Hi"], "displayText": "Hi'
+            usage = {"prompt_tokens": 100, "completion_tokens": 8, "total_tokens": 108}
+        else:
+            content = json.dumps({"diagnose": [], "speechText": ["Hello there"], "displayText": "Hello there"})
+            usage = {"prompt_tokens": 100, "completion_tokens": 16, "total_tokens": 116}
+        return {"role": "assistant", "content": content, "usage": usage}
+
+
+def _enable_shadow(monkeypatch, tmp_path, **env):
+    monkeypatch.setenv("LLM_SHADOW_PROVIDER", "aliyun")
+    monkeypatch.setenv("LLM_SHADOW_MODEL", "qwen-turbo")
+    monkeypatch.setenv("LLM_SHADOW_SAMPLE", "1")
+    monkeypatch.setenv("LLM_SHADOW_LOG", str(tmp_path / "shadow" / "log.jsonl"))
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+
+
+def test_shadow_request_is_logged_without_affecting_primary(monkeypatch, tmp_path):
+    _enable_shadow(monkeypatch, tmp_path)
+    service = ShadowedLLMService()
+    messages = [{"role": "user", "content": "hi"}]
+
+    async def run():
+        result = await service.structured_chat(messages, output_model=LessonTurn, profile="lesson_turn")
+        # 主请求返回时候选请求还在进行
+        assert len(service.shadow._tasks) == 1
+        await asyncio.gather(*service.shadow._tasks)
+        return result
+
+    result = asyncio.run(run())
+    assert result["speechText"] == ["Hello there"]
+
+    records = [json.loads(line) for line in (tmp_path / "shadow" / "log.jsonl").read_text().splitlines()]
+    assert len(records) == 1
+    record = records[0]
+    assert record["profile"] == "lesson_turn"
+    assert record["primary"]["parse"] == "ok"
+    assert record["primary"]["schema_valid"] is True
+    assert record["primary"]["completion_tokens"] == 16
+    assert record["candidate"]["provider"] == "shadow_aliyun"
+    assert record["candidate"]["model"] == "qwen-turbo"
+    assert record["candidate"]["parse"] == "repaired"
+    assert record["size_ratio"] < 1
+
+
+def test_shadow_respects_profiles_and_concurrency(monkeypatch, tmp_path):
+    _enable_shadow(monkeypatch, tmp_path, LLM_SHADOW_PROFILES="lesson_turn", LLM_SHADOW_CONCURRENCY="1")
+    service = ShadowedLLMService()
+    turn = service.profiles.resolve("lesson_turn")
+
+    async def run():
+        assert service.shadow.mirror([], service.profiles.resolve("total_plan"), None, None) is None
+        first = service.shadow.mirror([], turn, None, None)
+        assert first is not None
+        assert service.shadow.mirror([], turn, None, None) is None
+        first.primary_done(None, 0.5)
+        await asyncio.gather(*service.shadow._tasks)
+
+    asyncio.run(run())
+    record = json.loads((tmp_path / "shadow" / "log.jsonl").read_text())
+    assert record["primary"]["parse"] == "no_response"
+
+
+def test_shadow_disabled_by_default(monkeypatch):
+    monkeypatch.delenv("LLM_SHADOW_PROVIDER", raising=False)
+    assert not LLMService().shadow.enabled
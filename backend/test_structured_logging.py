@@ -0,0 +1,50 @@
+import logging
+import queue
+
+from services import structured_logging
+from services.structured_logging import TruncatingQueueHandler, log_payload, reset_request_debug, set_request_debug
+
+logger = logging.getLogger("test_structured_logging")
+
+
+def test_payload_only_logged_for_debug_requests(caplog, monkeypatch):
+    monkeypatch.setitem(structured_logging._payload_config, "max_chars", 10)
+    caplog.set_level(logging.INFO)
+
+    log_payload(logger, "LLM response", "x" * 50)
+    assert not caplog.records
+
+    token = set_request_debug(True)
+    try:
+        log_payload(logger, "LLM response", {"speechText": ["a" * 50]})
+    finally:
+        reset_request_debug(token)
+    assert len(caplog.records) == 1
+    assert caplog.records[0].getMessage() == 'LLM response:\n{"speechTe...(+60 chars)'
+    assert caplog.records[0].payload_label == "LLM response"
+
+
+def test_payload_sampling(caplog, monkeypatch):
+    monkeypatch.setitem(structured_logging._payload_config, "sample", 1.0)
+    caplog.set_level(logging.INFO)
+    log_payload(logger, "Lesson last message", {"role": "user", "content": "hi"})
+    assert len(caplog.records) == 1
+
+
+def test_queue_handler_formats_and_truncates_before_enqueue():
+    log_queue = queue.Queue()
+    handler = TruncatingQueueHandler(log_queue, max_length=20)
+    record = logging.LogRecord("x", logging.INFO, __file__, 1, "value: %s", ("y" * 100,), None)
+    handler.emit(record)
+    queued = log_queue.get_nowait()
+    assert queued.args is None
+    assert queued.msg == "value: " + "y" * 13 + "...(+87 chars)"
+
+
+def test_debug_header_requires_configured_token(monkeypatch):
+    monkeypatch.setitem(structured_logging._payload_config, "debug_token", "")
+    assert not structured_logging.debug_requested(b"anything")
+    monkeypatch.setitem(structured_logging._payload_config, "debug_token", "s3cret")
+    assert structured_logging.debug_requested(b"s3cret")
+    assert not structured_logging.debug_requested(b"wrong")
+    assert not structured_logging.debug_requested(None)
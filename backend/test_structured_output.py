@@ -0,0 +1,104 @@
+import asyncio
+import json
+
+from models.output_models import LessonTurn, WeeklyPlan
+from services.llm_service import LLMService
+
+USAGE = {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15}
+
+
+class FakeLLMService(LLMService):
+    """按顺序返回预设的回复，并记录每次调用的消息"""
+
+    def __init__(self, replies):
+        super().__init__()
+        self.replies = list(replies)
+        self.calls = []
+
+    async def chat_completion(self, messages, model=None, response_format=None, profile=None):
+        self.calls.append(messages)
+        return {"role": "assistant", "content": self.replies.pop(0), "usage": dict(USAGE)}
+
+
+def structured_chat(service, output_model):
+    messages = [{"role": "system", "content": "format"}, {"role": "user", "content": "hi"}]
+    return asyncio.run(service.structured_chat(messages, output_model=output_model))
+
+
+def test_valid_response_needs_no_reask():
+    service = FakeLLMService(['{"diagnose": [], "speechText": ["Hi!"], "displayText": ""}'])
+    result = structured_chat(service, LessonTurn)
+    assert result["speechText"] == ["Hi!"]
+    assert len(service.calls) == 1
+
+
+def test_optional_fields_missing_need_no_reask():
+    service = FakeLLMService(['{"speechText": ["Hi!"]}'])
+    result = structured_chat(service, LessonTurn)
+    assert result["speechText"] == ["Hi!"]
+    assert len(service.calls) == 1
+
+
+def test_reask_only_for_invalid_fields():
+    service = FakeLLMService([
+        '{"diagnose": [{"type": "Grammar"}], "speechText": "Hi!", "displayText": "keep me"}',
+        '{"diagnose": [{"type": "Grammar", "description": "d", "correct": "c"}], "speechText": ["Hi!"], "displayText": "ignored"}',
+    ])
+    result = structured_chat(service, LessonTurn)
+    assert result["speechText"] == ["Hi!"]
+    assert result["diagnose"][0]["correct"] == "c"
+    # 只接受追问的字段，其他字段保持原样
+    assert result["displayText"] == "keep me"
+    assert result["usage"]["total_tokens"] == 30
+
+    reask = service.calls[1]
+    assert json.loads(reask[-2]["content"])["displayText"] == "keep me"
+    assert "diagnose" in reask[-1]["content"] and "speechText" in reask[-1]["content"]
+    assert "displayText" not in reask[-1]["content"]
+
+
+def test_reask_replaces_invalid_array_items():
+    day = {"day_number": 1, "topic": "t", "scenarios": [], "knowledge_points": [], "practice": [], "estimated_time": 30}
+    broken = dict(day, day_number=2)
+    del broken["topic"]
+    service = FakeLLMService([
+        json.dumps([day, broken]),
+        json.dumps({"1": dict(day, day_number=2), "0": {"day_number": 99}}),
+    ])
+    result = structured_chat(service, WeeklyPlan)
+    assert result["content"] == [day, dict(day, day_number=2)]
+
+
+def test_json_repair_call_usage_is_counted():
+    service = FakeLLMService(["not json", '{"diagnose": [], "speechText": ["Hi!"], "displayText": ""}'])
+    result = structured_chat(service, LessonTurn)
+    assert result["speechText"] == ["Hi!"]
+    assert result["usage"]["total_tokens"] == 30
+
+
+def test_still_invalid_result_is_returned_after_reasks():
+    service = FakeLLMService(['{"speechText": "Hi!"}', "not json"])
+    result = structured_chat(service, LessonTurn)
+    assert result["speechText"] == "Hi!"
+    assert len(service.calls) == 2
+
+
+def test_scalar_json_result_is_wrapped_in_an_object():
+    # 本地修复或模型修复后的结果可能是字符串、数字等，调用方始终拿到一个对象
+    for value in ("Hi!", 42, None, [1, 2]):
+        assert LLMService._to_structured_result(value, USAGE) == {"content": value, "usage": USAGE}
+    assert LLMService._to_structured_result({"speechText": ["Hi!"]}, None) == {"speechText": ["Hi!"], "usage": None}
+
+
+def test_response_schemas_are_generated_from_the_models():
+    from models.output_schemas import LESSON_STEPS_SCHEMA, LESSON_TURN_SCHEMA, WEEKLY_PLAN_SCHEMA
+
+    assert LESSON_TURN_SCHEMA["title"] == "lesson_turn"
+    # 有默认值的字段不要求模型输出
+    assert LESSON_TURN_SCHEMA["required"] == ["speechText"]
+    assert LESSON_TURN_SCHEMA["properties"]["diagnose"]["items"]["properties"]["type"]["enum"][0] == "Grammar"
+    # 嵌套的模型直接展开，字段名 title 不受影响
+    step = LESSON_STEPS_SCHEMA["properties"]["steps"]["items"]
+    assert step["properties"]["title"] == {"type": "string"}
+    assert "$ref" not in json.dumps([LESSON_STEPS_SCHEMA, WEEKLY_PLAN_SCHEMA]) and "$defs" not in LESSON_STEPS_SCHEMA
+    assert WEEKLY_PLAN_SCHEMA["type"] == "array"